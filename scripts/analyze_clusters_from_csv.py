@@ -12,8 +12,10 @@ from collections import Counter
 # 增加CSV字段大小限制
 csv.field_size_limit(sys.maxsize)
 
+from gemini_client import load_genai
+
 try:
-    import google.generativeai as genai
+    genai = load_genai()  # GEMINI_BACKEND=fake时连接本地模拟服务
 except ImportError:
     print("请先安装google-generativeai: pip install google-generativeai")
     sys.exit(1)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+评估不同embedding维度（Matryoshka截断）对聚类质量和速度的影响
+- 在已缓存的embedding上，对每个维度运行cluster_analysis.py的k值扫描
+- 记录每个k的轮廓系数、惯性以及整个扫描的耗时
+- 在统一的k下，比较各维度的聚类分配与完整维度的一致性（ARI）及在完整维度空间中的轮廓系数
+
+用法:
+    python benchmark_dimensionality.py [embedding文件] [维度列表,如768,256,128,64]
+"""
+import json
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import adjusted_rand_score, silhouette_score
+
+from cluster_analysis import find_optimal_k
+from embedding_store import open_embeddings, truncate_embeddings
+
+
+def benchmark_dimensions(embeddings: np.ndarray, dims: List[int], k_range: range,
+                         sample_size: int = 10000, silhouette_size: int = 5000, seed: int = 42,
+                         n_jobs: int = 1) -> Dict:
+    """对每个维度运行k值扫描，并在完整维度的最优k下比较聚类结果"""
+    rng = np.random.RandomState(seed)
+
+    # 所有维度使用同一批采样数据，保证结果可比
+    if len(embeddings) > sample_size:
+        indices = np.sort(rng.choice(len(embeddings), sample_size, replace=False))
+        sample = np.asarray(embeddings[indices], dtype=np.float32)
+    else:
+        sample = np.asarray(embeddings, dtype=np.float32)
+    full_dim = sample.shape[1]
+    silhouette_indices = rng.choice(len(sample), min(silhouette_size, len(sample)), replace=False)
+
+    results = []
+    for dim in dims:
+        print(f"\n{'='*50}\n维度 {dim}\n{'='*50}")
+        reduced = truncate_embeddings(sample, dim)
+        start = time.time()
+        k_results = find_optimal_k(reduced, k_range, sample_size=len(reduced), n_jobs=n_jobs, seed=seed)
+        elapsed = time.time() - start
+        results.append({
+            'dim': int(min(dim, full_dim)),
+            'sweep_seconds': elapsed,
+            'best_k': k_results['best_k'],
+            'k_values': k_results['k_values'],
+            'inertias': [float(x) for x in k_results['inertias']],
+            'silhouette_scores': [float(x) for x in k_results['silhouette_scores']]
+        })
+
+    # 以完整维度（或列表中最大维度）的最优k为统一k，比较分配一致性
+    reference = max(results, key=lambda r: r['dim'])
+    common_k = reference['best_k']
+    print(f"\n在统一的k={common_k}下比较各维度的聚类分配...")
+    reference_labels = None
+    for result in sorted(results, key=lambda r: -r['dim']):
+        reduced = truncate_embeddings(sample, result['dim'])
+        start = time.time()
+        labels = MiniBatchKMeans(n_clusters=common_k, random_state=seed, batch_size=1000,
+                                 n_init=10).fit_predict(reduced)
+        result['fit_seconds_at_common_k'] = time.time() - start
+        if reference_labels is None:
+            reference_labels = labels
+        result['ari_vs_full'] = float(adjusted_rand_score(reference_labels, labels))
+        # 在完整维度空间中评估该维度得到的分配，消除不同空间轮廓系数不可比的问题
+        result['silhouette_in_full_space'] = float(silhouette_score(
+            sample[silhouette_indices], labels[silhouette_indices], metric='cosine'))
+
+    return {
+        'sample_size': len(sample),
+        'full_dim': full_dim,
+        'common_k': common_k,
+        'results': sorted(results, key=lambda r: -r['dim'])
+    }
+
+
+def print_report(report: Dict):
+    """打印对比表"""
+    print("\n" + "="*90)
+    print(f"维度对比 (样本数: {report['sample_size']}, 统一k={report['common_k']})")
+    print("="*90)
+    print(f"{'维度':>6} {'扫描耗时(s)':>12} {'最优k':>6} {'最优k轮廓系数':>14} {'统一k拟合(s)':>13} "
+          f"{'ARI':>7} {'完整空间轮廓系数':>16}")
+    for r in report['results']:
+        best_idx = r['k_values'].index(r['best_k'])
+        print(f"{r['dim']:>6} {r['sweep_seconds']:>12.2f} {r['best_k']:>6} "
+              f"{r['silhouette_scores'][best_idx]:>14.4f} {r['fit_seconds_at_common_k']:>13.2f} "
+              f"{r['ari_vs_full']:>7.4f} {r['silhouette_in_full_space']:>16.4f}")
+
+
+def main():
+    embeddings_file = "../data/output_embeddings.json"
+    dims = [768, 256, 128, 64]
+    k_range = range(2, 21)
+    output_file = "../results/dimensionality_benchmark.json"
+
+    if len(sys.argv) > 1:
+        embeddings_file = sys.argv[1]
+    if len(sys.argv) > 2:
+        dims = [int(d) for d in sys.argv[2].split(',')]
+
+    print(f"加载embedding数据: {embeddings_file}")
+    embeddings, _, _ = open_embeddings(embeddings_file)
+    print(f"共 {len(embeddings)} 条，维度 {embeddings.shape[1]}")
+
+    report = benchmark_dimensions(embeddings, dims, k_range)
+    print_report(report)
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到: {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+比较球面k-means与当前MiniBatchKMeans路径的速度和聚类质量
+- 对每个聚类引擎在同一数据上以相同的k拟合，记录拟合耗时
+- 在全部数据上计算精确余弦轮廓系数、简化轮廓系数、Davies-Bouldin、Calinski-Harabasz
+- 记录样本到（归一化）所属中心的平均余弦相似度，以及与MiniBatchKMeans分配的一致性（ARI）
+
+用法:
+    python benchmark_spherical_kmeans.py [embedding文件] [k] [样本数,0为全量]
+"""
+import json
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+from sklearn.metrics import adjusted_rand_score
+
+from cluster_analysis import CLUSTERING_ENGINES, make_kmeans
+from cluster_quality import quality_metrics
+from embedding_store import open_embeddings
+from spherical_kmeans import assign_blocked, normalize_rows
+
+
+def benchmark_engines(embeddings: np.ndarray, k: int, engines: List[str], repeats: int = 3,
+                      seed: int = 42) -> Dict:
+    """每个引擎用不同种子拟合repeats次，报告耗时与质量的均值"""
+    results = []
+    reference_labels = None
+    for engine in engines:
+        print(f"\n{'='*50}\n引擎 {engine}\n{'='*50}")
+        runs = []
+        for repeat in range(repeats):
+            model = make_kmeans(engine, k, seed + repeat)
+            start = time.time()
+            labels = model.fit_predict(embeddings)
+            elapsed = time.time() - start
+            quality = quality_metrics(embeddings, labels, k)
+            _, sims = assign_blocked(embeddings, normalize_rows(model.cluster_centers_), normalize=True)
+            run = {
+                'seed': seed + repeat,
+                'fit_seconds': elapsed,
+                'mean_cosine_to_center': float(sims.mean()),
+                'silhouette': quality['silhouette'],
+                'simplified_silhouette': quality['simplified_silhouette'],
+                'davies_bouldin': quality['davies_bouldin'],
+                'calinski_harabasz': quality['calinski_harabasz'],
+                'min_cluster_size': int(np.bincount(labels, minlength=k).min())
+            }
+            if reference_labels is None:
+                reference_labels = labels
+            run['ari_vs_reference'] = float(adjusted_rand_score(reference_labels, labels))
+            print(f"  种子 {run['seed']}: 耗时={elapsed:.2f}s, 轮廓系数={run['silhouette']:.4f}, "
+                  f"平均余弦={run['mean_cosine_to_center']:.4f}, ARI={run['ari_vs_reference']:.4f}")
+            runs.append(run)
+        summary = {key: float(np.mean([run[key] for run in runs]))
+                   for key in runs[0] if key not in ('seed', 'min_cluster_size')}
+        summary['min_cluster_size'] = min(run['min_cluster_size'] for run in runs)
+        results.append({'engine': engine, 'mean': summary, 'runs': runs})
+
+    return {
+        'n_samples': len(embeddings),
+        'dim': int(embeddings.shape[1]),
+        'k': k,
+        'reference_engine': engines[0],
+        'results': results
+    }
+
+
+def print_report(report: Dict):
+    """打印对比表"""
+    print("\n" + "="*100)
+    print(f"聚类引擎对比 (样本数: {report['n_samples']}, 维度: {report['dim']}, k={report['k']}, "
+          f"ARI参照: {report['reference_engine']}的第一次运行)")
+    print("="*100)
+    print(f"{'引擎':<22} {'耗时(s)':>9} {'平均余弦':>9} {'轮廓系数':>9} {'简化轮廓':>9} {'DB':>7} {'CH':>10} {'ARI':>7}")
+    for result in report['results']:
+        m = result['mean']
+        print(f"{result['engine']:<22} {m['fit_seconds']:>9.2f} {m['mean_cosine_to_center']:>9.4f} "
+              f"{m['silhouette']:>9.4f} {m['simplified_silhouette']:>9.4f} {m['davies_bouldin']:>7.3f} "
+              f"{m['calinski_harabasz']:>10.1f} {m['ari_vs_reference']:>7.4f}")
+
+
+def main():
+    embeddings_file = "../data/output_embeddings.json"
+    k = 10
+    sample_size = 0
+    output_file = "../results/spherical_kmeans_benchmark.json"
+
+    if len(sys.argv) > 1:
+        embeddings_file = sys.argv[1]
+    if len(sys.argv) > 2:
+        k = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        sample_size = int(sys.argv[3])
+
+    print(f"加载embedding数据: {embeddings_file}")
+    embeddings, _, _ = open_embeddings(embeddings_file)
+    if sample_size and len(embeddings) > sample_size:
+        indices = np.sort(np.random.RandomState(42).choice(len(embeddings), sample_size, replace=False))
+        embeddings = np.asarray(embeddings[indices], dtype=np.float32)
+    print(f"共 {len(embeddings)} 条，维度 {embeddings.shape[1]}")
+
+    report = benchmark_engines(embeddings, k, list(CLUSTERING_ENGINES))
+    print_report(report)
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到: {output_file}")
+
+
+if __name__ == "__main__":
+    main()
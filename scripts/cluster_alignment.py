@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+跨运行的稳定聚类编号（新中心与上次模型中心的余弦相似度最优匹配）
+- 用匈牙利算法在相似度矩阵上做最大权匹配，相似度 >= min_similarity 的配对沿用上次的稳定id（unchanged）
+- 未匹配的新聚类: 最近的旧聚类已被其他新聚类匹配 -> split（从该旧聚类拆出，分配新id，被拆的一方也标为split）；
+  否则 -> new（分配新id）
+- 未匹配的旧聚类: 最近的新聚类足够相似 -> 并入该新聚类（merged）；否则 -> retired
+- 匹配上的新聚类尽量沿用上次的位置编号（cluster_id），分配结果、中心文件和按cluster_id索引的下游数据保持一致；
+  稳定id（stable_id）从不复用，记录在模型文件中，下游只需重新生成状态不是unchanged的聚类
+
+用法（查看上次对齐的结果）:
+    python cluster_alignment.py ../results/cluster_results.json
+"""
+import json
+import sys
+from typing import Dict, List
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from cluster_model import load_model, model_exists
+from spherical_kmeans import normalize_rows
+
+ALIGN_MIN_SIMILARITY = 0.9  # 新旧中心的余弦相似度低于该值时不视为同一个聚类
+# 这些预处理不同时中心不在同一空间，不做对齐（降维变换按指纹比较：重新拟合的PCA基与上次不同）
+ALIGNMENT_KEYS = ('embedding_model', 'embedding_dim', 'reduction', 'reducer_fingerprint')
+
+
+def align_clusters(previous_centroids: np.ndarray, centroids: np.ndarray, previous_ids: List[int] = None,
+                   next_id: int = None, min_similarity: float = ALIGN_MIN_SIMILARITY) -> Dict:
+    """
+    返回 {'order': 位置编号 -> 本次拟合的聚类下标, 'position': 本次拟合的聚类下标 -> 位置编号,
+          'clusters': 按位置编号的 [{'cluster_id', 'stable_id', 'status', 'previous_stable_ids', 'similarity'}],
+          'retired': 退役的稳定id, 'next_stable_id', 'min_similarity'}
+    previous_ids: 上次各位置的稳定id（None时为0..k_prev-1）
+    """
+    previous = normalize_rows(previous_centroids)
+    current = normalize_rows(centroids)
+    k_prev, k = len(previous), len(current)
+    previous_ids = list(range(k_prev)) if previous_ids is None else list(previous_ids)
+    next_id = max(previous_ids, default=-1) + 1 if next_id is None else next_id
+    sims = current @ previous.T
+
+    rows, cols = linear_sum_assignment(-sims)
+    matched = {int(j): int(i) for j, i in zip(rows, cols) if sims[j, i] >= min_similarity}
+    nearest_prev = sims.argmax(axis=1) if k_prev else np.zeros(k, dtype=np.int64)
+    # 最优匹配中配给了别处、但最近的旧聚类仍然空着的新聚类，直接接上
+    for j in range(k):
+        i = int(nearest_prev[j])
+        if j not in matched and k_prev and sims[j, i] >= min_similarity and i not in matched.values():
+            matched[j] = i
+
+    status = {}
+    sources = {}
+    for j in range(k):
+        i = int(nearest_prev[j])
+        if j in matched:
+            status[j], sources[j] = 'unchanged', [matched[j]]
+        elif k_prev and sims[j, i] >= min_similarity:
+            status[j], sources[j] = 'split', [i]
+        else:
+            status[j], sources[j] = 'new', []
+    for j in range(k):
+        if status[j] == 'split':
+            for sibling, i in matched.items():
+                if i == sources[j][0]:
+                    status[sibling] = 'split'
+    retired = []
+    matched_prev = set(matched.values())
+    for i in range(k_prev):
+        if i in matched_prev:
+            continue
+        j = int(sims[:, i].argmax()) if k else -1
+        if j >= 0 and sims[j, i] >= min_similarity:
+            status[j] = 'merged'
+            sources[j].append(i)
+        else:
+            retired.append(previous_ids[i])
+
+    stable_ids = {}
+    for j in range(k):
+        if j in matched:
+            stable_ids[j] = previous_ids[matched[j]]
+        else:
+            stable_ids[j] = next_id
+            next_id += 1
+
+    # 位置编号: 匹配上的聚类沿用上次的位置（不超出本次的k时），其余按拟合顺序填入空位
+    position = np.full(k, -1, dtype=np.int64)
+    for j, i in matched.items():
+        if i < k:
+            position[j] = i
+    free = iter(sorted(set(range(k)) - set(position[position >= 0].tolist())))
+    for j in range(k):
+        if position[j] < 0:
+            position[j] = next(free)
+    order = np.argsort(position)
+
+    clusters = [{
+        'cluster_id': int(p),
+        'stable_id': int(stable_ids[j]),
+        'status': status[j],
+        'previous_stable_ids': [int(previous_ids[i]) for i in sources[j]],
+        'similarity': float(sims[j].max()) if k_prev else None
+    } for p, j in enumerate(order)]
+    return {
+        'order': order,
+        'position': position,
+        'clusters': clusters,
+        'retired': [int(stable_id) for stable_id in retired],
+        'next_stable_id': int(next_id),
+        'min_similarity': min_similarity
+    }
+
+
+def align_with_model(model_base: str, centroids: np.ndarray, preprocessing: Dict,
+                     min_similarity: float = ALIGN_MIN_SIMILARITY) -> Dict:
+    """与已保存模型的中心对齐；没有模型或预处理不同（中心不在同一空间）时返回None"""
+    if not model_exists(model_base):
+        return None
+    model = load_model(model_base)
+    if model['centroids'].shape[1] != centroids.shape[1] or any(
+            model.get(key) != preprocessing.get(key) for key in ALIGNMENT_KEYS):
+        print("上次的聚类模型与本次预处理不同，不做编号对齐")
+        return None
+    alignment = align_clusters(model['centroids'], centroids, model.get('stable_ids'),
+                               model.get('next_stable_id'), min_similarity)
+    counts = {}
+    for cluster in alignment['clusters']:
+        counts[cluster['status']] = counts.get(cluster['status'], 0) + 1
+    print(f"聚类编号对齐 (上次 {len(model['centroids'])} 个 -> 本次 {len(centroids)} 个): "
+          + ", ".join(f"{status} {count}" for status, count in sorted(counts.items()))
+          + f", retired {len(alignment['retired'])}")
+    return alignment
+
+
+def remap_labels(labels: np.ndarray, position: np.ndarray) -> np.ndarray:
+    """把拟合得到的标签换成位置编号（噪声-1保持不变）"""
+    labels = np.asarray(labels)
+    return np.where(labels >= 0, position[np.maximum(labels, 0)], labels).astype(labels.dtype)
+
+
+def describe_alignment(alignment: Dict) -> Dict:
+    """可写入JSON的对齐概况（不含数组）"""
+    return {key: value for key, value in alignment.items() if key not in ('order', 'position')}
+
+
+if __name__ == "__main__":
+    results_file = sys.argv[1] if len(sys.argv) > 1 else "../results/cluster_results.json"
+    with open(results_file, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    alignment = results.get('cluster_alignment')
+    if not alignment:
+        print(f"{results_file} 中没有编号对齐记录（首次运行或未启用对齐）")
+        sys.exit(0)
+    print(f"{'cluster_id':>10} {'stable_id':>9} {'状态':<10} {'相似度':>7}  来源")
+    for cluster in alignment['clusters']:
+        similarity = '' if cluster['similarity'] is None else f"{cluster['similarity']:.4f}"
+        print(f"{cluster['cluster_id']:>10} {cluster['stable_id']:>9} {cluster['status']:<10} {similarity:>7}  "
+              f"{cluster['previous_stable_ids']}")
+    print(f"退役的稳定id: {alignment['retired']}")
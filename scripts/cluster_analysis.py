@@ -2,7 +2,7 @@
 """
 使用K-means对embedding进行聚类分析
 - 使用肘部法则和轮廓系数选择最优k
-- 使用MiniBatchKMeans对全量数据拟合
+- 使用MiniBatchKMeans（或球面k-means）对全量数据拟合
 - 提取每个聚类最相似的10个样本
 - 使用AI生成聚类摘要
 """
@@ -10,22 +10,47 @@ import json
 import csv
 import sys
 import numpy as np
-from sklearn.cluster import MiniBatchKMeans, KMeans
-from sklearn.metrics import silhouette_score
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.cluster import MiniBatchKMeans
 import matplotlib.pyplot as plt
 from typing import List, Dict, Tuple
 import os
 import time
+import re
+
+from cluster_alignment import ALIGN_MIN_SIMILARITY, align_with_model, describe_alignment, remap_labels
+from cluster_assignments import representative_samples, write_assignments
+from cluster_model import DRIFT_THRESHOLDS, embedding_model_name, model_exists, run_incremental, save_fitted_model
+from cluster_quality import export_sample_silhouette, quality_metrics
+from coreset import build_coreset, describe_coreset
+from dimensionality_reduction import (describe_reducer, fit_reducer, load_matching_reducer, reducer_fingerprint,
+                                      reduction_impact, save_reducer, transform_blocked)
+from embedding_quantization import RESCORE_OVERSAMPLE, load_quantized, rescore_candidates
+from embedding_store import load_duplicate_groups, open_embeddings, truncate_embeddings
+from gemini_client import load_genai
+from knn_graph_clustering import cluster_centroids, knn_graph_cluster
+from near_duplicates import collapse_near_duplicates
+from spherical_kmeans import MiniBatchSphericalKMeans, SphericalKMeans, normalize_rows
+from summary_pipeline import DEFAULT_SUMMARY_CONCURRENCY, DEFAULT_SUMMARY_RPM, SummaryPipeline
+from streaming_clustering import load_row_ids, load_row_records, open_streaming_matrix, stream_assign, stream_fit
 
 # 增加CSV字段大小限制
 csv.field_size_limit(sys.maxsize)
 
-try:
-    import google.generativeai as genai
-except ImportError:
-    print("请先安装google-generativeai: pip install google-generativeai")
-    exit(1)
+CLUSTERING_ENGINES = ('minibatch_kmeans', 'spherical', 'minibatch_spherical')
+GRAPH_ENGINE = 'knn_graph'  # kNN图密度聚类：不扫描k，允许噪声点（见knn_graph_clustering.py）
+
+genai = None  # 在configure_genai中加载，只导入聚类函数的脚本（如benchmark）不需要安装google-generativeai
+
+
+def configure_genai(api_key: str):
+    """加载genai（GEMINI_BACKEND=fake时连接本地模拟服务）并配置API key，生成摘要前调用"""
+    global genai
+    try:
+        genai = load_genai()
+    except ImportError:
+        print("请先安装google-generativeai: pip install google-generativeai")
+        exit(1)
+    genai.configure(api_key=api_key)
 
 
 def load_full_outputs(csv_file: str) -> Dict[str, str]:
@@ -56,24 +81,25 @@ def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
     return embeddings / norms
 
 
-def load_embeddings(json_file: str, full_outputs: Dict[str, str] = None) -> Tuple[np.ndarray, List[Dict]]:
-    """加载embedding数据并归一化（用于余弦相似度）"""
-    print(f"加载embedding数据: {json_file}")
-    with open(json_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+def load_embeddings(embeddings_file: str, full_outputs: Dict[str, str] = None,
+                    embedding_dim: int = None) -> Tuple[np.ndarray, List[Dict]]:
+    """
+    加载embedding数据并归一化（用于余弦相似度），优先使用memmap方式打开二进制存储
+    embedding_dim不为None时截断到前embedding_dim维并重新归一化（Matryoshka截断）
+    """
+    print(f"加载embedding数据: {embeddings_file}")
+    embeddings, ids, previews = open_embeddings(embeddings_file)
+    if embedding_dim and embedding_dim < embeddings.shape[1]:
+        print(f"截断到前 {embedding_dim} 维并重新归一化...")
+        embeddings = truncate_embeddings(embeddings, embedding_dim)
     
-    # 过滤掉embedding为None的数据
+    # 如果有完整的output数据，替换预览
     valid_data = []
-    for item in data:
-        if item.get('embedding') is not None:
-            # 如果有完整的output数据，替换预览
-            if full_outputs and item.get('id'):
-                item_id = item['id'].strip('"')
-                if item_id in full_outputs:
-                    item['output'] = full_outputs[item_id]
-            valid_data.append(item)
-    
-    embeddings = np.array([item['embedding'] for item in valid_data])
+    for i, item_id in enumerate(ids):
+        output = previews[i] if previews else ''
+        if full_outputs and item_id:
+            output = full_outputs.get(item_id.strip('"'), output)
+        valid_data.append({'id': item_id, 'output': output})
     
     # 确保向量已归一化（如果未归一化则归一化）
     # 检查是否已归一化（归一化向量的L2范数应该接近1）
@@ -90,51 +116,228 @@ def load_embeddings(json_file: str, full_outputs: Dict[str, str] = None) -> Tupl
     return embeddings, valid_data
 
 
-def find_optimal_k(embeddings: np.ndarray, k_range: range, sample_size: int = 10000) -> Dict:
+def make_kmeans(engine: str, n_clusters: int, seed: int = 42, init: np.ndarray = None, max_iter: int = None):
+    """
+    按名称创建聚类器（接口一致: fit / fit_predict / predict / cluster_centers_ / inertia_）
+    - minibatch_kmeans: sklearn的欧氏MiniBatchKMeans
+    - spherical / minibatch_spherical: 余弦空间的球面k-means，中心始终归一化
+    init: 给定的初始中心（热启动，只做一次初始化）；max_iter: 覆盖默认的最大迭代轮数
+    """
+    options = {} if max_iter is None else {'max_iter': max_iter}
+    if engine == 'minibatch_kmeans':
+        if init is not None:
+            return MiniBatchKMeans(n_clusters=n_clusters, init=init, n_init=1, random_state=seed, batch_size=1000,
+                                   **options)
+        return MiniBatchKMeans(n_clusters=n_clusters, random_state=seed, batch_size=1000, n_init=10, **options)
+    if engine == 'spherical':
+        return SphericalKMeans(n_clusters=n_clusters, n_init=3, random_state=seed, init=init, **options)
+    if engine == 'minibatch_spherical':
+        return MiniBatchSphericalKMeans(n_clusters=n_clusters, batch_size=1000, n_init=10, random_state=seed,
+                                        init=init, **options)
+    raise ValueError(f"不支持的聚类引擎: {engine}（可选: {', '.join(CLUSTERING_ENGINES)}）")
+
+
+def evaluate_k(sample_embeddings: np.ndarray, k: int, seed: int = 42,
+               engine: str = 'minibatch_kmeans', sample_weight: np.ndarray = None) -> Dict[str, float]:
+    """
+    对单个k拟合聚类器，并在全部采样数据上计算惯性和聚类质量指标（coreset时按sample_weight加权）
+    随机数只由 (seed, k) 决定，串行和并行执行的结果完全一致
+    """
+    kmeans = make_kmeans(engine, k, seed)
+    labels = kmeans.fit_predict(sample_embeddings, sample_weight=sample_weight)
+    return k_metrics(sample_embeddings, labels, k, kmeans.inertia_, sample_weight)
+
+
+def k_metrics(sample_embeddings: np.ndarray, labels: np.ndarray, k: int, inertia: float,
+              sample_weight: np.ndarray = None) -> Dict[str, float]:
+    """惯性 + 全量精确余弦轮廓系数、简化轮廓系数、Davies-Bouldin、Calinski-Harabasz"""
+    quality = quality_metrics(sample_embeddings, labels, k, sample_weight=sample_weight)
+    metrics = {'inertia': float(inertia)}
+    for key in ('silhouette', 'simplified_silhouette', 'davies_bouldin', 'calinski_harabasz'):
+        metrics[key] = float(quality[key])
+    return metrics
+
+
+def print_k_metrics(k: int, metrics: Dict[str, float]):
+    print(f"    k={k}: 惯性={metrics['inertia']:.2f}, 轮廓系数={metrics['silhouette']:.4f}, "
+          f"DB={metrics['davies_bouldin']:.4f}, CH={metrics['calinski_harabasz']:.1f}")
+
+
+def split_direction(members: np.ndarray, rng: np.random.RandomState, iterations: int = 10) -> np.ndarray:
+    """用幂迭代求簇内样本的第一主成分方向，作为拆分方向"""
+    centered = members - members.mean(axis=0)
+    direction = rng.standard_normal(members.shape[1]).astype(np.float32)
+    for _ in range(iterations):
+        direction = centered.T @ (centered @ direction)
+        norm = np.linalg.norm(direction)
+        if norm == 0:
+            break
+        direction /= norm
+    return direction
+
+
+def next_k_init(sample_embeddings: np.ndarray, centroids: np.ndarray, labels: np.ndarray,
+                sq_distances: np.ndarray, rng: np.random.RandomState, strategy: str = 'split') -> np.ndarray:
+    """
+    由k的解构造k+1个初始中心
+    - split: 沿主成分方向拆分SSE最大的簇（两半各自的均值替换原中心）
+    - kmeans++: 保留原中心，按到最近中心距离平方的概率再加一个种子
+    """
+    if strategy == 'split':
+        cluster_sse = np.bincount(labels, weights=sq_distances, minlength=len(centroids))
+        target = int(np.argmax(cluster_sse))
+        members = sample_embeddings[labels == target]
+        if len(members) >= 2:
+            projection = (members - centroids[target]) @ split_direction(members, rng)
+            left, right = members[projection <= 0], members[projection > 0]
+            if len(left) and len(right):
+                new_centroids = centroids.copy()
+                new_centroids[target] = left.mean(axis=0)
+                return np.vstack([new_centroids, right.mean(axis=0)])
+    # kmeans++ 追加一个种子（也是拆分失败时的回退）
+    total = sq_distances.sum()
+    if total > 0:
+        seed_index = rng.choice(len(sample_embeddings), p=sq_distances / total)
+    else:
+        seed_index = rng.randint(len(sample_embeddings))
+    return np.vstack([centroids, sample_embeddings[seed_index]])
+
+
+def sweep_k_warm_start(sample_embeddings: np.ndarray, k_values: List[int], seed: int = 42,
+                       strategy: str = 'split', refine_iter: int = 10, sample_weight: np.ndarray = None,
+                       engine: str = 'minibatch_kmeans') -> Dict[int, Dict[str, float]]:
+    """
+    增量式k值扫描：只有最小的k完整初始化，之后每个k+1由k的中心热启动，
+    拆分SSE最大的簇（或追加一个k-means++种子）后只做少量迭代
+    每个k都用与最终拟合相同的引擎（make_kmeans），返回 k -> 指标字典，与独立扫描的指标定义相同
+    """
+    rng = np.random.RandomState(seed)
+    k_min, k_max = min(k_values), max(k_values)
+    wanted = set(k_values)
+    results = {}
+    # 球面引擎在单位球面上聚类：拆分方向和SSE也在归一化后的向量上计算（距离平方 = 2 - 2·余弦）
+    points = sample_embeddings if engine == 'minibatch_kmeans' else normalize_rows(sample_embeddings)
+
+    kmeans = make_kmeans(engine, k_min, seed)
+    for k in range(k_min, k_max + 1):
+        if k > k_min:
+            init = next_k_init(points, centroids, labels, sq_distances, rng, strategy)
+            kmeans = make_kmeans(engine, k, seed, init=init, max_iter=refine_iter)
+        labels = kmeans.fit_predict(sample_embeddings, sample_weight=sample_weight)
+        centroids = kmeans.cluster_centers_.astype(np.float32)
+        sq_distances = ((points - centroids[labels]) ** 2).sum(axis=1)
+        if sample_weight is not None:
+            sq_distances = sq_distances * sample_weight
+        if k in wanted:
+            results[k] = k_metrics(sample_embeddings, labels, k, kmeans.inertia_, sample_weight)
+            print_k_metrics(k, results[k])
+    return results
+
+
+# 进程池worker中共享的采样矩阵（通过共享内存映射，不随任务pickle）
+_worker_shm = None
+_worker_embeddings = None
+_worker_weights = None
+_worker_blas_limits = None
+
+
+def _init_k_worker(shm_name: str, shape: Tuple[int, int], blas_threads: int, sample_weight: np.ndarray = None):
+    """进程池初始化：映射共享内存中的采样矩阵，并限制BLAS/OpenMP线程数避免超额订阅"""
+    global _worker_shm, _worker_embeddings, _worker_weights, _worker_blas_limits
+    from multiprocessing import shared_memory
+    from threadpoolctl import threadpool_limits
+    _worker_blas_limits = threadpool_limits(limits=blas_threads)
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_embeddings = np.ndarray(shape, dtype=np.float32, buffer=_worker_shm.buf)
+    _worker_weights = sample_weight
+
+
+def _evaluate_k_worker(k: int, seed: int, engine: str) -> Tuple[int, Dict[str, float]]:
+    return k, evaluate_k(_worker_embeddings, k, seed, engine, _worker_weights)
+
+
+def sweep_k_parallel(sample_embeddings: np.ndarray, k_values: List[int], seed: int = 42,
+                     n_jobs: int = None, engine: str = 'minibatch_kmeans',
+                     sample_weight: np.ndarray = None) -> Dict[int, Dict[str, float]]:
+    """把k值扫描分发到进程池，采样矩阵只放入共享内存一次（权重向量很小，随初始化参数传入）；返回 k -> 指标字典"""
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+    
+    cpu_count = os.cpu_count() or 1
+    n_jobs = min(n_jobs or cpu_count, len(k_values))
+    blas_threads = max(1, cpu_count // n_jobs)
+    print(f"  并行扫描: {n_jobs} 个进程, 每个进程 {blas_threads} 个BLAS线程")
+    
+    sample = np.ascontiguousarray(sample_embeddings, dtype=np.float32)
+    shm = shared_memory.SharedMemory(create=True, size=max(sample.nbytes, 1))
+    try:
+        np.ndarray(sample.shape, dtype=np.float32, buffer=shm.buf)[:] = sample
+        results = {}
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_k_worker,
+                                 initargs=(shm.name, sample.shape, blas_threads, sample_weight)) as executor:
+            # 大k耗时更长，先提交以减少尾部等待
+            futures = [executor.submit(_evaluate_k_worker, k, seed, engine) for k in sorted(k_values, reverse=True)]
+            for future in futures:
+                k, metrics = future.result()
+                results[k] = metrics
+                print_k_metrics(k, metrics)
+        return results
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def find_optimal_k(embeddings: np.ndarray, k_range: range, sample_size: int = 10000,
+                   n_jobs: int = 1, seed: int = 42, sweep_mode: str = 'independent',
+                   engine: str = 'minibatch_kmeans', sampling: str = 'coreset',
+                   sample_weight: np.ndarray = None) -> Dict:
     """
     使用肘部法则和轮廓系数找到最优k值
-    为了加快速度，使用采样数据
+    为了加快速度，使用采样数据；n_jobs>1时各k值在进程池中并行计算（结果与串行一致）
+    sweep_mode='warm_start' 时由k的解热启动k+1（串行，n_jobs不生效）
+    sampling='coreset' 时用加权coreset（见coreset.py，小簇不会被漏采）代替均匀采样，拟合和质量指标都按权重计算
+    sample_weight: 每行代表的原始样本数（如近重复折叠后的重复次数），与采样权重相乘
     """
     print(f"\n开始寻找最优k值 (k范围: {k_range.start}-{k_range.stop-1})...")
     
+    k_values = list(k_range)
+    row_weight = sample_weight
+    coreset_info = None
+    
     # 如果数据量太大，采样
-    if len(embeddings) > sample_size:
+    if len(embeddings) <= sample_size:
+        sample_embeddings = np.asarray(embeddings, dtype=np.float32)
+    elif sampling == 'coreset':
+        print(f"数据量较大，构建 {sample_size} 点的加权coreset进行k值选择...")
+        coreset = build_coreset(embeddings, sample_size, n_centers=2 * max(k_values), seed=seed)
+        sample_embeddings, sample_weight = coreset['points'], coreset['weights']
+        if row_weight is not None:
+            sample_weight = sample_weight * row_weight[coreset['indices']]
+        coreset_info = describe_coreset(coreset)
+        print(f"  coreset: {coreset_info['size']} 个不同样本, 总权重 {coreset_info['total_weight']:.0f}, "
+              f"有效样本数 {coreset_info['effective_size']:.0f}")
+    elif sampling == 'uniform':
         print(f"数据量较大，采样 {sample_size} 条数据进行k值选择...")
-        indices = np.random.choice(len(embeddings), sample_size, replace=False)
-        sample_embeddings = embeddings[indices]
+        indices = np.sort(np.random.RandomState(seed).choice(len(embeddings), sample_size, replace=False))
+        sample_embeddings = np.asarray(embeddings[indices], dtype=np.float32)
+        sample_weight = None if row_weight is None else row_weight[indices]
     else:
-        sample_embeddings = embeddings
+        raise ValueError(f"不支持的采样方式: {sampling}（可选: coreset, uniform）")
     
-    inertias = []
-    silhouette_scores = []
-    k_values = list(k_range)
+    if sweep_mode == 'warm_start':
+        print("  热启动扫描: 每个k+1拆分k的解中SSE最大的簇后少量迭代")
+        sweep = sweep_k_warm_start(sample_embeddings, k_values, seed, sample_weight=sample_weight, engine=engine)
+    elif min(n_jobs or os.cpu_count() or 1, len(k_values)) > 1:
+        sweep = sweep_k_parallel(sample_embeddings, k_values, seed, n_jobs, engine, sample_weight)
+    else:
+        sweep = {}
+        for k in k_values:
+            print(f"  测试 k={k}...")
+            sweep[k] = evaluate_k(sample_embeddings, k, seed, engine, sample_weight)
+            print_k_metrics(k, sweep[k])
     
-    for k in k_values:
-        print(f"  测试 k={k}...")
-        
-        # 使用MiniBatchKMeans快速训练
-        kmeans = MiniBatchKMeans(n_clusters=k, random_state=42, batch_size=1000, n_init=10)
-        labels = kmeans.fit_predict(sample_embeddings)
-        
-        inertia = kmeans.inertia_
-        inertias.append(inertia)
-        
-        # 计算轮廓系数（可能较慢，所以采样）
-        if len(sample_embeddings) > 5000:
-            # 对轮廓系数计算也采样
-            silhouette_sample_size = 5000
-            silhouette_indices = np.random.choice(len(sample_embeddings), silhouette_sample_size, replace=False)
-            silhouette_sample = sample_embeddings[silhouette_indices]
-            silhouette_labels = labels[silhouette_indices]
-        else:
-            silhouette_sample = sample_embeddings
-            silhouette_labels = labels
-        
-        # 使用余弦距离计算轮廓系数（向量已归一化，明确使用余弦距离）
-        silhouette = silhouette_score(silhouette_sample, silhouette_labels, metric='cosine')
-        silhouette_scores.append(silhouette)
-        
-        print(f"    k={k}: 惯性={inertia:.2f}, 轮廓系数={silhouette:.4f}")
+    inertias = [sweep[k]['inertia'] for k in k_values]
+    silhouette_scores = [sweep[k]['silhouette'] for k in k_values]
     
     # 结合肘部法则和轮廓系数选择最优k
     # 方法：找到轮廓系数较高且惯性下降率开始变缓的k值
@@ -187,8 +390,13 @@ def find_optimal_k(embeddings: np.ndarray, k_range: range, sample_size: int = 10
         'k_values': k_values,
         'inertias': inertias,
         'silhouette_scores': silhouette_scores,
+        'simplified_silhouette_scores': [sweep[k]['simplified_silhouette'] for k in k_values],
+        'davies_bouldin_scores': [sweep[k]['davies_bouldin'] for k in k_values],
+        'calinski_harabasz_scores': [sweep[k]['calinski_harabasz'] for k in k_values],
         'best_k': best_k,
-        'inertia_rates': inertia_rates if len(inertia_rates) > 0 else []
+        'inertia_rates': inertia_rates if len(inertia_rates) > 0 else [],
+        'sampling': sampling if len(embeddings) > sample_size else 'full',
+        'coreset': coreset_info
     }
 
 
@@ -225,24 +433,8 @@ def plot_elbow_and_silhouette(results: Dict, output_dir: str = '.'):
     plt.close()
 
 
-def get_top_similar_samples(embeddings: np.ndarray, cluster_center: np.ndarray, 
-                           cluster_indices: np.ndarray, top_n: int = 10) -> List[int]:
-    """找到聚类中心最相似的top_n个样本"""
-    # 计算与聚类中心的余弦相似度
-    cluster_embeddings = embeddings[cluster_indices]
-    similarities = cosine_similarity([cluster_center], cluster_embeddings)[0]
-    
-    # 获取top_n个最相似的索引（在cluster_indices中的位置）
-    top_indices_in_cluster = np.argsort(similarities)[-top_n:][::-1]
-    
-    # 转换为全局索引
-    top_global_indices = cluster_indices[top_indices_in_cluster]
-    
-    return top_global_indices.tolist()
-
-
-def generate_cluster_summary(samples: List[Dict], model_name: str = "models/gemini-flash-lite-latest") -> str:
-    """使用AI生成聚类摘要"""
+def build_summary_prompt(samples: List[Dict]) -> str:
+    """由代表样本构建聚类摘要的prompt"""
     # 准备样本文本
     sample_texts = []
     for i, sample in enumerate(samples[:10], 1):  # 最多10个样本
@@ -315,14 +507,36 @@ def generate_cluster_summary(samples: List[Dict], model_name: str = "models/gemi
 [你的摘要，必须突出这个聚类的独特性和与其他聚类的区别]
 
 请用中文回答，生成一个能够清晰区分这个聚类与其他聚类的摘要。"""
-    
-    try:
-        model = genai.GenerativeModel(model_name)
-        response = model.generate_content(prompt)
-        return response.text.strip()
-    except Exception as e:
-        print(f"生成摘要时出错: {e}")
-        return f"聚类包含 {len(samples)} 个样本"
+    return prompt
+
+
+def generate_cluster_summary(samples: List[Dict], model_name: str = "models/gemini-flash-lite-latest") -> str:
+    """使用AI生成聚类摘要（请求失败时抛出异常，由调用方记录失败）"""
+    prompt = build_summary_prompt(samples)
+    model = genai.GenerativeModel(model_name)
+    response = model.generate_content(prompt)
+    return response.text.strip()
+
+
+async def generate_cluster_summary_async(samples: List[Dict],
+                                         model_name: str = "models/gemini-flash-lite-latest") -> str:
+    """generate_cluster_summary的异步版本，供SummaryPipeline并发调用（重试和失败记录由流水线负责）"""
+    prompt = build_summary_prompt(samples)
+    model = genai.GenerativeModel(model_name)
+    response = await model.generate_content_async(prompt)
+    return response.text.strip()
+
+
+def fallback_summary(size: int) -> str:
+    """摘要生成失败时写入结果的占位文本"""
+    return f"聚类包含 {size} 个样本"
+
+
+def reusable_summary(cluster: Dict) -> bool:
+    """上次结果中的摘要是否生成成功、可以沿用（旧结果没有summary_status时按占位文本判断）"""
+    if 'summary_status' in cluster:
+        return cluster['summary_status'] != 'failed'
+    return 'summary_error' not in cluster and not re.fullmatch(r'聚类包含 \d+ 个样本', cluster.get('summary', ''))
 
 
 def main():
@@ -331,67 +545,351 @@ def main():
     csv_file = "../data/ikarao.csv"
     k_range = range(2, 21)  # 测试k从2到20
     top_n_samples = 10
+    farthest_n_samples = 5  # 每个聚类额外保存与中心最不相似的样本，用于离群检查（0为不保存）
+    embedding_dim = None  # 截断到更小的维度（如256/128/64）以加快聚类，可用benchmark_dimensionality.py评估
+    reduction = None  # 聚类前降维: None / 'pca'（随机化PCA）/ 'random_projection'（稀疏随机投影）
+    reduction_dim = 128  # 降维后的维度
+    reduction_base = "../results/reduction"  # 降维变换的保存前缀（增量模式复用；流式模式的降维矩阵也写在这里）
+    refit_reduction = False  # True时每次全量运行都重新拟合降维（新的基下中心与上次不可比，编号对齐会跳过）
+    embedding_format = 'float32'  # 'float16'/'int8'/'binary': 在量化存储上做分配和代表样本搜索（先运行embedding_quantization.py生成）
+    quantized_fit_size = 100000  # 量化模式下用于拟合聚类中心的解码样本数
+    quantized_quality_size = 20000  # 量化模式下计算聚类质量指标的解码样本数
+    k_sweep_jobs = None  # k值扫描的并行进程数（None为使用全部CPU，1为串行）
+    k_sweep_mode = 'independent'  # k值扫描方式: independent（每个k独立多次初始化）或 warm_start（增量热启动）
+    clustering_engine = 'minibatch_kmeans'  # 聚类引擎: minibatch_kmeans / spherical / minibatch_spherical（可用benchmark_spherical_kmeans.py比较）/ knn_graph
+    knn_neighbors = 15  # knn_graph引擎: kNN图的近邻数
+    knn_min_cluster_size = 100  # knn_graph引擎: 最小聚类大小，更小的稀疏区域标为噪声
+    near_duplicate_threshold = None  # 近重复折叠的余弦相似度阈值（如0.98）；None为不折叠。每组只用一个代表、以重复次数为权重拟合
+    streaming = False  # 流式模式: 从memmap/分段文件按块partial_fit和分配，内存占用与数据行数无关
+    streaming_epochs = 1  # 流式模式下训练数据的轮数
+    quality_sample_size = 100000  # 流式模式下计算聚类质量指标的加权coreset大小
+    k_sample_size = 10000  # k值扫描使用的样本数（超过时构建加权coreset）
+    k_sampling = 'coreset'  # k值扫描的采样方式: coreset（敏感度加权采样）或 uniform（均匀采样）
+    assignments_base = "../results/cluster_assignments"  # 全量分配结果（标签/相似度/第二近聚类/中心/统计）的输出前缀
+    model_base = "../results/cluster_model"  # 持久化的聚类模型（中心、k、embedding模型与预处理、漂移基线）
+    incremental = False  # 每日增量模式: 只分配新追加的行并小批量更新中心，漂移超过阈值时才重新选择k并全量拟合
+    drift_thresholds = dict(DRIFT_THRESHOLDS)  # 触发全量拟合的漂移阈值（见cluster_model.py）
+    align_cluster_ids = True  # 全量拟合后与上次模型的中心对齐，沿用聚类编号并标记split/merged/new/retired
+    align_min_similarity = ALIGN_MIN_SIMILARITY  # 新旧中心视为同一聚类的最低余弦相似度
+    reuse_unchanged_summaries = True  # 对齐后状态为unchanged的聚类沿用上次的摘要，不再调用API
+    summary_mode = 'pipelined'  # 摘要生成方式: pipelined（代表样本确定后立即异步并发请求，与质量计算重叠）或 serial（逐个调用）
+    summary_concurrency = DEFAULT_SUMMARY_CONCURRENCY  # pipelined模式下同时在途的摘要请求数
+    summary_rpm = DEFAULT_SUMMARY_RPM  # pipelined模式下每分钟最多发出的摘要请求数
+    summary_progress_file = "../results/cluster_summaries.partial.jsonl"  # pipelined模式下每个摘要完成时立即追加写入
+    output_file = "../results/cluster_results.json"
+    
+    if embedding_format != 'float32' and embedding_dim:
+        raise ValueError("embedding_format与embedding_dim不能同时使用（量化存储保存的是完整维度）")
+    if reduction and (embedding_dim or embedding_format != 'float32'):
+        raise ValueError("reduction只支持完整维度的float32存储（不能与embedding_dim/量化存储同时使用）")
+    if streaming and (embedding_dim or embedding_format != 'float32'):
+        raise ValueError("流式模式只支持完整维度的float32存储")
+    if streaming and clustering_engine == 'spherical':
+        raise ValueError("流式模式需要支持partial_fit的引擎: minibatch_kmeans 或 minibatch_spherical")
+    if clustering_engine == GRAPH_ENGINE and (streaming or embedding_format != 'float32'):
+        raise ValueError("knn_graph引擎只支持非流式的float32存储")
+    if near_duplicate_threshold and (streaming or embedding_format != 'float32' or clustering_engine == GRAPH_ENGINE):
+        raise ValueError("近重复折叠只支持非流式float32存储上的k-means引擎")
+    
+    preprocessing = {
+        'embeddings_file': embeddings_file,
+        'embedding_model': embedding_model_name(embeddings_file),
+        'embedding_dim': embedding_dim,
+        'embedding_format': embedding_format,
+        'clustering_engine': clustering_engine,
+        'reduction': f"{reduction}:{reduction_dim}" if reduction else None,
+        'reduction_base': reduction_base if reduction else None
+    }
+    if incremental:
+        if not model_exists(model_base):
+            print(f"未找到聚类模型 {model_base}，进行全量拟合")
+        elif run_incremental(model_base, embeddings_file, assignments_base, preprocessing, drift_thresholds,
+                             output_file):
+            return
     
     # 加载API key
     api_key = os.getenv('GEMINI_API_KEY')
     if not api_key:
         api_key = input("请输入您的Gemini API Key: ").strip()
-    genai.configure(api_key=api_key)
-    
-    # 加载完整output数据（如果可用）
-    full_outputs = load_full_outputs(csv_file) if os.path.exists(csv_file) else None
-    
-    # 加载数据
-    embeddings, data = load_embeddings(embeddings_file, full_outputs)
+    configure_genai(api_key)
+    
+    if streaming:
+        # 流式模式只打开memmap，代表样本的id/output在聚类后按需读取
+        print(f"流式模式打开embedding数据: {embeddings_file}")
+        embeddings = open_streaming_matrix(embeddings_file)
+        data = None
+        print(f"共 {len(embeddings)} 条，维度 {embeddings.shape[1]}")
+    else:
+        # 加载完整output数据（如果可用）
+        full_outputs = load_full_outputs(csv_file) if os.path.exists(csv_file) else None
+        
+        # 加载数据
+        embeddings, data = load_embeddings(embeddings_file, full_outputs, embedding_dim)
+    
+    reduction_info = None
+    if reduction:
+        # 复用已保存的同设置降维变换（否则在采样上拟合并保存），之后的k值扫描、拟合、分配和质量指标
+        # 都在降维后的空间中进行；变换的指纹写入模型，编号对齐只在同一个基下比较中心
+        print(f"\n降维: {reduction}, {embeddings.shape[1]} -> {reduction_dim} 维...")
+        reducer = None if refit_reduction else load_matching_reducer(reduction_base, reduction, reduction_dim,
+                                                                     embeddings.shape[1])
+        if reducer:
+            print(f"  复用已保存的降维变换: {reduction_base}")
+        else:
+            reducer = fit_reducer(embeddings, reduction, reduction_dim)
+            save_reducer(reduction_base, reducer)
+        preprocessing['reducer_fingerprint'] = reducer_fingerprint(reducer)
+        reduction_info = describe_reducer(reducer)
+        print(f"  保留方差: {reducer['retained_variance']:.4f}, 余弦距离平均失真: {reducer['pairwise_distortion']:.4f}, "
+              f"拟合耗时 {reducer['fit_seconds']:.1f}s")
+        full_embeddings = embeddings
+        start = time.time()
+        embeddings = transform_blocked(full_embeddings, reducer, reduction_base + '.matrix.npy' if streaming else None)
+        print(f"  变换 {len(embeddings)} 行，耗时 {time.time() - start:.1f}s")
+    
+    duplicates = None
+    fit_embeddings, fit_weight = embeddings, None
+    if near_duplicate_threshold:
+        # 完全重复按content_hash合并，近重复用SimHash分桶后精确验证；k值扫描和拟合只用每组的代表行
+        print(f"\n折叠近重复样本 (余弦相似度 >= {near_duplicate_threshold})...")
+        exact = load_duplicate_groups(embeddings_file)
+        duplicates = collapse_near_duplicates(embeddings, near_duplicate_threshold,
+                                              exact_groups=exact[0] if exact else None)
+        info = duplicates['info']
+        print(f"  {info['n_rows']} 行 -> {info['exact_groups']} 个不同内容 -> {info['n_groups']} 组 "
+              f"(保留 {info['collapse_ratio']:.1%}), 耗时 {info['seconds']:.1f}s")
+        fit_embeddings = embeddings[duplicates['representatives']]
+        fit_weight = duplicates['counts'].astype(np.float64)
     
-    # 寻找最优k
     print("\n" + "="*50)
-    k_results = find_optimal_k(embeddings, k_range, sample_size=10000)
-    
-    # 绘制图表
-    plot_elbow_and_silhouette(k_results)
-    
-    # 使用最优k进行全量数据聚类
-    optimal_k = k_results['best_k']
-    print(f"\n使用最优k={optimal_k}对全量数据进行聚类...")
-    print("="*50)
-    
-    mbk = MiniBatchKMeans(n_clusters=optimal_k, random_state=42, batch_size=1000, n_init=10)
-    labels = mbk.fit_predict(embeddings)
-    
+    if clustering_engine == GRAPH_ENGINE:
+        # kNN图密度聚类直接得到聚类数和标签（噪声为-1），不需要k值扫描
+        labels, k_results = knn_graph_cluster(embeddings, knn_neighbors, knn_min_cluster_size)
+        optimal_k = k_results['n_clusters']
+        centers = cluster_centroids(embeddings, labels, optimal_k)
+    else:
+        # 寻找最优k
+        k_results = find_optimal_k(fit_embeddings, k_range, sample_size=k_sample_size, n_jobs=k_sweep_jobs,
+                                   sweep_mode=k_sweep_mode, engine=clustering_engine, sampling=k_sampling,
+                                   sample_weight=fit_weight)
+        
+        # 绘制图表
+        plot_elbow_and_silhouette(k_results)
+        
+        # 使用最优k进行全量数据聚类
+        optimal_k = k_results['best_k']
+        print(f"\n使用最优k={optimal_k}对全量数据进行聚类...")
+        print("="*50)
+        mbk = make_kmeans(clustering_engine, optimal_k, 42)
+    
+    if reduction and optimal_k > 1:
+        # 在采样上比较降维前后同一k的聚类结果（图聚类引擎用MiniBatchKMeans比较）
+        impact_engine = clustering_engine if clustering_engine in CLUSTERING_ENGINES else 'minibatch_kmeans'
+        reduction_info['impact'] = reduction_impact(full_embeddings, reducer,
+                                                    lambda k: make_kmeans(impact_engine, k, 42), optimal_k)
+        impact = reduction_info['impact']
+        print(f"降维影响 (k={optimal_k}, 采样 {impact['sample_size']} 行): ARI={impact['ari_vs_full']:.4f}, "
+              f"原始空间轮廓系数 {impact['silhouette_full_space']:.4f} -> "
+              f"{impact['silhouette_full_space_reduced_labels']:.4f}, 拟合加速 {impact['speedup']:.1f}x")
+    
+    top_by_cluster = None
+    quantized = None
+    assignment_metadata = {
+        'embeddings_file': embeddings_file,
+        'clustering_engine': clustering_engine,
+        'embedding_dim': embedding_dim,
+        'embedding_format': embedding_format,
+        'optimal_k': optimal_k
+    }
+    if clustering_engine == GRAPH_ENGINE:
+        pass  # 标签和中心已由图聚类得到
+    elif streaming:
+        print(f"流式训练 ({streaming_epochs} 轮)...")
+        stream_fit(embeddings, mbk, epochs=streaming_epochs)
+        centers = mbk.cluster_centers_
+        alignment = align_with_model(model_base, centers, preprocessing, align_min_similarity) \
+            if align_cluster_ids else None
+        if alignment:
+            centers = centers[alignment['order']]
+        print("流式分配标签和相似度...")
+        row_ids = load_row_ids(embeddings_file)
+        labels, similarities, top_by_cluster, farthest_by_cluster = stream_assign(
+            embeddings, centers, row_ids, assignments_base, top_n_samples,
+            assignment_metadata, farthest_n_samples)
+        needed_rows = [row for groups in (top_by_cluster, farthest_by_cluster)
+                       for rows in groups.values() for row in rows]
+        data = load_row_records(embeddings_file, needed_rows, csv_file)
+    elif duplicates:
+        # 在代表行上加权拟合，组内所有行沿用代表的标签
+        labels = mbk.fit_predict(fit_embeddings, sample_weight=fit_weight)[duplicates['group_of']]
+        centers = mbk.cluster_centers_
+    elif embedding_format == 'float32':
+        labels = mbk.fit_predict(embeddings)
+        centers = mbk.cluster_centers_
+    else:
+        # 量化模式：在解码后的样本上拟合中心，全量分配在写入分配结果时直接在量化数据上完成（只有一遍）
+        print(f"使用 {embedding_format} 量化存储进行分配...")
+        quantized = load_quantized(embeddings_file, embedding_format)
+        fit_size = min(quantized_fit_size, len(quantized))
+        fit_indices = np.sort(np.random.RandomState(42).choice(len(quantized), fit_size, replace=False))
+        mbk.fit(quantized.decode(fit_indices))
+        centers = normalize_embeddings(mbk.cluster_centers_)
+        labels = None
+    
+    if not streaming:
+        # 与上次模型的中心对齐后再写入分配结果（流式模式在第二遍分配前已对齐）
+        alignment = align_with_model(model_base, centers, preprocessing, align_min_similarity) \
+            if align_cluster_ids else None
+        if alignment:
+            centers = centers[alignment['order']]
+            if labels is not None:
+                labels = remap_labels(labels, alignment['position'])
+        # 保存全量分配结果（流式模式已在第二遍中写入），同一遍中得到每行与所属中心的相似度
+        row_ids = [sample['id'] for sample in data]
+        if quantized is not None:
+            # 在量化数据上按块分配，同一遍中合并出代表样本候选，再只读取候选行的float32向量重新打分
+            columns, candidates, farthest_by_cluster = write_assignments(
+                assignments_base, quantized, centers, row_ids, metadata=assignment_metadata,
+                top_n=top_n_samples * RESCORE_OVERSAMPLE[embedding_format], farthest_n=farthest_n_samples)
+            labels = columns['labels']
+            top_by_cluster = rescore_candidates(candidates, embeddings, centers, top_n_samples)
+        else:
+            columns, _, _ = write_assignments(assignments_base, embeddings, centers,
+                                              row_ids, labels=labels, metadata=assignment_metadata)
+            # 按组argpartition一次取出所有聚类的代表样本
+            top_by_cluster, farthest_by_cluster = representative_samples(
+                columns['similarity'], labels, optimal_k, top_n_samples, farthest_n_samples)
+        similarities = columns['similarity']
+    print(f"全量分配结果已保存到: {assignments_base}.*（聚类统计: {assignments_base}.stats.json）")
+    previous_summaries = {}
+    if alignment and reuse_unchanged_summaries and os.path.exists(output_file):
+        # 在覆盖模型和结果之前读取上次的摘要（按稳定id），生成失败的摘要不沿用，本次重新生成
+        with open(output_file, 'r', encoding='utf-8') as f:
+            previous_summaries = {cluster.get('stable_id', cluster['cluster_id']): cluster['summary']
+                                  for cluster in json.load(f).get('cluster_summaries', [])
+                                  if reusable_summary(cluster)}
+    if alignment:
+        save_fitted_model(model_base, assignments_base, row_ids, preprocessing,
+                          [cluster['stable_id'] for cluster in alignment['clusters']], alignment['next_stable_id'])
+    else:
+        save_fitted_model(model_base, assignments_base, row_ids, preprocessing)
     print(f"聚类完成！")
+    
+    # 编号对齐后未变化的聚类沿用上次的摘要；pipelined模式下其余聚类的摘要请求现在就放入异步队列，
+    # 与下面的质量指标计算同时进行
+    lineages = alignment['clusters'] if alignment else [None] * optimal_k
+    reused_summaries = {
+        cluster_id: previous_summaries[lineage['stable_id']]
+        for cluster_id, lineage in enumerate(lineages)
+        if lineage and lineage['status'] == 'unchanged' and lineage['stable_id'] in previous_summaries
+    }
+    pipeline = None
+    if summary_mode == 'pipelined':
+        pipeline = SummaryPipeline(generate_cluster_summary_async, summary_concurrency, summary_rpm,
+                                   summary_progress_file)
+        for cluster_id in range(optimal_k):
+            if cluster_id not in reused_summaries:
+                pipeline.submit(cluster_id, [data[idx] for idx in top_by_cluster[cluster_id]],
+                                {'stable_id': lineages[cluster_id]['stable_id'] if alignment else cluster_id})
+        print(f"已提交 {len(pipeline.futures)} 个摘要请求 (并发 {summary_concurrency}, 每分钟 {summary_rpm} 次)")
+    elif summary_mode != 'serial':
+        raise ValueError(f"不支持的摘要生成方式: {summary_mode}（可选: pipelined, serial）")
+    
+    # 全量数据上的聚类质量（分块计算），并导出逐样本轮廓系数用于标记边界会话
+    noise_samples = int((np.asarray(labels) < 0).sum())
+    if streaming:
+        # 流式模式在固定大小的加权coreset上计算质量指标，不导出逐样本轮廓系数
+        coreset = build_coreset(embeddings, quality_sample_size, n_centers=2 * optimal_k)
+        quality = quality_metrics(coreset['points'], np.asarray(labels[coreset['indices']]), optimal_k,
+                                  sample_weight=coreset['weights'])
+        quality['coreset'] = describe_coreset(coreset)
+        print(f"coreset ({len(coreset['indices'])} 行) 上的轮廓系数: {quality['silhouette']:.4f}, "
+              f"DB: {quality['davies_bouldin']:.4f}, CH: {quality['calinski_harabasz']:.1f}")
+    elif quantized is not None:
+        # 量化模式在解码的均匀采样上计算质量指标，不读取float32存储，也不导出逐样本轮廓系数
+        sample_size = min(quantized_quality_size, len(quantized))
+        sample_rows = np.sort(np.random.RandomState(42).choice(len(quantized), sample_size, replace=False))
+        quality = quality_metrics(normalize_embeddings(quantized.decode(sample_rows)),
+                                  np.asarray(labels[sample_rows]), optimal_k)
+        quality['decoded_sample_size'] = int(sample_size)
+        print(f"解码采样 ({sample_size} 行) 上的轮廓系数: {quality['silhouette']:.4f}, "
+              f"DB: {quality['davies_bouldin']:.4f}, CH: {quality['calinski_harabasz']:.1f}")
+    elif noise_samples:
+        # 质量指标只在非噪声样本上计算
+        clustered = np.flatnonzero(labels >= 0)
+        quality = quality_metrics(embeddings[clustered], labels[clustered], optimal_k, per_sample=True)
+        print(f"非噪声样本的轮廓系数: {quality['silhouette']:.4f}, 简化轮廓系数: {quality['simplified_silhouette']:.4f}, "
+              f"DB: {quality['davies_bouldin']:.4f}, CH: {quality['calinski_harabasz']:.1f}")
+        export_sample_silhouette("../results/sample_silhouette.csv", [row_ids[row] for row in clustered],
+                                 labels[clustered], quality)
+    elif duplicates:
+        # 在代表行上按重复次数加权计算，逐样本轮廓系数扩展到组内所有行
+        representatives = duplicates['representatives']
+        quality = quality_metrics(fit_embeddings, labels[representatives], optimal_k, per_sample=True,
+                                  sample_weight=fit_weight)
+        for key in ('sample_silhouette', 'sample_simplified_silhouette'):
+            if key in quality:
+                quality[key] = quality[key][duplicates['group_of']]
+        print(f"加权轮廓系数 ({len(representatives)} 个代表行): {quality['silhouette']:.4f}, "
+              f"简化轮廓系数: {quality['simplified_silhouette']:.4f}, "
+              f"DB: {quality['davies_bouldin']:.4f}, CH: {quality['calinski_harabasz']:.1f}")
+        export_sample_silhouette("../results/sample_silhouette.csv", row_ids, labels, quality)
+    else:
+        quality = quality_metrics(embeddings, labels, optimal_k, per_sample=True)
+        print(f"全量轮廓系数: {quality['silhouette']:.4f}, 简化轮廓系数: {quality['simplified_silhouette']:.4f}, "
+              f"DB: {quality['davies_bouldin']:.4f}, CH: {quality['calinski_harabasz']:.1f}")
+        export_sample_silhouette("../results/sample_silhouette.csv", row_ids, labels, quality)
     print(f"聚类分布:")
-    unique, counts = np.unique(labels, return_counts=True)
-    for cluster_id, count in zip(unique, counts):
-        print(f"  聚类 {cluster_id}: {count} 个样本")
+    cluster_sizes = np.bincount(labels[labels >= 0], minlength=optimal_k)
+    for cluster_id, count in enumerate(cluster_sizes):
+        if count:
+            print(f"  聚类 {cluster_id}: {count} 个样本")
+    if noise_samples:
+        print(f"  噪声: {noise_samples} 个样本")
     
     # 为每个聚类提取最相似的样本并生成摘要
     print(f"\n为每个聚类提取最相似的{top_n_samples}个样本并生成摘要...")
     print("="*50)
     
     cluster_summaries = []
+    summary_failures = 0
     
     for cluster_id in range(optimal_k):
         print(f"\n处理聚类 {cluster_id}...")
         
-        # 找到该聚类的所有样本
-        cluster_indices = np.where(labels == cluster_id)[0]
-        cluster_center = mbk.cluster_centers_[cluster_id]
-        
-        # 归一化聚类中心（用于余弦相似度计算）
-        cluster_center_norm = cluster_center / np.linalg.norm(cluster_center) if np.linalg.norm(cluster_center) > 0 else cluster_center
-        
         # 获取最相似的样本
-        top_indices = get_top_similar_samples(embeddings, cluster_center_norm, cluster_indices, top_n_samples)
-        top_samples = [data[idx] for idx in top_indices]
+        top_samples = [data[idx] for idx in top_by_cluster[cluster_id]]
+        
+        lineage = lineages[cluster_id]
         
-        # 生成摘要
-        print(f"  生成摘要...")
-        summary = generate_cluster_summary(top_samples)
+        # 生成摘要（编号对齐后未变化的聚类沿用上次的摘要）；失败时写入占位文本并记录summary_error
+        summary_error = None
+        summary_status = 'generated'
+        if cluster_id in reused_summaries:
+            print(f"  聚类未变化 (stable_id={lineage['stable_id']})，沿用上次的摘要")
+            summary = reused_summaries[cluster_id]
+            summary_status = 'reused'
+        elif pipeline:
+            summary = pipeline.result(cluster_id)
+            summary_error = pipeline.failures.get(cluster_id)
+        else:
+            print(f"  生成摘要...")
+            try:
+                summary = generate_cluster_summary(top_samples)
+            except Exception as e:
+                print(f"生成摘要时出错: {e}")
+                summary_error = str(e)
+        if summary_error is not None:
+            summary = fallback_summary(int(cluster_sizes[cluster_id]))
+            summary_status = 'failed'
+            summary_failures += 1
         
         cluster_info = {
             'cluster_id': int(cluster_id),
-            'size': int(len(cluster_indices)),
+            'stable_id': lineage['stable_id'] if lineage else int(cluster_id),
+            'status': lineage['status'] if lineage else 'new',
+            'previous_stable_ids': lineage['previous_stable_ids'] if lineage else [],
+            'size': int(cluster_sizes[cluster_id]),
             'top_samples': [
                 {
                     'id': sample['id'],
@@ -399,22 +897,45 @@ def main():
                 }
                 for sample in top_samples
             ],
-            'summary': summary
+            'summary': summary,
+            'summary_status': summary_status
         }
+        if summary_error is not None:
+            cluster_info['summary_error'] = summary_error
+        if farthest_n_samples:
+            cluster_info['farthest_samples'] = [
+                {
+                    'id': data[idx]['id'],
+                    'output_preview': data[idx].get('output', '')[:200],
+                    'similarity': float(similarities[idx])
+                }
+                for idx in farthest_by_cluster.get(cluster_id, [])
+            ]
         
         cluster_summaries.append(cluster_info)
         
         print(f"  摘要: {summary[:100]}...")
-        time.sleep(0.5)  # 避免API限流
+        if pipeline is None and cluster_id not in reused_summaries:
+            time.sleep(0.5)  # 避免API限流
+    
+    if pipeline:
+        print(f"\n摘要流水线完成，提交后共耗时 {pipeline.close():.1f}s")
+    if summary_failures:
+        print(f"{summary_failures} 个聚类的摘要生成失败（结果中记录了summary_error，下次运行会重新生成）")
     
     # 保存结果
-    output_file = "../results/cluster_results.json"
     with open(output_file, 'w', encoding='utf-8') as f:
         json.dump({
             'optimal_k': optimal_k,
             'k_selection_results': k_results,
+            'assignments': assignments_base,
+            'quality': {key: value for key, value in quality.items() if not key.startswith('sample_')},
             'cluster_summaries': cluster_summaries,
-            'total_samples': len(data)
+            'noise_samples': noise_samples,
+            'reduction': reduction_info,
+            'near_duplicates': duplicates['info'] if duplicates else None,
+            'cluster_alignment': describe_alignment(alignment) if alignment else None,
+            'total_samples': len(embeddings)
         }, f, ensure_ascii=False, indent=2)
     
     print(f"\n结果已保存到: {output_file}")
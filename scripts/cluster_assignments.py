@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+聚类分配结果的紧凑存储，供下游脚本直接加载而无需重新拟合
+- <base>.labels.npy: int16 所属聚类（密度聚类的噪声点为 -1）
+- <base>.similarity.npy: float32 与所属聚类中心的余弦相似度
+- <base>.second.npy: int16 第二近的聚类
+- <base>.second_similarity.npy: float32 与第二近聚类中心的余弦相似度
+- <base>.centroids.npy: float32 (k, dim) 由全部成员计算的归一化聚类中心
+- <base>.ids.npy: 定长unicode的行id（与embedding存储的行顺序一致，可memmap）
+- <base>.index.json: 元数据（行数、聚类数、维度等）
+- <base>.stats.json: 每个聚类的样本数、簇内相似度均值/分位数、与第二近聚类的平均间隔
+
+全部按块计算，.npy以memmap写入，分位数由固定分箱的直方图得到（精度 2/SIMILARITY_BINS）
+
+用法（查看已保存的聚类统计）:
+    python cluster_assignments.py ../results/cluster_assignments
+"""
+import json
+import os
+import sys
+from typing import Dict, List, Tuple
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from embedding_store import ids_array
+from spherical_kmeans import normalize_rows
+
+BLOCK_ROWS = 65536
+SIMILARITY_BINS = 2000  # 余弦相似度[-1, 1]的直方图分箱数
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def assignment_paths(base: str) -> Dict[str, str]:
+    """返回分配结果各组成文件的路径"""
+    return {
+        'labels': base + '.labels.npy',
+        'similarity': base + '.similarity.npy',
+        'second': base + '.second.npy',
+        'second_similarity': base + '.second_similarity.npy',
+        'centroids': base + '.centroids.npy',
+        'ids': base + '.ids.npy',
+        'index': base + '.index.json',
+        'stats': base + '.stats.json',
+    }
+
+
+def assignment_exists(base: str) -> bool:
+    paths = assignment_paths(base)
+    return all(os.path.exists(paths[key]) for key in ('labels', 'similarity', 'centroids', 'index'))
+
+
+def _histogram_percentiles(histogram: np.ndarray, percentiles=PERCENTILES) -> Dict[str, float]:
+    """由直方图求分位数（取所在分箱的中点）"""
+    total = histogram.sum()
+    if total == 0:
+        return {f'p{p}': None for p in percentiles}
+    cumulative = np.cumsum(histogram)
+    centers = -1.0 + (np.arange(len(histogram)) + 0.5) * 2.0 / len(histogram)
+    return {f'p{p}': float(centers[np.searchsorted(cumulative, total * p / 100.0)]) for p in percentiles}
+
+
+def own_centroid_similarity(matrix: np.ndarray, labels: np.ndarray, centroids: np.ndarray,
+                            block_rows: int = BLOCK_ROWS) -> np.ndarray:
+    """每行与所属聚类中心的余弦相似度：按块做一次逐行点积，不按聚类复制数据"""
+    centroids = normalize_rows(centroids)
+    sims = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), block_rows):
+        block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+        block_labels = np.asarray(labels[start:start + len(block)], dtype=np.int64)
+        # 除以行范数代替逐块归一化，避免复制整个块
+        norms = np.sqrt(np.einsum('ij,ij->i', block, block))
+        norms[norms == 0] = 1.0
+        sims[start:start + len(block)] = np.einsum('ij,ij->i', block, centroids[block_labels]) / norms
+    return sims
+
+
+def _read_block(matrix, start: int, block_rows: int) -> np.ndarray:
+    """按块读取行；量化矩阵（embedding_quantization.QuantizedMatrix）按块解码为近似的float32向量"""
+    if hasattr(matrix, 'decode'):
+        return matrix.decode(slice(start, start + block_rows))
+    return matrix[start:start + block_rows]
+
+
+def _group_by_label(labels: np.ndarray, n_clusters: int) -> Tuple[np.ndarray, np.ndarray]:
+    """稳定排序把行号按聚类分组，返回 (分组后的行号, 每组起始位置)；噪声行（标签<0）排在最前，不属于任何组"""
+    labels = np.asarray(labels)
+    order = np.argsort(labels, kind='stable')
+    members = labels >= 0
+    n_noise = len(labels) - int(members.sum())
+    starts = n_noise + np.concatenate([[0], np.cumsum(np.bincount(labels[members], minlength=n_clusters))])
+    return order, starts
+
+
+def representative_samples(similarities: np.ndarray, labels: np.ndarray, n_clusters: int, top_n: int = 10,
+                           farthest_n: int = 0) -> Tuple[Dict[int, List[int]], Dict[int, List[int]]]:
+    """
+    按组argpartition一次取出所有聚类的代表样本：
+    与中心最相似的top_n行，以及（farthest_n>0时）最不相似的farthest_n行，用于离群样本检查
+    返回 (聚类 -> top行号列表（相似度降序）, 聚类 -> farthest行号列表（相似度升序）)
+    """
+    order, starts = _group_by_label(labels, n_clusters)
+    grouped_sims = np.asarray(similarities, dtype=np.float32)[order]
+    top, farthest = {}, {}
+    for cluster_id in range(n_clusters):
+        start, end = starts[cluster_id], starts[cluster_id + 1]
+        sims = grouped_sims[start:end]
+        rows = order[start:end]
+        m = min(top_n, len(sims))
+        if m:
+            picked = np.argpartition(-sims, m - 1)[:m]
+            top[cluster_id] = rows[picked[np.argsort(-sims[picked], kind='stable')]].tolist()
+        else:
+            top[cluster_id] = []
+        if farthest_n:
+            m = min(farthest_n, len(sims))
+            if m:
+                picked = np.argpartition(sims, m - 1)[:m]
+                farthest[cluster_id] = rows[picked[np.argsort(sims[picked], kind='stable')]].tolist()
+            else:
+                farthest[cluster_id] = []
+    return top, farthest
+
+
+def _merge_running_top(top_sims: np.ndarray, top_rows: np.ndarray, block_labels: np.ndarray,
+                       block_sims: np.ndarray, offset: int):
+    """把一个块的成员并入每个聚类当前的top候选（按相似度取最大），原地更新"""
+    n = top_sims.shape[1]
+    order, starts = _group_by_label(block_labels, len(top_sims))
+    for cluster_id in np.nonzero(np.diff(starts))[0]:
+        members = order[starts[cluster_id]:starts[cluster_id + 1]]
+        candidate_sims = np.concatenate([top_sims[cluster_id], block_sims[members]])
+        candidate_rows = np.concatenate([top_rows[cluster_id], members + offset])
+        keep = np.argpartition(-candidate_sims, n - 1)[:n]
+        top_sims[cluster_id] = candidate_sims[keep]
+        top_rows[cluster_id] = candidate_rows[keep]
+
+
+def _finish_running_top(top_sims: np.ndarray, top_rows: np.ndarray) -> Dict[int, List[int]]:
+    result = {}
+    for cluster_id in range(len(top_sims)):
+        order = np.argsort(-top_sims[cluster_id], kind='stable')
+        result[cluster_id] = [int(row) for row in top_rows[cluster_id][order] if row >= 0]
+    return result
+
+
+def write_assignments(base: str, matrix: np.ndarray, centers: np.ndarray, ids: List[str],
+                      labels: np.ndarray = None, metadata: Dict = None, top_n: int = 0, farthest_n: int = 0,
+                      block_rows: int = BLOCK_ROWS) -> Tuple[Dict[str, np.ndarray], Dict[int, List[int]], Dict[int, List[int]]]:
+    """
+    按块计算并写入分配结果。labels为None时分配到余弦相似度最大的中心，
+    否则沿用给定标签（与聚类器的输出保持一致），第二近聚类为其余中心中相似度最大的
+    给定标签中的噪声行（-1）保留标签，相似度/第二近聚类按最近的中心计算，不计入聚类统计和代表样本
+    top_n / farthest_n >0 时在同一遍中合并出每个聚类最相似 / 最不相似的行（内存只与k和N有关）
+    matrix可以是memmap或QuantizedMatrix（按块解码，不读取float32存储）
+    返回 (各列的memmap, 聚类 -> top行号列表, 聚类 -> farthest行号列表)
+    """
+    centers = normalize_rows(centers)
+    k, dim = centers.shape
+    n = len(matrix)
+    if k > np.iinfo(np.int16).max:
+        raise ValueError(f"聚类数 {k} 超出int16范围")
+    paths = assignment_paths(base)
+    os.makedirs(os.path.dirname(paths['labels']) or '.', exist_ok=True)
+    columns = {
+        'labels': open_memmap(paths['labels'], mode='w+', dtype=np.int16, shape=(n,)),
+        'similarity': open_memmap(paths['similarity'], mode='w+', dtype=np.float32, shape=(n,)),
+        'second': open_memmap(paths['second'], mode='w+', dtype=np.int16, shape=(n,)),
+        'second_similarity': open_memmap(paths['second_similarity'], mode='w+', dtype=np.float32, shape=(n,)),
+    }
+    member_sums = np.zeros((k, dim), dtype=np.float64)
+    histograms = np.zeros((k, SIMILARITY_BINS), dtype=np.int64)
+    margin_sums = np.zeros(k, dtype=np.float64)
+    similarity_sums = np.zeros(k, dtype=np.float64)
+    sim_min = np.full(k, np.inf)
+    sim_max = np.full(k, -np.inf)
+    top_sims = np.full((k, top_n), -np.inf, dtype=np.float32)
+    top_rows = np.full((k, top_n), -1, dtype=np.int64)
+    farthest_sims = np.full((k, farthest_n), -np.inf, dtype=np.float32)  # 存相似度的相反数
+    farthest_rows = np.full((k, farthest_n), -1, dtype=np.int64)
+    n_noise = 0
+
+    for start in range(0, n, block_rows):
+        block = normalize_rows(_read_block(matrix, start, block_rows))
+        rows = np.arange(len(block))
+        scores = block @ centers.T
+        if labels is None:
+            block_labels = scores.argmax(axis=1)
+        else:
+            block_labels = np.asarray(labels[start:start + len(block)], dtype=np.int64)
+        noise = block_labels < 0
+        nearest = np.where(noise, scores.argmax(axis=1), block_labels) if noise.any() else block_labels
+        block_sims = scores[rows, nearest]
+        if k > 1:
+            scores[rows, nearest] = -np.inf
+            block_second = scores.argmax(axis=1)
+            block_second_sims = scores[rows, block_second]
+        else:
+            block_second = np.zeros(len(block), dtype=np.int64)
+            block_second_sims = np.full(len(block), -1.0, dtype=np.float32)
+
+        end = start + len(block)
+        columns['labels'][start:end] = block_labels
+        columns['similarity'][start:end] = block_sims
+        columns['second'][start:end] = block_second
+        columns['second_similarity'][start:end] = block_second_sims
+
+        n_noise += int(noise.sum())
+        members = ~noise
+        member_labels, member_sims = block_labels[members], block_sims[members]
+        one_hot = np.zeros((len(block), k), dtype=np.float32)
+        one_hot[rows[members], member_labels] = 1.0
+        member_sums += one_hot.T @ block
+        bins = np.clip(((member_sims + 1.0) * SIMILARITY_BINS / 2.0).astype(np.int64), 0, SIMILARITY_BINS - 1)
+        histograms += np.bincount(member_labels * SIMILARITY_BINS + bins,
+                                  minlength=k * SIMILARITY_BINS).reshape(k, SIMILARITY_BINS)
+        margin_sums += np.bincount(member_labels, weights=member_sims - block_second_sims[members], minlength=k)
+        similarity_sums += np.bincount(member_labels, weights=member_sims, minlength=k)
+        np.minimum.at(sim_min, member_labels, member_sims)
+        np.maximum.at(sim_max, member_labels, member_sims)
+
+        if top_n:
+            _merge_running_top(top_sims, top_rows, block_labels, block_sims, start)
+        if farthest_n:
+            _merge_running_top(farthest_sims, farthest_rows, block_labels, -block_sims, start)
+
+    for column in columns.values():
+        column.flush()
+
+    sizes = histograms.sum(axis=1)
+    centroids = normalize_rows(member_sums)
+    np.save(paths['centroids'], centroids)
+
+    stats = []
+    for cluster_id in range(k):
+        size = int(sizes[cluster_id])
+        entry = {'cluster_id': cluster_id, 'size': size}
+        if size:
+            entry.update({
+                'similarity_mean': float(similarity_sums[cluster_id] / size),  # 精确值，不受直方图分箱影响
+                'similarity_min': float(sim_min[cluster_id]),
+                'similarity_max': float(sim_max[cluster_id]),
+                'similarity_percentiles': _histogram_percentiles(histograms[cluster_id]),
+                'margin_mean': float(margin_sums[cluster_id] / size)
+            })
+        stats.append(entry)
+
+    index = dict(metadata or {})
+    np.save(paths['ids'], ids_array(ids))
+    index.update({'count': n, 'n_clusters': k, 'dim': dim})
+    with open(paths['index'], 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    with open(paths['stats'], 'w', encoding='utf-8') as f:
+        json.dump({'n_clusters': k, 'count': n, 'noise': n_noise, 'clusters': stats}, f, ensure_ascii=False, indent=2)
+
+    top = _finish_running_top(top_sims, top_rows) if top_n else {}
+    farthest = _finish_running_top(farthest_sims, farthest_rows) if farthest_n else {}
+    return columns, top, farthest
+
+
+def load_assignments(base: str, mmap: bool = True) -> Dict:
+    """加载分配结果：ids、各列数组（默认memmap）、聚类中心和元数据（旧格式的ids在索引JSON中）"""
+    paths = assignment_paths(base)
+    mode = 'r' if mmap else None
+    with open(paths['index'], 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    result = {
+        'ids': np.load(paths['ids'], mmap_mode=mode) if os.path.exists(paths['ids']) else index.pop('ids'),
+        'metadata': index,
+        'centroids': np.load(paths['centroids']),
+    }
+    for key in ('labels', 'similarity', 'second', 'second_similarity'):
+        result[key] = np.load(paths[key], mmap_mode=mode)
+    return result
+
+
+def load_centroids(base: str) -> np.ndarray:
+    """只加载由全部成员计算的归一化聚类中心 (k, dim)"""
+    return np.load(assignment_paths(base)['centroids'])
+
+
+def load_cluster_stats(base: str) -> Dict:
+    """只加载每个聚类的统计信息（很小，可即时读取）"""
+    with open(assignment_paths(base)['stats'], 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def print_cluster_stats(stats: Dict):
+    print(f"{'聚类':>6} {'样本数':>9} {'平均相似度':>10} {'p5':>7} {'p50':>7} {'p95':>7} {'平均间隔':>9}")
+    for entry in stats['clusters']:
+        if not entry['size']:
+            print(f"{entry['cluster_id']:>6} {0:>9}")
+            continue
+        p = entry['similarity_percentiles']
+        print(f"{entry['cluster_id']:>6} {entry['size']:>9} {entry['similarity_mean']:>10.4f} "
+              f"{p['p5']:>7.3f} {p['p50']:>7.3f} {p['p95']:>7.3f} {entry['margin_mean']:>9.4f}")
+
+
+if __name__ == "__main__":
+    base = sys.argv[1] if len(sys.argv) > 1 else "../results/cluster_assignments"
+    stats = load_cluster_stats(base)
+    print(f"聚类分配: {base} (共 {stats['count']} 行, {stats['n_clusters']} 个聚类, 噪声 {stats.get('noise', 0)} 行)")
+    print_cluster_stats(stats)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+持久化的聚类模型与每日增量分配
+- <base>.json: k、聚类引擎、embedding模型与预处理（截断维度/存储格式/降维/归一化）、各聚类累计样本数、
+  全量拟合时的簇内相似度基线（均值与p5）、已分配的行数、各位置的稳定聚类id（见cluster_alignment.py），
+  以及每次增量运行的漂移记录
+- <base>.centroids.npy: 当前中心（增量运行中用小批量更新）
+- <base>.reference.npy: 上次全量拟合时的中心（漂移基线，增量运行不修改）
+
+增量模式只读取embedding存储中新追加的行：分配到最近的中心，把可分配的行按MiniBatchSphericalKMeans的规则
+（normalize(count·c + batch_sum)）更新中心，并统计每个聚类的中心偏移、簇内相似度下降和无法分配的比例。
+任一指标超过阈值、或embedding模型/预处理与模型不一致时，需要重新选择k并全量拟合。
+
+用法（查看模型和最近几次增量运行的漂移）:
+    python cluster_model.py ../results/cluster_model
+"""
+import json
+import os
+import sys
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+from cluster_assignments import BLOCK_ROWS, load_centroids, load_cluster_stats, write_assignments
+from dimensionality_reduction import load_reducer, transform_blocked
+from embedding_store import load_index, open_embeddings, store_exists, truncate_embeddings
+from spherical_kmeans import MiniBatchSphericalKMeans, normalize_rows
+
+UNASSIGNABLE_PERCENTILE = 'p5'  # 与最近中心的相似度低于该聚类全量拟合时的这一分位数即视为无法分配
+DRIFT_THRESHOLDS = {
+    'max_centroid_shift': 0.02,  # 任一聚类中心与基线的余弦距离
+    'max_similarity_drop': 0.05,  # 任一聚类（新增行数不少于min_drift_rows）新样本的平均相似度比基线下降的幅度
+    'mean_similarity_drop': 0.03,  # 按新增行数加权的平均相似度下降（分散在各聚类的整体漂移）
+    'max_unassignable_fraction': 0.15,  # 新样本中无法分配的比例（正常数据约为5%）
+    'min_drift_rows': 50,  # 新增行数少于该值的聚类不参与max_similarity_drop（一两行的均值波动太大）
+}
+
+
+def model_paths(base: str) -> Dict[str, str]:
+    return {
+        'model': base + '.json',
+        'centroids': base + '.centroids.npy',
+        'reference': base + '.reference.npy',
+    }
+
+
+def model_exists(base: str) -> bool:
+    return all(os.path.exists(path) for path in model_paths(base).values())
+
+
+def embedding_model_name(embeddings_file: str) -> str:
+    """embedding存储中记录的模型名（旧的JSON文件没有时返回None）"""
+    if store_exists(embeddings_file):
+        return load_index(embeddings_file).get('model_name')
+    return None
+
+
+def save_model(base: str, model: Dict, centroids: np.ndarray, reference: np.ndarray = None):
+    paths = model_paths(base)
+    os.makedirs(os.path.dirname(paths['model']) or '.', exist_ok=True)
+    np.save(paths['centroids'], np.asarray(centroids, dtype=np.float32))
+    if reference is not None:
+        np.save(paths['reference'], np.asarray(reference, dtype=np.float32))
+    with open(paths['model'], 'w', encoding='utf-8') as f:
+        json.dump(model, f, ensure_ascii=False, indent=2)
+
+
+def load_model(base: str) -> Dict:
+    """返回模型元数据，附带 'centroids' 和 'reference' 两个数组"""
+    paths = model_paths(base)
+    with open(paths['model'], 'r', encoding='utf-8') as f:
+        model = json.load(f)
+    model['centroids'] = np.load(paths['centroids'])
+    model['reference'] = np.load(paths['reference'])
+    return model
+
+
+def save_fitted_model(base: str, assignments_base: str, ids: List[str], preprocessing: Dict,
+                      stable_ids: List[int] = None, next_stable_id: int = None):
+    """
+    全量拟合后由分配结果生成模型：中心取全部成员计算的归一化中心，相似度基线取分配统计
+    preprocessing: embeddings_file / embedding_model / embedding_dim / embedding_format / clustering_engine /
+    reduction / reduction_base
+    stable_ids / next_stable_id: 编号对齐的结果（None时为0..k-1）
+    """
+    centroids = load_centroids(assignments_base)
+    stats = load_cluster_stats(assignments_base)['clusters']
+    model = dict(preprocessing)
+    model.update({
+        'n_clusters': len(centroids),
+        'normalized': True,
+        'fitted_at': datetime.now().isoformat(timespec='seconds'),
+        'assigned_count': len(ids),
+        'last_id': str(ids[-1]) if len(ids) else None,
+        'counts': [entry['size'] for entry in stats],
+        'stable_ids': list(range(len(centroids))) if stable_ids is None else stable_ids,
+        'next_stable_id': len(centroids) if next_stable_id is None else next_stable_id,
+        'reference_similarity_mean': [entry.get('similarity_mean') for entry in stats],
+        'unassignable_threshold': [
+            entry['similarity_percentiles'][UNASSIGNABLE_PERCENTILE] if entry['size'] else None for entry in stats
+        ],
+        'history': []
+    })
+    save_model(base, model, centroids, centroids)
+    print(f"聚类模型已保存到: {model_paths(base)['model']}")
+
+
+def check_compatibility(model: Dict, embeddings_file: str, ids: List[str], preprocessing: Dict) -> List[str]:
+    """模型与当前数据不兼容（需要全量重新拟合）的原因列表"""
+    reasons = []
+    for key in ('embeddings_file', 'embedding_model', 'embedding_dim', 'embedding_format', 'clustering_engine',
+                'reduction'):
+        if model.get(key) != preprocessing.get(key):
+            reasons.append(f"{key} 已变化: {model.get(key)} -> {preprocessing.get(key)}")
+    assigned = model['assigned_count']
+    if len(ids) < assigned or (assigned and ids[assigned - 1] != model['last_id']):
+        reasons.append(f"{embeddings_file} 不是在上次分配的数据之后追加的（行数或id不一致）")
+    return reasons
+
+
+def incremental_update(model: Dict, new_rows: np.ndarray, batch_size: int = 1000, seed: int = 42,
+                       block_rows: int = BLOCK_ROWS,
+                       min_drift_rows: int = DRIFT_THRESHOLDS['min_drift_rows']) -> Dict:
+    """
+    对新行做一遍分块分配，可分配的行按小批量更新model['centroids']和model['counts']（原地修改），
+    返回本次运行的漂移报告（max_similarity_drop只统计新增行数不少于min_drift_rows的聚类，
+    mean_similarity_drop按新增行数加权覆盖所有聚类）
+    """
+    k = model['n_clusters']
+    thresholds = np.array([-np.inf if t is None else t for t in model['unassignable_threshold']], dtype=np.float32)
+    kmeans = MiniBatchSphericalKMeans(n_clusters=k, batch_size=batch_size, reassignment_ratio=0.0,
+                                      random_state=seed)
+    # 从已保存的状态继续（不重新初始化，也不重新分配样本少的中心，保证聚类编号不变）
+    kmeans.cluster_centers_ = normalize_rows(model['centroids'])
+    kmeans.counts_ = np.asarray(model['counts'], dtype=np.float64)
+    kmeans.n_steps_ = 0
+    kmeans._rng = np.random.RandomState(seed)
+
+    sizes = np.zeros(k, dtype=np.int64)
+    similarity_sums = np.zeros(k, dtype=np.float64)
+    unassignable = np.zeros(k, dtype=np.int64)
+    for start in range(0, len(new_rows), block_rows):
+        block = normalize_rows(new_rows[start:start + block_rows])
+        scores = block @ kmeans.cluster_centers_.T
+        labels = scores.argmax(axis=1)
+        sims = scores[np.arange(len(block)), labels]
+        sizes += np.bincount(labels, minlength=k)
+        similarity_sums += np.bincount(labels, weights=sims, minlength=k)
+        outliers = sims < thresholds[labels]
+        unassignable += np.bincount(labels[outliers], minlength=k)
+        assignable = block[~outliers]
+        order = np.random.RandomState(seed + start).permutation(len(assignable))
+        for batch_start in range(0, len(assignable), batch_size):
+            kmeans.partial_fit(assignable[order[batch_start:batch_start + batch_size]])
+
+    centroids = kmeans.cluster_centers_
+    centroid_shift = 1.0 - np.einsum('ij,ij->i', centroids, normalize_rows(model['reference']))
+    reference_mean = np.array([np.nan if m is None else m for m in model['reference_similarity_mean']])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        new_mean = np.where(sizes > 0, similarity_sums / np.maximum(sizes, 1), np.nan)
+    similarity_drop = reference_mean - new_mean
+    counted = (sizes >= min_drift_rows) & np.isfinite(similarity_drop)
+    weighted = (sizes > 0) & np.isfinite(similarity_drop)
+
+    model['centroids'] = centroids
+    model['counts'] = kmeans.counts_.round().astype(np.int64).tolist()
+    n_new = len(new_rows)
+    return {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'new_rows': n_new,
+        'unassignable_fraction': float(unassignable.sum() / n_new) if n_new else 0.0,
+        'max_centroid_shift': float(np.nanmax(centroid_shift)) if k else 0.0,
+        'max_similarity_drop': float(similarity_drop[counted].max()) if counted.any() else 0.0,
+        'mean_similarity_drop': float(np.average(similarity_drop[weighted], weights=sizes[weighted]))
+        if weighted.any() else 0.0,
+        'min_drift_rows': int(min_drift_rows),
+        'clusters': [
+            {
+                'cluster_id': cluster_id,
+                'new_size': int(sizes[cluster_id]),
+                'unassignable': int(unassignable[cluster_id]),
+                'centroid_shift': float(centroid_shift[cluster_id]),
+                'similarity_drop': None if np.isnan(similarity_drop[cluster_id]) else float(similarity_drop[cluster_id])
+            }
+            for cluster_id in range(k)
+        ]
+    }
+
+
+def drift_reasons(report: Dict, thresholds: Dict = None) -> List[str]:
+    """超过阈值的漂移指标（非空表示需要全量重新拟合）"""
+    thresholds = thresholds or DRIFT_THRESHOLDS
+    reasons = []
+    for key, label in (('max_centroid_shift', '中心偏移'), ('max_similarity_drop', '簇内相似度下降'),
+                       ('mean_similarity_drop', '加权平均相似度下降'), ('max_unassignable_fraction', '无法分配比例')):
+        value = report['unassignable_fraction'] if key == 'max_unassignable_fraction' else report.get(key, 0.0)
+        if value > thresholds[key]:
+            reasons.append(f"{label} {value:.4f} 超过阈值 {thresholds[key]}")
+    return reasons
+
+
+def run_incremental(model_base: str, embeddings_file: str, assignments_base: str, preprocessing: Dict,
+                    thresholds: Dict = None, results_file: str = None, batch_size: int = 1000) -> bool:
+    """
+    每日增量运行：只分配上次之后追加的行并更新模型，结果写入 <assignments_base>.delta_<日期>.*
+    返回True表示增量完成；返回False表示需要全量重新选择k并拟合（模型不兼容或漂移超过阈值，模型不做修改）
+    """
+    model = load_model(model_base)
+    matrix, ids, _ = open_embeddings(embeddings_file)
+    reasons = check_compatibility(model, embeddings_file, ids, preprocessing)
+    if reasons:
+        print("聚类模型与当前数据不兼容，需要全量拟合:")
+        for reason in reasons:
+            print(f"  - {reason}")
+        return False
+
+    start = model['assigned_count']
+    new_rows = truncate_embeddings(matrix[start:], preprocessing.get('embedding_dim'))
+    if model.get('reduction'):
+        # 复用全量拟合时保存的降维变换
+        new_rows = transform_blocked(new_rows, load_reducer(model['reduction_base']))
+    print(f"增量模式: 模型已分配 {start} 行，新增 {len(new_rows)} 行 (k={model['n_clusters']})")
+    if not len(new_rows):
+        print("没有新增数据")
+        return True
+
+    thresholds = thresholds or DRIFT_THRESHOLDS
+    report = incremental_update(model, new_rows, batch_size, min_drift_rows=thresholds['min_drift_rows'])
+    print(f"  无法分配比例: {report['unassignable_fraction']:.4f}, 最大中心偏移: {report['max_centroid_shift']:.4f}, "
+          f"最大簇内相似度下降: {report['max_similarity_drop']:.4f} (新增不少于 {thresholds['min_drift_rows']} 行的聚类), "
+          f"加权平均相似度下降: {report['mean_similarity_drop']:.4f}")
+    reasons = drift_reasons(report, thresholds)
+    if reasons:
+        print("漂移超过阈值，需要重新选择k并全量拟合:")
+        for reason in reasons:
+            print(f"  - {reason}")
+        return False
+
+    delta_base = f"{assignments_base}.delta_{datetime.now().strftime('%Y%m%d')}"
+    columns, _, _ = write_assignments(delta_base, new_rows, model['centroids'], ids[start:], metadata={
+        'embeddings_file': embeddings_file, 'row_offset': start, 'model': model_base})
+    new_sizes = np.bincount(columns['labels'], minlength=model['n_clusters'])
+    print(f"新增行的分配结果已保存到: {delta_base}.*")
+
+    centroids = model.pop('centroids')
+    model.pop('reference')  # 基线只在全量拟合时更新
+    model['assigned_count'] = len(ids)
+    model['last_id'] = ids[-1]
+    model['history'].append({key: value for key, value in report.items() if key != 'clusters'})
+    model['last_report'] = report
+    save_model(model_base, model, centroids)
+
+    if results_file and os.path.exists(results_file):
+        # 摘要沿用上次全量运行的结果，只更新聚类大小和总数
+        with open(results_file, 'r', encoding='utf-8') as f:
+            results = json.load(f)
+        for cluster_info in results.get('cluster_summaries', []):
+            cluster_info['size'] += int(new_sizes[cluster_info['cluster_id']])
+        results['total_samples'] = len(ids)
+        results.setdefault('incremental_assignments', []).append(delta_base)
+        with open(results_file, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"已更新聚类大小: {results_file}")
+    return True
+
+
+if __name__ == "__main__":
+    base = sys.argv[1] if len(sys.argv) > 1 else "../results/cluster_model"
+    model = load_model(base)
+    print(f"聚类模型: {base} (k={model['n_clusters']}, 引擎: {model.get('clustering_engine')}, "
+          f"embedding模型: {model.get('embedding_model')}, 拟合于 {model['fitted_at']})")
+    print(f"已分配 {model['assigned_count']} 行")
+    print(f"{'日期':<20} {'新增行数':>9} {'无法分配':>9} {'中心偏移':>9} {'相似度下降':>10}")
+    for entry in model['history'][-10:]:
+        print(f"{entry['date']:<20} {entry['new_rows']:>9} {entry['unassignable_fraction']:>9.4f} "
+              f"{entry['max_centroid_shift']:>9.4f} {entry['max_similarity_drop']:>10.4f}")
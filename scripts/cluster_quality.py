@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+全量数据上的聚类质量指标（分块float32矩阵乘法，内存占用与数据量无关）
+- 简化轮廓系数: 样本到自身簇中心与到最近其他簇中心的余弦距离
+- 精确余弦轮廓系数: 向量归一化后，样本到某簇所有成员的余弦距离之和 = n_j - x·S_j
+  （S_j为该簇归一化向量之和），因此无需计算n×n距离矩阵，复杂度为O(n·k·d)
+- Davies-Bouldin 与 Calinski-Harabasz（欧氏距离，与sklearn定义一致）
+- 可导出逐样本轮廓系数，用于在看板中标记处于簇边界的会话
+- 支持样本权重（如coreset.py的加权coreset）：簇大小、向量和与各项平均都按权重计算
+"""
+import csv
+from typing import Dict, List
+
+import numpy as np
+
+BLOCK_ROWS = 65536
+BORDERLINE_SILHOUETTE = 0.05  # 轮廓系数低于该值的样本视为边界样本
+
+
+def _unit_rows(block: np.ndarray) -> np.ndarray:
+    block = np.array(block, dtype=np.float32)
+    norms = np.linalg.norm(block, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    block /= norms
+    return block
+
+
+def _one_hot(labels: np.ndarray, k: int) -> np.ndarray:
+    one_hot = np.zeros((len(labels), k), dtype=np.float32)
+    one_hot[np.arange(len(labels)), labels] = 1.0
+    return one_hot
+
+
+def cluster_sums(embeddings: np.ndarray, labels: np.ndarray, k: int, block_rows: int = BLOCK_ROWS,
+                 sample_weight: np.ndarray = None) -> Dict[str, np.ndarray]:
+    """分块累加每个簇的样本数、权重和、原始向量之和与归一化向量之和（有权重时向量按权重累加）"""
+    dim = embeddings.shape[1]
+    counts = np.bincount(labels, minlength=k).astype(np.int64)
+    weight_sums = counts.astype(np.float64) if sample_weight is None else np.bincount(
+        labels, weights=sample_weight, minlength=k)
+    raw_sums = np.zeros((k, dim), dtype=np.float64)
+    unit_sums = np.zeros((k, dim), dtype=np.float64)
+    for start in range(0, len(embeddings), block_rows):
+        block = np.asarray(embeddings[start:start + block_rows], dtype=np.float32)
+        one_hot_t = _one_hot(labels[start:start + block_rows], k).T
+        if sample_weight is not None:
+            one_hot_t *= sample_weight[start:start + block_rows].astype(np.float32)
+        raw_sums += one_hot_t @ block
+        unit_sums += one_hot_t @ _unit_rows(block)
+    return {'counts': counts, 'weight_sums': weight_sums, 'raw_sums': raw_sums, 'unit_sums': unit_sums}
+
+
+def _silhouette_from_distances(own: np.ndarray, nearest_other: np.ndarray) -> np.ndarray:
+    denominator = np.maximum(own, nearest_other)
+    denominator[denominator == 0] = 1.0
+    return (nearest_other - own) / denominator
+
+
+def quality_metrics(embeddings: np.ndarray, labels: np.ndarray, k: int = None, exact: bool = True,
+                    per_sample: bool = False, block_rows: int = BLOCK_ROWS, sample_weight: np.ndarray = None) -> Dict:
+    """
+    在全部样本上计算聚类质量指标，embeddings可以是memmap（按块读取）
+    返回 silhouette（exact=True时为精确余弦轮廓系数）、simplified_silhouette、davies_bouldin、calinski_harabasz；
+    per_sample=True 时额外返回逐样本的 sample_silhouette / sample_simplified_silhouette
+    sample_weight: 每个样本代表的原始样本数，此时各指标为加权估计（轮廓系数取加权平均）
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    k = int(k if k is not None else labels.max() + 1)
+    n = len(labels)
+    weights = None if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+    sums = cluster_sums(embeddings, labels, k, block_rows, weights)
+    counts = sums['counts']
+    weight_sums = sums['weight_sums']
+    total_weight = float(weight_sums.sum())
+    present = counts > 0
+    n_present = int(present.sum())
+
+    centroids = np.zeros_like(sums['raw_sums'])
+    centroids[present] = sums['raw_sums'][present] / weight_sums[present, None]
+    centroids = centroids.astype(np.float32)
+    centroid_sq_norms = (centroids ** 2).sum(axis=1)
+    unit_sums = sums['unit_sums'].astype(np.float32)
+    unit_centroids = _unit_rows(unit_sums)
+
+    sample_silhouette = np.zeros(n, dtype=np.float32) if exact else None
+    sample_simplified = np.zeros(n, dtype=np.float32)
+    sq_distance_sums = np.zeros(k, dtype=np.float64)
+    distance_sums = np.zeros(k, dtype=np.float64)
+    # 空簇不能作为"最近的其他簇"
+    absent_penalty = np.where(present, 0.0, np.inf).astype(np.float32)
+
+    for start in range(0, n, block_rows):
+        block = np.asarray(embeddings[start:start + block_rows], dtype=np.float32)
+        block_labels = labels[start:start + block_rows]
+        rows = np.arange(len(block_labels))
+        unit_block = _unit_rows(block)
+
+        # 简化轮廓系数：到簇中心方向的余弦距离
+        center_distances = 1.0 - unit_block @ unit_centroids.T + absent_penalty
+        own = center_distances[rows, block_labels].copy()
+        center_distances[rows, block_labels] = np.inf
+        sample_simplified[start:start + len(block)] = _silhouette_from_distances(
+            np.maximum(own, 0), np.maximum(center_distances.min(axis=1), 0))
+
+        if exact:
+            # 精确余弦轮廓系数：到簇内所有成员的（加权）平均余弦距离，自身的距离为0，分母中去掉自身的权重
+            distance_totals = weight_sums[None, :].astype(np.float32) - unit_block @ unit_sums.T
+            own_counts = counts[block_labels]
+            own_weights = weight_sums[block_labels] - (1.0 if weights is None else weights[start:start + len(block)])
+            a = np.maximum(distance_totals[rows, block_labels], 0) / np.where(own_counts > 1, own_weights, 1.0)
+            mean_distances = distance_totals / np.where(present, weight_sums, 1.0)[None, :] + absent_penalty
+            mean_distances[rows, block_labels] = np.inf
+            b = np.maximum(mean_distances.min(axis=1), 0)
+            values = _silhouette_from_distances(a, b)
+            values[own_counts == 1] = 0.0  # 与sklearn一致：单样本簇的轮廓系数为0
+            sample_silhouette[start:start + len(block)] = values
+
+        # 欧氏距离平方：|x|^2 + |c|^2 - 2x·c（只取自身簇中心）
+        own_centroids = centroids[block_labels]
+        sq_distances = np.maximum(
+            (block ** 2).sum(axis=1) + centroid_sq_norms[block_labels] - 2 * (block * own_centroids).sum(axis=1), 0)
+        distances = np.sqrt(sq_distances)
+        if weights is not None:
+            block_weights = weights[start:start + len(block)]
+            sq_distances = sq_distances * block_weights
+            distances = distances * block_weights
+        sq_distance_sums += np.bincount(block_labels, weights=sq_distances, minlength=k)
+        distance_sums += np.bincount(block_labels, weights=distances, minlength=k)
+
+    result = {
+        'n_samples': n,
+        'n_clusters': n_present,
+        'simplified_silhouette': _mean(sample_simplified, weights) if n else 0.0,
+    }
+    if weights is not None:
+        result['total_weight'] = total_weight
+    if exact:
+        result['silhouette'] = _mean(sample_silhouette, weights) if n else 0.0
+
+    # Davies-Bouldin: 每个簇的平均簇内距离与簇中心间距之比
+    if n_present > 1:
+        scatter = distance_sums[present] / weight_sums[present]
+        present_centroids = centroids[present].astype(np.float64)
+        centroid_distances = np.sqrt(np.maximum(
+            (present_centroids ** 2).sum(1)[:, None] + (present_centroids ** 2).sum(1)[None, :]
+            - 2 * present_centroids @ present_centroids.T, 0))
+        np.fill_diagonal(centroid_distances, np.inf)
+        ratios = (scatter[:, None] + scatter[None, :]) / np.where(centroid_distances == 0, np.inf, centroid_distances)
+        result['davies_bouldin'] = float(ratios.max(axis=1).mean())
+
+        # Calinski-Harabasz: 簇间离散度与簇内离散度之比
+        mean = sums['raw_sums'].sum(axis=0) / total_weight
+        between = float((weight_sums[present] * ((centroids[present] - mean) ** 2).sum(axis=1)).sum())
+        within = float(sq_distance_sums.sum())
+        result['calinski_harabasz'] = (between * (total_weight - n_present) / (within * (n_present - 1))
+                                       if within > 0 else float('inf'))
+    else:
+        result['davies_bouldin'] = 0.0
+        result['calinski_harabasz'] = 0.0
+
+    if per_sample:
+        result['sample_simplified_silhouette'] = sample_simplified
+        if exact:
+            result['sample_silhouette'] = sample_silhouette
+    return result
+
+
+def _mean(values: np.ndarray, weights: np.ndarray = None) -> float:
+    if weights is None:
+        return float(values.mean())
+    return float(np.dot(values.astype(np.float64), weights) / weights.sum())
+
+
+def export_sample_silhouette(output_file: str, ids: List[str], labels: np.ndarray, quality: Dict,
+                             threshold: float = BORDERLINE_SILHOUETTE):
+    """导出逐样本轮廓系数CSV（id, cluster, silhouette, simplified_silhouette, borderline）"""
+    silhouette = quality.get('sample_silhouette', quality['sample_simplified_silhouette'])
+    simplified = quality['sample_simplified_silhouette']
+    with open(output_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'cluster', 'silhouette', 'simplified_silhouette', 'borderline'])
+        for sample_id, label, value, simple_value in zip(ids, labels, silhouette, simplified):
+            writer.writerow([sample_id, int(label), f"{value:.6f}", f"{simple_value:.6f}", int(value < threshold)])
+    borderline = int((silhouette < threshold).sum())
+    print(f"逐样本轮廓系数已保存到: {output_file} (边界样本 {borderline} 个, 阈值 {threshold})")
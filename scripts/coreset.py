@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+加权coreset（敏感度采样），用少量带权样本代替均匀采样做k值扫描和质量评估
+- 先在均匀抽取的试点样本上做k-means++，得到 n_centers 个粗中心（bicriteria近似解）
+- 按块把全部数据分配到最近的粗中心，得到每行的余弦距离 d(x)=1-cos 和所在粗簇的大小
+- 采样概率 q(x) = ½·d(x)/Σd + ½·1/(B·|簇(x)|)：离中心远的样本和小簇中的样本被优先抽到，
+  每个粗簇至少期望分到 size/(2B) 个样本，小意图不会因为均匀采样而被漏掉
+- 有放回抽取 size 次，权重 w = 1/(size·q)（重复抽中的行合并、权重相加），Σw 的期望为总行数
+matrix可以是memmap，只按块读取；相同的seed得到相同的coreset
+"""
+from typing import Dict
+
+import numpy as np
+
+from spherical_kmeans import BLOCK_ROWS, assign_blocked, kmeanspp_init, normalize_rows
+
+PILOT_SIZE = 20000  # 拟合粗中心的均匀试点样本数
+
+
+def build_coreset(matrix: np.ndarray, size: int, n_centers: int = 40, seed: int = 42,
+                  block_rows: int = BLOCK_ROWS) -> Dict:
+    """
+    返回 {'indices': 行号（升序）, 'points': 对应行（float32）, 'weights': float64权重,
+          'n_samples': 原始行数, 'effective_size': 权重的有效样本数}
+    """
+    n = len(matrix)
+    rng = np.random.RandomState(seed)
+    if n <= size:
+        return {'indices': np.arange(n), 'points': np.asarray(matrix[:], dtype=np.float32),
+                'weights': np.ones(n, dtype=np.float64), 'n_samples': n, 'effective_size': float(n)}
+
+    pilot_rows = np.sort(rng.choice(n, min(PILOT_SIZE, n), replace=False))
+    centers = kmeanspp_init(normalize_rows(matrix[pilot_rows]), min(n_centers, len(pilot_rows)), rng)
+    labels, sims = assign_blocked(matrix, centers, block_rows, normalize=True)
+
+    distances = np.maximum(1.0 - sims.astype(np.float64), 0)
+    cluster_sizes = np.bincount(labels, minlength=len(centers))
+    n_nonempty = int((cluster_sizes > 0).sum())
+    total = distances.sum()
+    probabilities = 0.5 / (n_nonempty * cluster_sizes[labels])
+    probabilities += 0.5 * distances / total if total > 0 else 0.5 / n
+    probabilities /= probabilities.sum()
+
+    draws = rng.choice(n, size, replace=True, p=probabilities)
+    indices, multiplicity = np.unique(draws, return_counts=True)
+    weights = multiplicity / (size * probabilities[indices])
+    return {
+        'indices': indices,
+        'points': np.asarray(matrix[indices], dtype=np.float32),
+        'weights': weights,
+        'n_samples': n,
+        'effective_size': float(weights.sum() ** 2 / (weights ** 2).sum())
+    }
+
+
+def describe_coreset(coreset: Dict) -> Dict:
+    """可写入JSON的coreset概况"""
+    return {
+        'n_samples': int(coreset['n_samples']),
+        'size': int(len(coreset['indices'])),
+        'total_weight': float(coreset['weights'].sum()),
+        'effective_size': coreset['effective_size']
+    }
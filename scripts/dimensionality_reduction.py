@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+聚类前的降维（随机化PCA / 稀疏随机投影），让k值扫描、全量拟合和轮廓系数在低维空间中计算
+- 在采样数据上拟合：PCA用随机化SVD，随机投影只需要维度；两者都先减去采样均值
+- 变换 y = normalize((x - mean) @ components.T)，按块处理（可直接写入磁盘上的.npy memmap），
+  输出为单位向量，下游的余弦/球面k-means代码无需改动
+- 持久化为 <base>.npz（mean、components）和 <base>.json（方法、维度、保留方差、距离失真、指纹），
+  增量分配（cluster_model.py）和之后的全量运行复用同一个变换，聚类中心始终在同一个基下，可以跨运行对齐
+- reduction_impact 在采样上比较降维前后同一k的聚类：分配一致性（ARI）、在原始空间中的轮廓系数和拟合耗时
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Dict
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from sklearn.metrics import adjusted_rand_score
+
+from cluster_quality import quality_metrics
+from spherical_kmeans import BLOCK_ROWS, normalize_rows
+
+REDUCTION_METHODS = ('pca', 'random_projection')
+
+
+def reducer_paths(base: str) -> Dict[str, str]:
+    return {'arrays': base + '.npz', 'meta': base + '.json'}
+
+
+def _sample_rows(matrix: np.ndarray, sample_size: int, seed: int) -> np.ndarray:
+    if len(matrix) <= sample_size:
+        return normalize_rows(matrix[:])
+    indices = np.sort(np.random.RandomState(seed).choice(len(matrix), sample_size, replace=False))
+    return normalize_rows(matrix[indices])
+
+
+def pairwise_distortion(sample: np.ndarray, reduced: np.ndarray, n_pairs: int = 20000, seed: int = 42) -> float:
+    """随机样本对的余弦距离在降维前后的平均绝对差"""
+    rng = np.random.RandomState(seed)
+    left, right = rng.randint(len(sample), size=(2, n_pairs))
+    original = 1.0 - np.einsum('ij,ij->i', sample[left], sample[right])
+    projected = 1.0 - np.einsum('ij,ij->i', reduced[left], reduced[right])
+    return float(np.abs(projected - original).mean())
+
+
+def fit_reducer(matrix: np.ndarray, method: str = 'pca', n_components: int = 128, sample_size: int = 50000,
+                seed: int = 42) -> Dict:
+    """在采样上拟合降维，返回 {'method', 'mean', 'components', 'input_dim', 'n_components', 'retained_variance', ...}"""
+    if method not in REDUCTION_METHODS:
+        raise ValueError(f"不支持的降维方法: {method}（可选: {', '.join(REDUCTION_METHODS)}）")
+    sample = _sample_rows(matrix, sample_size, seed)
+    dim = sample.shape[1]
+    n_components = min(n_components, dim)
+    mean = sample.mean(axis=0)
+    centered = sample - mean
+    start = time.time()
+    if method == 'pca':
+        from sklearn.decomposition import PCA
+        pca = PCA(n_components=n_components, svd_solver='randomized', random_state=seed).fit(centered)
+        components = pca.components_.astype(np.float32)
+    else:
+        from sklearn.random_projection import SparseRandomProjection
+        projection = SparseRandomProjection(n_components=n_components, random_state=seed).fit(centered)
+        components = projection.components_.toarray().astype(np.float32)
+    fit_seconds = time.time() - start
+
+    reducer = {
+        'method': method,
+        'input_dim': int(dim),
+        'n_components': int(n_components),
+        'sample_size': int(len(sample)),
+        'seed': seed,
+        'fit_seconds': fit_seconds,
+        'mean': mean.astype(np.float32),
+        'components': components
+    }
+    # 保留方差：投影后（归一化前）的方差占采样总方差的比例；随机投影的投影不是正交的，按缩放后的比值估计
+    projected = centered @ components.T
+    total_variance = float((centered ** 2).sum())
+    scale = float((components ** 2).sum(axis=1).mean())
+    reducer['retained_variance'] = float((projected ** 2).sum() / scale / total_variance) if total_variance else 1.0
+    reducer['pairwise_distortion'] = pairwise_distortion(sample, normalize_rows(projected), seed=seed)
+    return reducer
+
+
+def transform_blocked(matrix: np.ndarray, reducer: Dict, output_file: str = None,
+                      block_rows: int = BLOCK_ROWS) -> np.ndarray:
+    """按块降维并重新归一化；output_file不为None时写入磁盘上的.npy memmap（适用于流式模式）"""
+    components_t = np.ascontiguousarray(reducer['components'].T)
+    mean_projection = reducer['mean'] @ components_t
+    shape = (len(matrix), reducer['n_components'])
+    if output_file:
+        os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+        reduced = open_memmap(output_file, mode='w+', dtype=np.float32, shape=shape)
+    else:
+        reduced = np.empty(shape, dtype=np.float32)
+    for start in range(0, len(matrix), block_rows):
+        block = normalize_rows(matrix[start:start + block_rows])
+        reduced[start:start + len(block)] = normalize_rows(block @ components_t - mean_projection)
+    if output_file:
+        reduced.flush()
+    return reduced
+
+
+def reducer_fingerprint(reducer: Dict) -> str:
+    """变换矩阵的指纹：重新拟合（即使设置相同）会改变主成分的符号和顺序，中心不再可比"""
+    digest = hashlib.md5(np.ascontiguousarray(reducer['mean'], dtype=np.float32).tobytes())
+    digest.update(np.ascontiguousarray(reducer['components'], dtype=np.float32).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def reducer_exists(base: str) -> bool:
+    return all(os.path.exists(path) for path in reducer_paths(base).values())
+
+
+def load_matching_reducer(base: str, method: str, n_components: int, input_dim: int) -> Dict:
+    """已保存的降维变换与当前设置一致时返回它，否则返回None"""
+    if not reducer_exists(base):
+        return None
+    reducer = load_reducer(base)
+    if (reducer['method'], reducer['n_components'], reducer['input_dim']) != (method, min(n_components, input_dim),
+                                                                            input_dim):
+        return None
+    return reducer
+
+
+def save_reducer(base: str, reducer: Dict):
+    paths = reducer_paths(base)
+    os.makedirs(os.path.dirname(paths['arrays']) or '.', exist_ok=True)
+    np.savez(paths['arrays'], mean=reducer['mean'], components=reducer['components'])
+    with open(paths['meta'], 'w', encoding='utf-8') as f:
+        json.dump(describe_reducer(reducer), f, ensure_ascii=False, indent=2)
+
+
+def load_reducer(base: str) -> Dict:
+    paths = reducer_paths(base)
+    with open(paths['meta'], 'r', encoding='utf-8') as f:
+        reducer = json.load(f)
+    arrays = np.load(paths['arrays'])
+    reducer['mean'] = arrays['mean']
+    reducer['components'] = arrays['components']
+    return reducer
+
+
+def describe_reducer(reducer: Dict) -> Dict:
+    """可写入JSON的降维概况（不含矩阵）"""
+    info = {key: value for key, value in reducer.items() if key not in ('mean', 'components')}
+    info['fingerprint'] = reducer_fingerprint(reducer)
+    return info
+
+
+def reduction_impact(matrix: np.ndarray, reducer: Dict, make_model, k: int, sample_size: int = 10000,
+                     seed: int = 42) -> Dict:
+    """
+    在采样上分别用原始维度和降维后的向量拟合同一个k的聚类器（make_model(k)返回新的聚类器），比较:
+    分配一致性（ARI）、两种分配在原始空间中的精确余弦轮廓系数、拟合耗时
+    """
+    sample = _sample_rows(matrix, sample_size, seed)
+    reduced = transform_blocked(sample, reducer)
+    start = time.time()
+    full_labels = make_model(k).fit_predict(sample)
+    full_seconds = time.time() - start
+    start = time.time()
+    reduced_labels = make_model(k).fit_predict(reduced)
+    reduced_seconds = time.time() - start
+    return {
+        'k': int(k),
+        'sample_size': int(len(sample)),
+        'ari_vs_full': float(adjusted_rand_score(full_labels, reduced_labels)),
+        'silhouette_full_space': quality_metrics(sample, full_labels, k)['silhouette'],
+        'silhouette_full_space_reduced_labels': quality_metrics(sample, reduced_labels, k)['silhouette'],
+        'fit_seconds_full': full_seconds,
+        'fit_seconds_reduced': reduced_seconds,
+        'speedup': full_seconds / reduced_seconds if reduced_seconds > 0 else None
+    }
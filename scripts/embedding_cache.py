@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+基于SQLite的持久化embedding缓存
+- 以 (规范化文本, 模型名, task_type, 截断长度) 的哈希为键，内容寻址
+- 向量以float32二进制存储
+- 支持按条目数上限进行LRU淘汰，并统计命中/未命中次数
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+import unicodedata
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+
+# SQLite单条语句的参数个数有上限，分块查询
+QUERY_CHUNK_SIZE = 500
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本（Unicode NFC + 去除首尾空白），使等价文本命中同一缓存键"""
+    return unicodedata.normalize('NFC', text).strip()
+
+
+def make_cache_key(text: str, model_name: str, task_type: str, max_chars: int, variant: str = '') -> str:
+    """根据规范化文本、模型、task_type和截断长度生成缓存键（variant区分长文本处理方式等其他参数）"""
+    h = hashlib.sha256()
+    for part in (model_name, task_type, str(max_chars), variant, normalize_text(text)):
+        h.update(part.encode('utf-8'))
+        h.update(b'\x00')
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """持久化embedding缓存"""
+
+    def __init__(self, db_file: str, max_entries: int = 0):
+        """max_entries为0表示不限制条目数"""
+        db_dir = os.path.dirname(db_file)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.db_file = db_file
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            ' key TEXT PRIMARY KEY,'
+            ' vector BLOB NOT NULL,'
+            ' dim INTEGER NOT NULL,'
+            ' last_used REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)')
+        self.conn.commit()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, np.ndarray]:
+        """批量查询缓存，返回命中的 key -> embedding，并刷新其最近使用时间"""
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        for i in range(0, len(keys), QUERY_CHUNK_SIZE):
+            chunk = keys[i:i + QUERY_CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', chunk
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+
+        if found:
+            now = time.time()
+            self.conn.executemany('UPDATE embeddings SET last_used = ? WHERE key = ?',
+                                  [(now, key) for key in found])
+            self.conn.commit()
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, entries: Iterable[Tuple[str, np.ndarray]]):
+        """批量写入缓存，超出容量时淘汰最久未使用的条目"""
+        now = time.time()
+        rows = []
+        for key, embedding in entries:
+            vec = np.asarray(embedding, dtype=np.float32)
+            rows.append((key, vec.tobytes(), len(vec), now))
+        if not rows:
+            return
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO embeddings (key, vector, dim, last_used) VALUES (?, ?, ?, ?)', rows)
+        self.conn.commit()
+        self.evict()
+
+    def evict(self):
+        """按LRU淘汰超出max_entries的条目"""
+        if not self.max_entries:
+            return
+        count = self.conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                'DELETE FROM embeddings WHERE key IN '
+                '(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)', (excess,))
+            self.conn.commit()
+            self.evictions += excess
+
+    def stats(self) -> Dict:
+        """返回缓存统计信息"""
+        entries = self.conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'size_bytes': os.path.getsize(self.db_file) if os.path.exists(self.db_file) else 0,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+        }
+
+    def report(self):
+        """打印缓存统计信息"""
+        s = self.stats()
+        print(f"缓存统计: 命中 {s['hits']}, 未命中 {s['misses']}, 命中率 {s['hit_rate']:.1%}, "
+              f"淘汰 {s['evictions']}, 条目数 {s['entries']}, 文件大小 {s['size_bytes'] / 1024 / 1024:.1f} MB")
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == "__main__":
+    # 查看缓存统计
+    db_file = sys.argv[1] if len(sys.argv) > 1 else "../data/embedding_cache.sqlite"
+    cache = EmbeddingCache(db_file)
+    cache.report()
+    cache.close()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+embedding量化存储（float16 / int8 / 1-bit二值）
+- <base>.<format>.npy: 量化后的矩阵（binary为按位打包的uint8）
+- <base>.<format>.json: 量化参数（维度、int8的逐维缩放系数）
+- 聚类分配和代表样本搜索直接在量化数据上分块计算，需要时用float32存储重新打分
+- 附带报告：与完整精度比较聚类分配一致率和每个聚类top-10代表样本的召回率
+
+用法（生成三种量化格式并输出对比报告）:
+    python embedding_quantization.py [embedding文件] [k]
+"""
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from cluster_assignments import own_centroid_similarity, representative_samples
+from embedding_store import open_embeddings, store_base, store_exists
+
+FORMATS = ('float16', 'int8', 'binary')
+BLOCK_ROWS = 65536
+# 重新打分时每种格式的候选倍数（二值量化误差大，需要更多候选）
+RESCORE_OVERSAMPLE = {'float16': 2, 'int8': 4, 'binary': 20}
+
+
+def quantized_paths(path: str, fmt: str) -> Dict[str, str]:
+    """返回某种量化格式的文件路径"""
+    base = store_base(path)
+    return {'matrix': f'{base}.{fmt}.npy', 'params': f'{base}.{fmt}.json'}
+
+
+def quantized_exists(path: str, fmt: str) -> bool:
+    paths = quantized_paths(path, fmt)
+    return os.path.exists(paths['matrix']) and os.path.exists(paths['params'])
+
+
+class QuantizedMatrix:
+    """量化后的embedding矩阵，支持分块解码和直接在量化数据上计算内积"""
+
+    def __init__(self, codes: np.ndarray, fmt: str, dim: int, scale: np.ndarray = None):
+        if fmt not in FORMATS:
+            raise ValueError(f"不支持的量化格式: {fmt}")
+        self.codes = codes
+        self.fmt = fmt
+        self.dim = dim
+        self.scale = scale
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.codes), self.dim
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes)
+
+    def _block_float(self, start: int, end: int) -> np.ndarray:
+        """把一块codes转为float32（int8不乘缩放系数，binary为±1）"""
+        block = self.codes[start:end]
+        if self.fmt == 'binary':
+            bits = np.unpackbits(block, axis=1, count=self.dim)
+            return bits.astype(np.float32) * 2 - 1
+        return block.astype(np.float32)
+
+    def decode(self, rows=None) -> np.ndarray:
+        """解码为近似的float32向量（binary解码为归一化的±1向量）"""
+        if rows is None:
+            rows = slice(None)
+        codes = self.codes[rows]
+        if self.fmt == 'float16':
+            return codes.astype(np.float32)
+        if self.fmt == 'int8':
+            return codes.astype(np.float32) * self.scale
+        bits = np.unpackbits(codes, axis=1, count=self.dim)
+        return (bits.astype(np.float32) * 2 - 1) / np.sqrt(self.dim)
+
+    def _prepare_queries(self, queries: np.ndarray) -> np.ndarray:
+        """把缩放系数折叠进查询向量，使codes无需解码即可直接做内积"""
+        queries = np.asarray(queries, dtype=np.float32)
+        if self.fmt == 'int8':
+            return queries * self.scale
+        if self.fmt == 'binary':
+            return queries / np.sqrt(self.dim)
+        return queries
+
+    def iter_scores(self, queries: np.ndarray, block_rows: int = BLOCK_ROWS):
+        """分块计算所有行与queries的（近似）内积，产出 (起始行, 分数块)"""
+        prepared = self._prepare_queries(queries)
+        for start in range(0, len(self), block_rows):
+            end = min(start + block_rows, len(self))
+            yield start, self._block_float(start, end) @ prepared.T
+
+    def row_scores(self, queries: np.ndarray, query_index: np.ndarray,
+                   block_rows: int = BLOCK_ROWS) -> np.ndarray:
+        """计算每一行与其对应查询向量（queries[query_index[i]]）的内积"""
+        prepared = self._prepare_queries(queries)
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), block_rows):
+            end = min(start + block_rows, len(self))
+            block = self._block_float(start, end)
+            scores[start:end] = np.einsum('ij,ij->i', block, prepared[query_index[start:end]])
+        return scores
+
+
+def quantize_embeddings(embeddings: np.ndarray, fmt: str, block_rows: int = BLOCK_ROWS) -> QuantizedMatrix:
+    """把float32矩阵量化为指定格式（int8为逐维对称标量量化，binary为符号位）"""
+    n, dim = embeddings.shape
+    if fmt == 'float16':
+        codes = np.empty((n, dim), dtype=np.float16)
+        for start in range(0, n, block_rows):
+            codes[start:start + block_rows] = embeddings[start:start + block_rows]
+        return QuantizedMatrix(codes, fmt, dim)
+
+    if fmt == 'int8':
+        max_abs = np.zeros(dim, dtype=np.float32)
+        for start in range(0, n, block_rows):
+            block = np.abs(np.asarray(embeddings[start:start + block_rows], dtype=np.float32))
+            np.maximum(max_abs, block.max(axis=0), out=max_abs)
+        scale = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+        codes = np.empty((n, dim), dtype=np.int8)
+        for start in range(0, n, block_rows):
+            block = np.asarray(embeddings[start:start + block_rows], dtype=np.float32) / scale
+            codes[start:start + block_rows] = np.clip(np.rint(block), -127, 127)
+        return QuantizedMatrix(codes, fmt, dim, scale)
+
+    if fmt == 'binary':
+        codes = np.empty((n, (dim + 7) // 8), dtype=np.uint8)
+        for start in range(0, n, block_rows):
+            codes[start:start + block_rows] = np.packbits(embeddings[start:start + block_rows] > 0, axis=1)
+        return QuantizedMatrix(codes, fmt, dim)
+
+    raise ValueError(f"不支持的量化格式: {fmt}")
+
+
+def save_quantized(path: str, qm: QuantizedMatrix):
+    """保存量化矩阵及参数"""
+    paths = quantized_paths(path, qm.fmt)
+    np.save(paths['matrix'], qm.codes)
+    params = {'format': qm.fmt, 'dim': qm.dim}
+    if qm.scale is not None:
+        params['scale'] = qm.scale.tolist()
+    with open(paths['params'], 'w', encoding='utf-8') as f:
+        json.dump(params, f)
+
+
+def load_quantized(path: str, fmt: str, mmap: bool = True) -> QuantizedMatrix:
+    """以memmap方式加载量化矩阵"""
+    paths = quantized_paths(path, fmt)
+    codes = np.load(paths['matrix'], mmap_mode='r' if mmap else None)
+    with open(paths['params'], 'r', encoding='utf-8') as f:
+        params = json.load(f)
+    scale = np.asarray(params['scale'], dtype=np.float32) if 'scale' in params else None
+    return QuantizedMatrix(codes, params['format'], params['dim'], scale)
+
+
+def assign_clusters(matrix, centroids: np.ndarray, block_rows: int = BLOCK_ROWS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    把每一行分配给内积最大的聚类中心，返回 (labels, 与所属中心的相似度)
+    matrix可以是float32矩阵或QuantizedMatrix（直接在量化数据上计算）
+    """
+    labels = np.empty(len(matrix), dtype=np.int64)
+    sims = np.empty(len(matrix), dtype=np.float32)
+    if isinstance(matrix, QuantizedMatrix):
+        blocks = matrix.iter_scores(centroids, block_rows)
+    else:
+        centroids = np.asarray(centroids, dtype=np.float32)
+        blocks = ((start, np.asarray(matrix[start:start + block_rows], dtype=np.float32) @ centroids.T)
+                  for start in range(0, len(matrix), block_rows))
+    for start, scores in blocks:
+        end = start + len(scores)
+        labels[start:end] = scores.argmax(axis=1)
+        sims[start:end] = scores[np.arange(len(scores)), labels[start:end]]
+    return labels, sims
+
+
+def top_samples_per_cluster(matrix, labels: np.ndarray, centroids: np.ndarray, top_n: int = 10,
+                            rescore_matrix: np.ndarray = None, oversample: int = None) -> Dict[int, List[int]]:
+    """
+    找出每个聚类中与中心最相似的top_n个样本
+    在量化数据上先取top_n*oversample个候选，如提供rescore_matrix（float32）则用其重新打分后取top_n
+    """
+    centroids = np.asarray(centroids, dtype=np.float32)
+    if oversample is None:
+        oversample = RESCORE_OVERSAMPLE.get(getattr(matrix, 'fmt', None), 1)
+    if isinstance(matrix, QuantizedMatrix):
+        sims = matrix.row_scores(centroids, labels)
+    else:
+        sims = own_centroid_similarity(matrix, labels, centroids)
+
+    n_candidates = top_n * oversample if rescore_matrix is not None else top_n
+    top, _ = representative_samples(sims, labels, len(centroids), n_candidates)
+    if rescore_matrix is not None:
+        top = rescore_candidates(top, rescore_matrix, centroids, top_n)
+    return top
+
+
+def rescore_candidates(candidates: Dict[int, List[int]], rescore_matrix: np.ndarray, centroids: np.ndarray,
+                       top_n: int = 10) -> Dict[int, List[int]]:
+    """用float32存储（memmap只读取候选行）对量化数据上得到的候选重新打分，每个聚类保留top_n"""
+    centroids = np.asarray(centroids, dtype=np.float32)
+    top = {}
+    for cluster_id, rows in candidates.items():
+        if not rows:
+            top[cluster_id] = []
+            continue
+        order = np.sort(rows)  # memmap按行号顺序读取更快
+        exact = np.asarray(rescore_matrix[order], dtype=np.float32) @ centroids[cluster_id]
+        top[cluster_id] = order[np.argsort(-exact)[:top_n]].tolist()
+    return top
+
+
+def quantization_report(embeddings: np.ndarray, centroids: np.ndarray, formats: Tuple[str, ...] = FORMATS,
+                        quantized: Dict[str, QuantizedMatrix] = None, top_n: int = 10) -> Dict:
+    """与完整精度比较各量化格式的聚类分配一致率、top_n代表样本召回率、内存占用和耗时"""
+    quantized = quantized or {}
+    centroids = np.asarray(centroids, dtype=np.float32)
+
+    start = time.time()
+    full_labels, _ = assign_clusters(embeddings, centroids)
+    full_seconds = time.time() - start
+    full_top = top_samples_per_cluster(embeddings, full_labels, centroids, top_n)
+
+    def recall(top: Dict[int, List[int]]) -> float:
+        hits = sum(len(set(top[c]) & set(full_top[c])) for c in full_top)
+        total = sum(len(full_top[c]) for c in full_top)
+        return hits / total if total else 1.0
+
+    report = {
+        'rows': len(embeddings),
+        'k': len(centroids),
+        'formats': [{
+            'format': 'float32',
+            'bytes': int(len(embeddings) * embeddings.shape[1] * 4),
+            'assign_seconds': full_seconds,
+            'assignment_agreement': 1.0,
+            'top_recall': 1.0,
+            'top_recall_rescored': 1.0
+        }]
+    }
+    for fmt in formats:
+        qm = quantized.get(fmt) or quantize_embeddings(embeddings, fmt)
+        start = time.time()
+        labels, _ = assign_clusters(qm, centroids)
+        seconds = time.time() - start
+        # 召回率在完整精度的分配下比较，只衡量代表样本搜索本身的误差
+        top = top_samples_per_cluster(qm, full_labels, centroids, top_n)
+        top_rescored = top_samples_per_cluster(qm, full_labels, centroids, top_n, rescore_matrix=embeddings)
+        report['formats'].append({
+            'format': fmt,
+            'bytes': qm.nbytes,
+            'assign_seconds': seconds,
+            'assignment_agreement': float(np.mean(labels == full_labels)),
+            'top_recall': recall(top),
+            'top_recall_rescored': recall(top_rescored)
+        })
+    return report
+
+
+def print_report(report: Dict):
+    """打印对比表"""
+    print("\n" + "="*80)
+    print(f"量化格式对比 ({report['rows']} 条, k={report['k']})")
+    print("="*80)
+    print(f"{'格式':>8} {'大小(MB)':>10} {'分配耗时(s)':>12} {'分配一致率':>10} {'top召回':>9} {'重打分后召回':>12}")
+    for r in report['formats']:
+        print(f"{r['format']:>8} {r['bytes'] / 1024 / 1024:>10.1f} {r['assign_seconds']:>12.2f} "
+              f"{r['assignment_agreement']:>10.4f} {r['top_recall']:>9.4f} {r['top_recall_rescored']:>12.4f}")
+
+
+def main():
+    embeddings_file = "../data/output_embeddings.json"
+    k = 15
+    output_file = "../results/quantization_report.json"
+
+    if len(sys.argv) > 1:
+        embeddings_file = sys.argv[1]
+    if len(sys.argv) > 2:
+        k = int(sys.argv[2])
+
+    print(f"加载embedding数据: {embeddings_file}")
+    embeddings, _, _ = open_embeddings(embeddings_file)
+
+    quantized = {}
+    for fmt in FORMATS:
+        print(f"生成 {fmt} 量化存储...")
+        quantized[fmt] = quantize_embeddings(embeddings, fmt)
+        if store_exists(embeddings_file):
+            save_quantized(embeddings_file, quantized[fmt])
+            print(f"  已保存到: {quantized_paths(embeddings_file, fmt)['matrix']}")
+
+    # 用完整精度的MiniBatchKMeans中心作为参照
+    from sklearn.cluster import MiniBatchKMeans
+    print(f"使用k={k}拟合参照聚类中心...")
+    mbk = MiniBatchKMeans(n_clusters=k, random_state=42, batch_size=1000, n_init=10).fit(embeddings)
+    centroids = mbk.cluster_centers_ / np.linalg.norm(mbk.cluster_centers_, axis=1, keepdims=True)
+
+    report = quantization_report(embeddings, centroids, quantized=quantized)
+    print_report(report)
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到: {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+紧凑的二进制embedding存储
+- <base>.npy: 连续的float32矩阵 (n, dim)，使用memmap零拷贝加载
+- <base>.index.json: id索引与元数据（模型、维度、是否已归一化等）
+- <base>.ids.npy: 与索引相同的id，定长unicode数组（memmap按行读取，不为每个id创建Python对象）
+- <base>.content_hash.npy: 可选的每行内容哈希，定长bytes数组（不写入索引JSON，避免每次读取元数据都解析）
+- <base>.previews.json: 可选的output预览文本
+
+流式写入时先追加到分段文件，按批次提交检查点，全部完成后再合并为.npy:
+- <base>.segment.f32 / <base>.segment.jsonl: 已提交的向量和对应的id/预览
+- <base>.checkpoint.json: 已提交的CSV行数和各分段文件的字节数
+- <base>.deadletter.jsonl: 重试后仍失败的行
+
+用法（把旧的JSON embedding文件转换为二进制存储）:
+    python embedding_store.py ../data/output_embeddings.json
+"""
+import json
+import os
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+def store_base(path: str) -> str:
+    """去掉扩展名得到存储的基础路径（兼容传入.json/.npy路径）"""
+    for suffix in ('.index.json', '.ids.npy', '.content_hash.npy', '.previews.json', '.segment.f32', '.segment.jsonl',
+                   '.checkpoint.json', '.deadletter.jsonl', '.npy', '.json'):
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return path
+
+
+def store_paths(path: str) -> Dict[str, str]:
+    """返回存储各组成文件的路径"""
+    base = store_base(path)
+    return {
+        'matrix': base + '.npy',
+        'index': base + '.index.json',
+        'ids': base + '.ids.npy',
+        'content_hash': base + '.content_hash.npy',
+        'previews': base + '.previews.json',
+        'segment': base + '.segment.f32',
+        'segment_index': base + '.segment.jsonl',
+        'checkpoint': base + '.checkpoint.json',
+        'deadletter': base + '.deadletter.jsonl',
+    }
+
+
+def store_exists(path: str) -> bool:
+    """判断二进制存储是否存在"""
+    paths = store_paths(path)
+    return os.path.exists(paths['matrix']) and os.path.exists(paths['index'])
+
+
+def ids_array(ids) -> np.ndarray:
+    """把id序列转为定长unicode数组（已是数组时不复制）"""
+    return np.asarray(ids, dtype=str)
+
+
+def save_index(path: str, ids: List[str], metadata: Dict = None, previews: List[str] = None,
+               content_hashes: List[str] = None):
+    """写入id索引（JSON和.ids.npy各一份）、可选的预览文本和内容哈希（没有哈希时删除旧的哈希文件）"""
+    paths = store_paths(path)
+    index = dict(metadata or {})
+    index['ids'] = list(ids)
+    index['count'] = len(ids)
+    with open(paths['index'], 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    np.save(paths['ids'], ids_array(index['ids']))
+    if content_hashes is not None:
+        np.save(paths['content_hash'], np.asarray(content_hashes, dtype=bytes))
+    elif os.path.exists(paths['content_hash']):
+        os.remove(paths['content_hash'])
+    if previews is not None:
+        with open(paths['previews'], 'w', encoding='utf-8') as f:
+            json.dump(list(previews), f, ensure_ascii=False)
+
+
+def save_embedding_store(path: str, ids: List[str], embeddings: np.ndarray,
+                         metadata: Dict = None, previews: List[str] = None):
+    """保存float32矩阵和id索引"""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if len(ids) != len(embeddings):
+        raise ValueError(f"id数量({len(ids)})与embedding行数({len(embeddings)})不一致")
+    paths = store_paths(path)
+    os.makedirs(os.path.dirname(paths['matrix']) or '.', exist_ok=True)
+    np.save(paths['matrix'], embeddings)
+
+    metadata = dict(metadata or {})
+    metadata['dim'] = int(embeddings.shape[1]) if embeddings.ndim == 2 else 0
+    metadata['dtype'] = 'float32'
+    save_index(path, ids, metadata, previews)
+
+
+def load_index(path: str) -> Dict:
+    """只加载id索引和元数据"""
+    with open(store_paths(path)['index'], 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_ids(path: str) -> np.ndarray:
+    """
+    以memmap打开按行顺序的id数组；旧存储没有.ids.npy（或比索引旧）时从索引JSON转换一次并写入，
+    之后的运行不再解析整个索引
+    """
+    paths = store_paths(path)
+    if not os.path.exists(paths['ids']) or os.path.getmtime(paths['ids']) < os.path.getmtime(paths['index']):
+        np.save(paths['ids'], ids_array(load_index(path)['ids']))
+    return np.load(paths['ids'], mmap_mode='r')
+
+
+def load_previews(path: str) -> Optional[List[str]]:
+    """加载预览文本（不存在时返回None）"""
+    previews_file = store_paths(path)['previews']
+    if not os.path.exists(previews_file):
+        return None
+    with open(previews_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_embedding_store(path: str, mmap: bool = True) -> Tuple[np.ndarray, Dict]:
+    """加载二进制存储，默认以只读memmap方式零拷贝打开矩阵"""
+    matrix = np.load(store_paths(path)['matrix'], mmap_mode='r' if mmap else None)
+    index = load_index(path)
+    if len(index['ids']) != len(matrix):
+        raise ValueError(f"索引条数({len(index['ids'])})与矩阵行数({len(matrix)})不一致")
+    return matrix, index
+
+
+def truncate_embeddings(embeddings: np.ndarray, dim: int = None) -> np.ndarray:
+    """
+    Matryoshka截断：保留前dim维并重新L2归一化，返回新的float32矩阵
+    dim为None或不小于原维度时原样返回
+    """
+    if not dim or dim >= embeddings.shape[1]:
+        return embeddings
+    truncated = np.array(embeddings[:, :dim], dtype=np.float32)
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    norms[norms == 0] = 1  # 避免除零
+    truncated /= norms
+    return truncated
+
+
+def load_legacy_json(json_file: str) -> Tuple[np.ndarray, List[str], List[str]]:
+    """加载旧格式的JSON embedding文件，返回 (float32矩阵, ids, 预览)，跳过embedding为None的数据"""
+    with open(json_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    valid = [item for item in data if item.get('embedding') is not None]
+    if valid:
+        embeddings = np.asarray([item['embedding'] for item in valid], dtype=np.float32)
+    else:
+        embeddings = np.zeros((0, 0), dtype=np.float32)
+    ids = [item.get('id', '') for item in valid]
+    previews = [item.get('output', '') for item in valid]
+    return embeddings, ids, previews
+
+
+def open_embeddings(path: str) -> Tuple[np.ndarray, List[str], Optional[List[str]]]:
+    """
+    优先打开二进制存储（memmap），不存在时回退到旧的JSON文件
+    返回 (embedding矩阵, ids, 预览文本或None)
+    """
+    if store_exists(path):
+        matrix, index = load_embedding_store(path)
+        return matrix, index['ids'], load_previews(path)
+    return load_legacy_json(path)
+
+
+def load_duplicate_groups(path: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    根据.content_hash.npy返回 (每行的重复组编号, 每行所在组的重复次数)
+    重复次数可作为聚类的sample_weight；旧存储的哈希在索引JSON中，转换一次写入.content_hash.npy；
+    没有哈希时返回None
+    """
+    if not store_exists(path):
+        return None
+    paths = store_paths(path)
+    if not os.path.exists(paths['content_hash']):
+        hashes = load_index(path).get('content_hash')
+        if not hashes:
+            return None
+        np.save(paths['content_hash'], np.asarray(hashes, dtype=bytes))
+    hashes = np.load(paths['content_hash'])
+    if len(hashes) != len(load_ids(path)):
+        raise ValueError(f"内容哈希条数({len(hashes)})与id条数({len(load_ids(path))})不一致")
+    _, groups, counts = np.unique(hashes, return_inverse=True, return_counts=True)
+    return groups, counts[groups]
+
+
+class SegmentWriter:
+    """
+    可断点续跑的追加式embedding写入器
+    每次commit先落盘分段数据，再原子地更新检查点；重新打开时截断检查点之后未提交的数据
+    """
+
+    def __init__(self, path: str, resume: bool = True):
+        self.path = path
+        self.paths = store_paths(path)
+        os.makedirs(os.path.dirname(self.paths['segment']) or '.', exist_ok=True)
+        self.checkpoint = {'rows_read': 0, 'vectors': 0, 'dim': 0,
+                           'segment_bytes': 0, 'segment_index_bytes': 0, 'deadletter_bytes': 0}
+        if resume and os.path.exists(self.paths['checkpoint']):
+            with open(self.paths['checkpoint'], 'r', encoding='utf-8') as f:
+                self.checkpoint.update(json.load(f))
+
+        # 截断到上次提交的位置（丢弃崩溃时写了一半的数据）
+        self.segment = self._open_truncated(self.paths['segment'], self.checkpoint['segment_bytes'])
+        self.segment_index = self._open_truncated(self.paths['segment_index'], self.checkpoint['segment_index_bytes'])
+        self.deadletter = self._open_truncated(self.paths['deadletter'], self.checkpoint['deadletter_bytes'])
+
+    @staticmethod
+    def _open_truncated(file_path: str, size: int):
+        f = open(file_path, 'ab')
+        f.truncate(size)
+        f.seek(size)
+        return f
+
+    @property
+    def rows_read(self) -> int:
+        """已提交的CSV数据行数，续跑时从这里开始"""
+        return self.checkpoint['rows_read']
+
+    @property
+    def vectors(self) -> int:
+        return self.checkpoint['vectors']
+
+    def append(self, ids: List[str], embeddings: np.ndarray, previews: List[str] = None,
+               extras: List[Dict] = None):
+        """追加一批向量（尚未提交），extras为每行需要额外写入索引的字段"""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if len(ids) == 0:
+            return
+        dim = embeddings.shape[1]
+        if self.checkpoint['dim'] and self.checkpoint['dim'] != dim:
+            raise ValueError(f"embedding维度({dim})与已写入的维度({self.checkpoint['dim']})不一致")
+        self.checkpoint['dim'] = dim
+        self.segment.write(embeddings.tobytes())
+        previews = previews if previews is not None else [''] * len(ids)
+        extras = extras if extras is not None else [{}] * len(ids)
+        lines = ''.join(json.dumps(dict(extra, id=item_id, output=preview), ensure_ascii=False) + '\n'
+                        for item_id, preview, extra in zip(ids, previews, extras))
+        self.segment_index.write(lines.encode('utf-8'))
+        self.checkpoint['vectors'] += len(ids)
+
+    def append_dead_letters(self, records: List[Dict]):
+        """记录重试后仍失败的行（尚未提交）"""
+        lines = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        self.deadletter.write(lines.encode('utf-8'))
+
+    def commit(self, rows_read: int):
+        """落盘分段数据并原子更新检查点"""
+        for f in (self.segment, self.segment_index, self.deadletter):
+            f.flush()
+            os.fsync(f.fileno())
+        self.checkpoint['rows_read'] = rows_read
+        self.checkpoint['segment_bytes'] = self.segment.tell()
+        self.checkpoint['segment_index_bytes'] = self.segment_index.tell()
+        self.checkpoint['deadletter_bytes'] = self.deadletter.tell()
+        tmp_file = self.paths['checkpoint'] + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp_file, self.paths['checkpoint'])
+
+    def segment_matrix(self) -> np.ndarray:
+        """以memmap方式读取已写入的分段向量"""
+        self.segment.flush()
+        if self.checkpoint['vectors'] == 0:
+            return np.zeros((0, self.checkpoint['dim']), dtype=np.float32)
+        return np.memmap(self.paths['segment'], dtype=np.float32, mode='r',
+                         shape=(self.checkpoint['vectors'], self.checkpoint['dim']))
+
+    def iter_records(self) -> Iterator[Dict]:
+        """按写入顺序读取已写入的每行id/预览/额外字段"""
+        self.segment_index.flush()
+        with open(self.paths['segment_index'], 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def finalize(self, metadata: Dict = None, chunk_rows: int = 100000):
+        """
+        把分段文件合并为.npy矩阵和id索引（content_hash写入单独的.content_hash.npy，其余额外字段按列写入索引），
+        并删除分段与检查点
+        """
+        ids = []
+        previews = []
+        columns = {}
+        for record in self.iter_records():
+            ids.append(record.pop('id'))
+            previews.append(record.pop('output'))
+            for key, value in record.items():
+                columns.setdefault(key, []).append(value)
+        for key, values in columns.items():
+            if len(values) != len(ids):
+                raise ValueError(f"额外字段 {key} 只出现在部分行中 ({len(values)}/{len(ids)})")
+
+        n, dim = self.checkpoint['vectors'], self.checkpoint['dim']
+        source = self.segment_matrix()
+        target = np.lib.format.open_memmap(self.paths['matrix'], mode='w+', dtype=np.float32, shape=(n, dim))
+        for start in range(0, n, chunk_rows):
+            target[start:start + chunk_rows] = source[start:start + chunk_rows]
+        target.flush()
+        del target, source
+
+        content_hashes = columns.pop('content_hash', None)
+        metadata = dict(metadata or {})
+        metadata.update(columns)
+        metadata['dim'] = dim
+        metadata['dtype'] = 'float32'
+        save_index(self.path, ids, metadata, previews, content_hashes)
+
+        self.close()
+        for key in ('segment', 'segment_index', 'checkpoint'):
+            os.remove(self.paths[key])
+
+    def close(self):
+        for f in (self.segment, self.segment_index, self.deadletter):
+            if not f.closed:
+                f.close()
+
+
+def convert_legacy_json(json_file: str, path: str = None):
+    """把旧的JSON embedding文件转换为二进制存储"""
+    path = path or json_file
+    print(f"转换 {json_file} -> {store_paths(path)['matrix']}")
+    embeddings, ids, previews = load_legacy_json(json_file)
+    # 旧文件中的向量由gemini_embedding.py写入，已经过L2归一化
+    save_embedding_store(path, ids, embeddings, {'normalized': True}, previews)
+    print(f"完成！共 {len(ids)} 条，维度 {embeddings.shape[1] if len(ids) else 0}")
+
+
+if __name__ == "__main__":
+    json_file = sys.argv[1] if len(sys.argv) > 1 else "../data/output_embeddings.json"
+    output_path = sys.argv[2] if len(sys.argv) > 2 else None
+    convert_legacy_json(json_file, output_path)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+本地Gemini模拟服务，用于离线压测embedding和文本生成流程
+- 实现 embedContent / batchEmbedContents / generateContent 三个REST接口
+- embedding和生成文本由输入内容的哈希确定，多次运行结果一致
+- 可配置延迟分布、服务端RPM限制（超出返回429）、随机429注入和随机5xx错误率
+- GET /stats 返回请求统计
+
+用法:
+    python fake_gemini_server.py [端口]
+    GEMINI_BACKEND=fake GEMINI_FAKE_URL=http://127.0.0.1:8765 python gemini_embedding.py
+
+环境变量配置:
+    FAKE_GEMINI_LATENCY            延迟分布: fixed:秒 / uniform:最小:最大 / lognormal:中位数:sigma / exponential:均值
+    FAKE_GEMINI_LATENCY_PER_ITEM   批量请求中每条文本额外增加的延迟（秒）
+    FAKE_GEMINI_RPM                服务端每分钟请求数上限（0为不限制，超出返回429）
+    FAKE_GEMINI_429_RATE           随机返回429的概率
+    FAKE_GEMINI_ERROR_RATE         随机返回500/503的概率
+    FAKE_GEMINI_DIM                embedding维度（默认768）
+    FAKE_GEMINI_SEED               随机故障注入的种子
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import numpy as np
+
+DEFAULT_PORT = 8765
+
+
+def parse_latency(spec: str):
+    """解析延迟分布配置，返回采样函数"""
+    name, *args = spec.split(':')
+    args = [float(a) for a in args]
+    if name == 'fixed':
+        return lambda rng: args[0]
+    if name == 'uniform':
+        return lambda rng: rng.uniform(args[0], args[1])
+    if name == 'lognormal':
+        median, sigma = args
+        return lambda rng: rng.lognormvariate(np.log(median), sigma)
+    if name == 'exponential':
+        return lambda rng: rng.expovariate(1.0 / args[0])
+    raise ValueError(f"不支持的延迟分布: {spec}")
+
+
+def load_config() -> Dict:
+    """从环境变量读取服务配置"""
+    return {
+        'latency': os.getenv('FAKE_GEMINI_LATENCY', 'lognormal:0.15:0.4'),
+        'latency_per_item': float(os.getenv('FAKE_GEMINI_LATENCY_PER_ITEM', '0.002')),
+        'requests_per_minute': int(os.getenv('FAKE_GEMINI_RPM', '0')),
+        'rate_limit_rate': float(os.getenv('FAKE_GEMINI_429_RATE', '0')),
+        'error_rate': float(os.getenv('FAKE_GEMINI_ERROR_RATE', '0')),
+        'dim': int(os.getenv('FAKE_GEMINI_DIM', '768')),
+        'seed': int(os.getenv('FAKE_GEMINI_SEED', '42')),
+    }
+
+
+def fake_embedding(text: str, dim: int, output_dimensionality: int = None) -> List[float]:
+    """由文本哈希确定的归一化向量（output_dimensionality截断后重新归一化）"""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    if output_dimensionality:
+        vec = vec[:output_dimensionality]
+    return (vec / np.linalg.norm(vec)).tolist()
+
+
+def fake_generation(prompt: str) -> str:
+    """由prompt哈希确定的生成文本"""
+    digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]
+    return f"**聚类摘要：**\n\n[fake-{digest}] 模拟生成的文本（prompt长度 {len(prompt)} 字符）"
+
+
+class FakeGeminiState:
+    """服务状态：配置、限流窗口和统计"""
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self.sample_latency = parse_latency(config['latency'])
+        self.rng = random.Random(config['seed'])
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_requests = 0
+        self.stats = {'requests': 0, 'embedded_texts': 0, 'generations': 0,
+                      'rate_limited': 0, 'errors': 0, 'started': time.time()}
+
+    def admit(self) -> int:
+        """决定本次请求的结果状态码（200 / 429 / 5xx），并返回"""
+        with self.lock:
+            self.stats['requests'] += 1
+            now = time.monotonic()
+            if now - self.window_start >= 60:
+                self.window_start = now
+                self.window_requests = 0
+            self.window_requests += 1
+            rpm = self.config['requests_per_minute']
+            if (rpm and self.window_requests > rpm) or self.rng.random() < self.config['rate_limit_rate']:
+                self.stats['rate_limited'] += 1
+                return 429
+            if self.rng.random() < self.config['error_rate']:
+                self.stats['errors'] += 1
+                return self.rng.choice([500, 503])
+            return 200
+
+    def latency(self, items: int = 1) -> float:
+        with self.lock:
+            base = self.sample_latency(self.rng)
+        return max(0.0, base) + self.config['latency_per_item'] * items
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    """处理 /v1beta/models/{model}:{method} 请求"""
+
+    protocol_version = 'HTTP/1.1'
+    state: FakeGeminiState = None
+    route = re.compile(r'^/v1beta/(models/[^:]+):(embedContent|batchEmbedContents|generateContent)$')
+
+    def log_message(self, format, *args):
+        """不打印每个请求的访问日志"""
+
+    def send_json(self, code: int, body: Dict):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, code: int, message: str):
+        self.send_json(code, {'error': {'code': code, 'message': message}})
+
+    def do_GET(self):
+        if self.path == '/stats':
+            with self.state.lock:
+                stats = dict(self.state.stats)
+            stats['uptime'] = time.time() - stats.pop('started')
+            self.send_json(200, stats)
+        else:
+            self.send_error_json(404, 'not found')
+
+    def do_POST(self):
+        match = self.route.match(self.path)
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length).decode('utf-8')) if length else {}
+        if not match:
+            self.send_error_json(404, f'unknown endpoint: {self.path}')
+            return
+        _, method = match.groups()
+
+        requests = body.get('requests', []) if method == 'batchEmbedContents' else [body]
+        status = self.state.admit()
+        time.sleep(self.state.latency(len(requests)))
+        if status == 429:
+            self.send_error_json(429, 'Resource has been exhausted (e.g. check quota).')
+            return
+        if status != 200:
+            self.send_error_json(status, 'Internal error (injected).')
+            return
+
+        dim = self.state.config['dim']
+        if method == 'generateContent':
+            prompt = ''.join(part.get('text', '') for content in body.get('contents', [])
+                             for part in content.get('parts', []))
+            with self.state.lock:
+                self.state.stats['generations'] += 1
+            self.send_json(200, {'candidates': [{'content': {'parts': [{'text': fake_generation(prompt)}]}}]})
+            return
+
+        embeddings = []
+        for request in requests:
+            text = ''.join(part.get('text', '') for part in request.get('content', {}).get('parts', []))
+            embeddings.append({'values': fake_embedding(text, dim, request.get('outputDimensionality'))})
+        with self.state.lock:
+            self.state.stats['embedded_texts'] += len(embeddings)
+        if method == 'embedContent':
+            self.send_json(200, {'embedding': embeddings[0]})
+        else:
+            self.send_json(200, {'embeddings': embeddings})
+
+
+def make_server(port: int = DEFAULT_PORT, config: Dict = None) -> ThreadingHTTPServer:
+    """创建服务（不启动），便于在测试或压测脚本中以线程方式运行"""
+    handler = type('Handler', (FakeGeminiHandler,), {'state': FakeGeminiState(config or load_config())})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PORT
+    config = load_config()
+    server = make_server(port, config)
+    print(f"Fake Gemini服务已启动: http://127.0.0.1:{port}")
+    print(f"配置: {json.dumps(config, ensure_ascii=False)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n服务已停止")
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
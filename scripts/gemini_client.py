@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+可插拔的Gemini客户端层
+- 默认返回google.generativeai模块本身
+- 设置环境变量 GEMINI_BACKEND=fake 时返回接口兼容的HTTP客户端，
+  连接本地的fake_gemini_server.py（地址由GEMINI_FAKE_URL指定），用于离线压测
+
+各脚本统一通过 load_genai() 获取genai对象，调用方式不变:
+    genai.configure(api_key=...)
+    genai.embed_content(model=..., content=..., task_type=...)
+    genai.GenerativeModel(model_name).generate_content(prompt).text
+
+调用方共用的异步限流器 TokenBucket 和重试策略（错误分类与指数退避）也放在这里，
+embedding引擎和摘要流水线都从本模块导入
+"""
+import asyncio
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Union
+
+DEFAULT_FAKE_URL = "http://127.0.0.1:8765"
+REQUEST_TIMEOUT = 60
+
+RETRY_BACKOFF = 1.0
+RATE_LIMIT_BACKOFF = 10.0  # 429/配额错误的退避基数（秒），配额按分钟恢复，等待比普通错误更长
+RATE_LIMIT_RETRIES = 6  # 429/配额错误的最多重试次数（单独计数）
+MAX_RETRY_DELAY = 60.0
+TRANSIENT_ERROR_NAMES = ('ServiceUnavailable', 'InternalServerError', 'DeadlineExceeded', 'GatewayTimeout')
+
+
+class GeminiHTTPError(Exception):
+    """HTTP请求返回错误状态码"""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class RateLimitError(GeminiHTTPError):
+    """429 请求过多"""
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """429 / 配额耗尽（google.api_core的ResourceExhausted，code为429）"""
+    if isinstance(error, RateLimitError) or getattr(error, 'code', None) == 429:
+        return True
+    return type(error).__name__ in ('ResourceExhausted', 'TooManyRequests') or 'quota' in str(error).lower()
+
+
+def is_transient_error(error: Exception) -> bool:
+    """值得原样重试的错误：429/配额、5xx、超时和连接错误（参数无效、内容被拦截等重试也不会成功）"""
+    code = getattr(error, 'code', None)
+    if is_rate_limit_error(error) or (isinstance(code, int) and code >= 500):
+        return True
+    return isinstance(error, (TimeoutError, ConnectionError, urllib.error.URLError)) or \
+        type(error).__name__ in TRANSIENT_ERROR_NAMES
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """第attempt次重试前的指数退避时间（限流错误用更长的基数），最多等待MAX_RETRY_DELAY秒"""
+    return min((RATE_LIMIT_BACKOFF if is_rate_limit_error(error) else RETRY_BACKOFF) * (2 ** attempt),
+               MAX_RETRY_DELAY)
+
+
+def retry_limit(error: Exception, max_retries: int) -> int:
+    """同一请求的最多重试次数（限流错误用RATE_LIMIT_RETRIES）"""
+    return RATE_LIMIT_RETRIES if is_rate_limit_error(error) else max_retries
+
+
+class TokenBucket:
+    """令牌桶限流器：容量为每分钟配额，按秒匀速补充；令牌状态可跨多次asyncio.run保留"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = None
+        self.loop = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        """获取amount个令牌，不足时等待补充（超过容量的请求在桶满时放行）"""
+        amount = min(amount, self.capacity)
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            # 锁只能在创建它的事件循环中使用，换了循环（如每块各自asyncio.run）时重建锁，令牌和补充时间不变
+            self.lock, self.loop = asyncio.Lock(), loop
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class FakeResponse:
+    """与genai的GenerateContentResponse兼容的最小响应对象"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """与genai.GenerativeModel接口兼容的HTTP客户端"""
+
+    def __init__(self, client: 'FakeGenAI', model_name: str):
+        self.client = client
+        self.model_name = model_name if model_name.startswith('models/') else f'models/{model_name}'
+
+    def generate_content(self, prompt: str) -> FakeResponse:
+        result = self.client.post(f'{self.model_name}:generateContent',
+                                  {'contents': [{'parts': [{'text': prompt}]}]})
+        return FakeResponse(result['candidates'][0]['content']['parts'][0]['text'])
+
+    async def generate_content_async(self, prompt: str) -> FakeResponse:
+        return await asyncio.to_thread(self.generate_content, prompt)
+
+
+class FakeGenAI:
+    """与google.generativeai模块接口兼容的HTTP客户端，请求本地fake服务"""
+
+    def __init__(self, base_url: str = DEFAULT_FAKE_URL):
+        self.base_url = base_url.rstrip('/')
+
+    def configure(self, api_key: str = None, **kwargs):
+        """本地服务不校验API key"""
+
+    def post(self, path: str, body: Dict) -> Dict:
+        request = urllib.request.Request(
+            f'{self.base_url}/v1beta/{path}',
+            data=json.dumps(body, ensure_ascii=False).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read().decode('utf-8'))['error']['message']
+            except (ValueError, KeyError):
+                message = e.reason
+            if e.code == 429:
+                raise RateLimitError(e.code, message)
+            raise GeminiHTTPError(e.code, message)
+
+    def embed_content(self, model: str, content: Union[str, List[str]], task_type: str = None,
+                      output_dimensionality: int = None, **kwargs) -> Dict:
+        """单条文本返回 {'embedding': [...]}，文本列表返回 {'embedding': [[...], ...]}"""
+        def make_request(text: str) -> Dict:
+            request = {'model': model, 'content': {'parts': [{'text': text}]}}
+            if task_type:
+                request['taskType'] = task_type
+            if output_dimensionality:
+                request['outputDimensionality'] = output_dimensionality
+            return request
+
+        if isinstance(content, str):
+            result = self.post(f'{model}:embedContent', make_request(content))
+            return {'embedding': result['embedding']['values']}
+        result = self.post(f'{model}:batchEmbedContents', {'requests': [make_request(text) for text in content]})
+        return {'embedding': [item['values'] for item in result['embeddings']]}
+
+    async def embed_content_async(self, **kwargs) -> Dict:
+        return await asyncio.to_thread(self.embed_content, **kwargs)
+
+    def GenerativeModel(self, model_name: str) -> FakeGenerativeModel:
+        return FakeGenerativeModel(self, model_name)
+
+
+def load_genai():
+    """根据GEMINI_BACKEND环境变量返回真实的genai模块或本地fake客户端（真实模块未安装时抛出ImportError）"""
+    backend = os.getenv('GEMINI_BACKEND', 'genai')
+    if backend == 'fake':
+        return FakeGenAI(os.getenv('GEMINI_FAKE_URL', DEFAULT_FAKE_URL))
+    import google.generativeai as genai
+    return genai
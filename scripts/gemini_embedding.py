@@ -2,16 +2,22 @@
 """
 使用Gemini API为CSV文件中的output列生成embedding
 """
+import asyncio
 import csv
+import hashlib
 import sys
 import os
 import json
-from typing import List, Dict
+from typing import Any, Dict, Iterator, List, Tuple
 import time
 import numpy as np
 
+from embedding_cache import EmbeddingCache, make_cache_key
+from embedding_store import SegmentWriter, store_paths, truncate_embeddings
+from gemini_client import TokenBucket, load_genai, retry_delay, retry_limit
+
 try:
-    import google.generativeai as genai
+    genai = load_genai()  # GEMINI_BACKEND=fake时连接本地模拟服务
 except ImportError:
     print("请先安装google-generativeai: pip install google-generativeai")
     sys.exit(1)
@@ -19,6 +25,18 @@ except ImportError:
 # 增加CSV字段大小限制
 csv.field_size_limit(sys.maxsize)
 
+# 批量请求限制（batchEmbedContents单次最多100条，token上限留出余量）
+MAX_TEXT_CHARS = 8000
+LONG_TEXT_POOLING = 'chunk-mean'  # 超长文本按片段切分后加权平均池化
+MAX_BATCH_TEXTS = 100
+MAX_BATCH_TOKENS = 100000
+MAX_RETRIES = 3
+
+# 并发与限流默认配置（可通过环境变量覆盖）
+DEFAULT_CONCURRENCY = 8
+DEFAULT_REQUESTS_PER_MINUTE = 1500
+DEFAULT_TOKENS_PER_MINUTE = 1000000
+
 
 def load_api_key() -> str:
     """从环境变量或用户输入获取API key"""
@@ -30,109 +48,499 @@ def load_api_key() -> str:
     return api_key
 
 
-def normalize_embedding(embedding: List[float]) -> List[float]:
-    """对embedding向量进行L2归一化（用于余弦相似度）"""
-    vec = np.array(embedding)
-    norm = np.linalg.norm(vec)
-    if norm > 0:
-        return (vec / norm).tolist()
-    return embedding
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """对一批embedding做向量化的L2归一化（用于余弦相似度），返回float32矩阵（float32输入原地归一化）"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1  # 避免除零
+    embeddings /= norms
+    return embeddings
+
+
+def split_text(text: str, max_chars: int = MAX_TEXT_CHARS) -> List[str]:
+    """把超长文本切分为不超过max_chars的片段，尽量在空白或标点处断开"""
+    if len(text) <= max_chars:
+        return [text]
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            cut = max(text.rfind(sep, start + max_chars // 2, end) for sep in (' ', '\n', ',', '，', '。'))
+            if cut > start:
+                end = cut + 1
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+def expand_long_texts(items: List[Tuple[Any, str]]) -> Tuple[List[Tuple[Any, str]], Dict[Any, List[Tuple[Any, int]]]]:
+    """
+    把超长文本切分为多个片段分别请求，片段key为 (key, 片段序号)
+    返回 (请求列表, key -> [(片段key, 片段长度)])
+    """
+    expanded = []
+    chunk_plan = {}
+    for key, text in items:
+        chunks = split_text(text)
+        if len(chunks) == 1:
+            expanded.append((key, text))
+            continue
+        chunk_plan[key] = [((key, j), len(chunk)) for j, chunk in enumerate(chunks)]
+        expanded.extend(((key, j), chunk) for j, chunk in enumerate(chunks))
+    return expanded, chunk_plan
+
+
+def pool_chunk_embeddings(embeddings: Dict[Any, np.ndarray], failed: Dict[Any, str],
+                          chunk_plan: Dict[Any, List[Tuple[Any, int]]]) -> Tuple[Dict[Any, np.ndarray], Dict[Any, str]]:
+    """按片段长度加权平均池化超长文本的片段embedding并重新归一化（所有超长文本一次完成）"""
+    if not chunk_plan:
+        return embeddings, failed
+
+    pooled_keys = []
+    owners = []
+    weights = []
+    vectors = []
+    for key, chunks in chunk_plan.items():
+        chunk_vectors = [embeddings.pop(chunk_key, None) for chunk_key, _ in chunks]
+        errors = [failed.pop(chunk_key) for chunk_key, _ in chunks if chunk_key in failed]
+        if errors or any(vec is None for vec in chunk_vectors):
+            failed[key] = errors[0] if errors else 'missing chunk embedding'
+            continue
+        owners.extend([len(pooled_keys)] * len(chunks))
+        weights.extend(length for _, length in chunks)
+        vectors.extend(chunk_vectors)
+        pooled_keys.append(key)
+
+    if pooled_keys:
+        weighted = np.stack(vectors) * np.asarray(weights, dtype=np.float32)[:, None]
+        pooled = np.zeros((len(pooled_keys), weighted.shape[1]), dtype=np.float32)
+        np.add.at(pooled, np.asarray(owners), weighted)
+        embeddings.update(zip(pooled_keys, normalize_embeddings(pooled)))
+    return embeddings, failed
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数：ASCII约4字符1token，中文等非ASCII字符按1字符1token（宁可高估，避免批次超限）"""
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+def build_batches(items: List[Tuple[Any, str]], max_texts: int = MAX_BATCH_TEXTS,
+                  max_tokens: int = MAX_BATCH_TOKENS) -> List[List[Tuple[Any, str]]]:
+    """按条数和估算token数自适应切分批次，保证单次请求不超过payload和token限制"""
+    batches = []
+    current = []
+    current_tokens = 0
+    for key, text in items:
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= max_texts or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append((key, text))
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
 
 
-def get_embeddings(texts: List[str], model_name: str = "models/text-embedding-004") -> List[List[float]]:
-    """使用Gemini API生成embedding"""
-    embeddings = []
-    for i, text in enumerate(texts):
+def embed_batch(texts: List[str], model_name: str = "models/text-embedding-004",
+                task_type: str = "RETRIEVAL_DOCUMENT", output_dimensionality: int = None) -> np.ndarray:
+    """一次请求为多条文本生成embedding，返回float32矩阵（output_dimensionality为None时返回完整维度）"""
+    kwargs = {'output_dimensionality': output_dimensionality} if output_dimensionality else {}
+    result = genai.embed_content(
+        model=model_name,
+        content=texts,
+        task_type=task_type,
+        **kwargs
+    )
+    embeddings = np.asarray(result['embedding'], dtype=np.float32)
+    if len(embeddings) != len(texts):
+        raise ValueError(f"返回的embedding数量({len(embeddings)})与请求文本数({len(texts)})不一致")
+    return embeddings
+
+
+def is_split_error(error: Exception) -> bool:
+    """请求过大或参数无效（400/413、InvalidArgument）以及返回条数不一致：拆小批次可能成功"""
+    if isinstance(error, ValueError) or getattr(error, 'code', None) in (400, 413):
+        return True
+    return type(error).__name__ in ('InvalidArgument', 'BadRequest', 'RequestEntityTooLarge')
+
+
+def embed_batch_with_split(batch: List[Tuple[Any, str]], model_name: str = "models/text-embedding-004",
+                           task_type: str = "RETRIEVAL_DOCUMENT",
+                           max_retries: int = MAX_RETRIES) -> Tuple[Dict[Any, np.ndarray], Dict[Any, str]]:
+    """
+    请求一个批次：
+    - 请求过大/参数无效（is_split_error）时将批次二分后分别请求，单条文本仍然无效时直接记为失败
+    - 429/配额错误不拆分（拆分只会成倍增加请求数），按更长的指数退避重试同一批次（最多RATE_LIMIT_RETRIES次）；
+      其他错误（超时、5xx）按指数退避重试同一批次（最多max_retries次）
+    返回 (key -> 归一化embedding, key -> 最终错误信息)
+    """
+    texts = [text for _, text in batch]
+    attempt = 0
+    while True:
         try:
-            # text-embedding-004 支持更长的文本，但为了安全起见，限制在8000字符
-            if len(text) > 8000:
-                text = text[:8000]
-            
-            result = genai.embed_content(
-                model=model_name,
-                content=text,
-                task_type="RETRIEVAL_DOCUMENT"
-            )
-            embedding = result['embedding']
-            
-            # 归一化向量（L2归一化，用于余弦相似度）
-            embedding = normalize_embedding(embedding)
-            
-            embeddings.append(embedding)
-            
-            # 避免API限流
-            if (i + 1) % 10 == 0:
-                time.sleep(0.5)
-                
+            embeddings = normalize_embeddings(embed_batch(texts, model_name, task_type))
+            return dict(zip((key for key, _ in batch), embeddings)), {}
         except Exception as e:
-            print(f"处理第 {i+1} 条数据时出错: {e}")
-            embeddings.append(None)
-    
-    return embeddings
+            last_error = e
+            if not is_split_error(e):
+                if attempt >= retry_limit(e, max_retries):
+                    break
+                print(f"  批次({len(batch)} 条)请求失败，退避后重试: {e}")
+                time.sleep(retry_delay(e, attempt))
+                attempt += 1
+                continue
+            if len(batch) > 1:
+                mid = len(batch) // 2
+                print(f"  批次({len(batch)} 条)过大或参数无效，拆分重试: {e}")
+                left_ok, left_failed = embed_batch_with_split(batch[:mid], model_name, task_type, max_retries)
+                right_ok, right_failed = embed_batch_with_split(batch[mid:], model_name, task_type, max_retries)
+                left_ok.update(right_ok)
+                left_failed.update(right_failed)
+                return left_ok, left_failed
+            break
+    return {}, {key: str(last_error) for key, _ in batch}
+
+
+def embed_items(items: List[Tuple[Any, str]], model_name: str = "models/text-embedding-004",
+                task_type: str = "RETRIEVAL_DOCUMENT") -> Tuple[Dict[Any, np.ndarray], Dict[Any, str]]:
+    """批量为 (key, text) 列表生成embedding，结果按key映射回原始行"""
+    # 超过8000字符的文本切分为多个片段，请求后再池化，而不是直接截断
+    items, chunk_plan = expand_long_texts(items)
+
+    embeddings = {}
+    failed = {}
+    for batch in build_batches(items):
+        batch_ok, batch_failed = embed_batch_with_split(batch, model_name, task_type)
+        embeddings.update(batch_ok)
+        failed.update(batch_failed)
+    return pool_chunk_embeddings(embeddings, failed, chunk_plan)
+
+
+def load_rate_limit_config() -> Dict[str, int]:
+    """从环境变量读取并发数、每分钟请求数(RPM)和每分钟token数(TPM)限制"""
+    return {
+        'concurrency': int(os.getenv('GEMINI_EMBED_CONCURRENCY', DEFAULT_CONCURRENCY)),
+        'requests_per_minute': int(os.getenv('GEMINI_EMBED_RPM', DEFAULT_REQUESTS_PER_MINUTE)),
+        'tokens_per_minute': int(os.getenv('GEMINI_EMBED_TPM', DEFAULT_TOKENS_PER_MINUTE)),
+    }
+
+
+class AsyncEmbeddingEngine:
+    """基于asyncio的并发embedding引擎，限制在途请求数并按RPM/TPM限流"""
+
+    def __init__(self, model_name: str = "models/text-embedding-004", task_type: str = "RETRIEVAL_DOCUMENT",
+                 concurrency: int = DEFAULT_CONCURRENCY,
+                 requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: int = DEFAULT_TOKENS_PER_MINUTE,
+                 max_texts: int = MAX_BATCH_TEXTS, max_retries: int = MAX_RETRIES,
+                 output_dimensionality: int = None):
+        self.model_name = model_name
+        self.task_type = task_type
+        self.output_dimensionality = output_dimensionality
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_texts = max_texts
+        self.max_retries = max_retries
+        self.stats = {'requests': 0, 'texts': 0, 'tokens': 0, 'failed_requests': 0, 'elapsed': 0.0}
+        # 令牌桶属于引擎而不是单次调用：流式按块调用embed_items时，各块共享同一份每分钟配额
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
 
+    async def _request(self, texts: List[str]) -> np.ndarray:
+        """经过限流后发送一次批量请求"""
+        tokens = sum(estimate_tokens(text) for text in texts)
+        await self.request_bucket.acquire(1)
+        await self.token_bucket.acquire(tokens)
+        async with self.semaphore:
+            self.stats['requests'] += 1
+            try:
+                if hasattr(genai, 'embed_content_async'):
+                    kwargs = {'output_dimensionality': self.output_dimensionality} if self.output_dimensionality else {}
+                    result = await genai.embed_content_async(
+                        model=self.model_name, content=texts, task_type=self.task_type, **kwargs)
+                    embeddings = np.asarray(result['embedding'], dtype=np.float32)
+                else:
+                    embeddings = await asyncio.to_thread(embed_batch, texts, self.model_name, self.task_type,
+                                                         self.output_dimensionality)
+            except Exception:
+                self.stats['failed_requests'] += 1
+                raise
+        if len(embeddings) != len(texts):
+            raise ValueError(f"返回的embedding数量({len(embeddings)})与请求文本数({len(texts)})不一致")
+        self.stats['texts'] += len(texts)
+        self.stats['tokens'] += tokens
+        return embeddings
 
-def process_csv(input_file: str, output_file: str, batch_size: int = 100):
-    """处理CSV文件，为output列生成embedding"""
+    async def _embed_with_split(self, batch: List[Tuple[Any, str]]) -> Tuple[Dict[Any, np.ndarray], Dict[Any, str]]:
+        """与embed_batch_with_split相同的策略（异步版本）：只在请求过大/参数无效时拆分，429等错误退避后重试同一批次"""
+        texts = [text for _, text in batch]
+        attempt = 0
+        while True:
+            try:
+                embeddings = normalize_embeddings(await self._request(texts))
+                return dict(zip((key for key, _ in batch), embeddings)), {}
+            except Exception as e:
+                last_error = e
+                if not is_split_error(e):
+                    if attempt >= retry_limit(e, self.max_retries):
+                        break
+                    print(f"  批次({len(batch)} 条)请求失败，退避后重试: {e}")
+                    await asyncio.sleep(retry_delay(e, attempt))
+                    attempt += 1
+                    continue
+                if len(batch) > 1:
+                    mid = len(batch) // 2
+                    print(f"  批次({len(batch)} 条)过大或参数无效，拆分重试: {e}")
+                    (left_ok, left_failed), (right_ok, right_failed) = await asyncio.gather(
+                        self._embed_with_split(batch[:mid]), self._embed_with_split(batch[mid:]))
+                    left_ok.update(right_ok)
+                    left_failed.update(right_failed)
+                    return left_ok, left_failed
+                break
+        return {}, {key: str(last_error) for key, _ in batch}
+
+    async def embed_items_async(self, items: List[Tuple[Any, str]]) -> Tuple[Dict[Any, np.ndarray], Dict[Any, str]]:
+        """并发处理所有批次，返回 (key -> embedding, key -> 错误信息)"""
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        items, chunk_plan = expand_long_texts(items)
+        batches = build_batches(items, max_texts=self.max_texts)
+
+        embeddings = {}
+        failed = {}
+        start = time.monotonic()
+        tasks = [asyncio.ensure_future(self._embed_with_split(batch)) for batch in batches]
+        for done, future in enumerate(asyncio.as_completed(tasks), 1):
+            batch_ok, batch_failed = await future
+            embeddings.update(batch_ok)
+            failed.update(batch_failed)
+            if done % 10 == 0 or done == len(tasks):
+                print(f"  已完成 {done}/{len(tasks)} 个请求批次 ({len(embeddings)} 条embedding)")
+        self.stats['elapsed'] += time.monotonic() - start
+        return pool_chunk_embeddings(embeddings, failed, chunk_plan)
+
+    def embed_items(self, items: List[Tuple[Any, str]]) -> Tuple[Dict[Any, np.ndarray], Dict[Any, str]]:
+        """同步入口"""
+        return asyncio.run(self.embed_items_async(items))
+
+    def report_throughput(self):
+        """打印实际达到的吞吐量"""
+        elapsed = self.stats['elapsed']
+        if elapsed <= 0:
+            return
+        print(f"吞吐量: {self.stats['texts'] / elapsed:.1f} 条/秒, "
+              f"{self.stats['requests'] / elapsed * 60:.0f} 请求/分钟, "
+              f"{self.stats['tokens'] / elapsed * 60:.0f} token/分钟 "
+              f"(并发={self.concurrency}, 请求总数={self.stats['requests']}, 失败请求={self.stats['failed_requests']})")
+
+
+def get_embeddings(texts: List[str], model_name: str = "models/text-embedding-004") -> np.ndarray:
+    """使用Gemini API批量生成embedding，返回与texts逐行对应的float32矩阵（重试后仍失败的行为NaN）"""
+    embeddings, failed = embed_items(list(enumerate(texts)), model_name)
+    for i, error in sorted(failed.items()):
+        print(f"处理第 {i+1} 条数据时出错: {error}")
+    if not embeddings:
+        return np.full((len(texts), 0), np.nan, dtype=np.float32)
+    dim = next(iter(embeddings.values())).shape[0]
+    matrix = np.full((len(texts), dim), np.nan, dtype=np.float32)
+    keys = list(embeddings)
+    matrix[keys] = np.stack([embeddings[key] for key in keys])
+    return matrix
+
+
+def embed_with_cache(engine: AsyncEmbeddingEngine, items: List[Tuple[Any, str]],
+                     cache: EmbeddingCache = None) -> Tuple[Dict[Any, np.ndarray], Dict[Any, str]]:
+    """先查询持久化缓存，只为新增或变化的文本调用API，并把新结果写回缓存"""
+    if not items:
+        return {}, {}
+    if cache is None:
+        return engine.embed_items(items)
+
+    variant = LONG_TEXT_POOLING
+    if engine.output_dimensionality:
+        variant += f':dim={engine.output_dimensionality}'
+    keys = {key: make_cache_key(text, engine.model_name, engine.task_type, MAX_TEXT_CHARS, variant)
+            for key, text in items}
+    cached = cache.get_many(keys.values())
+    embeddings = {key: cached[cache_key] for key, cache_key in keys.items() if cache_key in cached}
+    pending = [(key, text) for key, text in items if key not in embeddings]
+    print(f"缓存命中 {len(embeddings)} 条，需要请求API {len(pending)} 条")
+
+    failed = {}
+    if pending:
+        new_embeddings, failed = engine.embed_items(pending)
+        cache.put_many((keys[key], embedding) for key, embedding in new_embeddings.items())
+        embeddings.update(new_embeddings)
+    return embeddings, failed
+
+
+def _normalize_whitespace(value: Any) -> Any:
+    """递归规范化JSON值中字符串的空白"""
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, list):
+        return [_normalize_whitespace(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize_whitespace(v) for k, v in value.items()}
+    return value
+
+
+def canonicalize_output(output: str) -> str:
+    """规范化output：JSON按key排序并规范化空白后重新序列化，非JSON文本只规范化空白"""
+    try:
+        value = json.loads(output)
+    except ValueError:
+        return ' '.join(output.split())
+    return json.dumps(_normalize_whitespace(value), ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+def content_hash(text: str) -> str:
+    """规范化文本的内容哈希，用于识别完全重复的output"""
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def iter_csv_chunks(input_file: str, chunk_rows: int, skip_rows: int = 0) -> Iterator[Tuple[int, List[Dict]]]:
+    """
+    惰性读取CSV，每次产出 (截至本块已读取的数据行数, 本块中包含output的行)
+    skip_rows为续跑时需要跳过的已提交行数
+    """
+    with open(input_file, 'r', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        rows_read = 0
+        chunk = []
+        for row in reader:
+            rows_read += 1
+            if rows_read <= skip_rows:
+                continue
+            if row.get('output'):
+                chunk.append(row)
+            if rows_read % chunk_rows == 0:
+                yield rows_read, chunk
+                chunk = []
+        # 行数恰好是chunk_rows整数倍时最后一块已在循环中产出
+        if rows_read > skip_rows and rows_read % chunk_rows:
+            yield rows_read, chunk
+
+
+def process_csv(input_file: str, output_file: str, batch_size: int = 100,
+                cache_file: str = "../data/embedding_cache.sqlite", cache_max_entries: int = 2000000,
+                chunk_rows: int = 5000, resume: bool = True, output_dimensionality: int = None,
+                truncate_locally: bool = True):
+    """
+    流式处理CSV文件，为output列生成embedding（cache_file为None时不使用缓存）
+    完全重复的output（规范化JSON后相同）只请求一次，向量扇出给所有重复行，
+    每行的content_hash写入.content_hash.npy，供聚类时作为重复次数/sample_weight使用
+    每处理chunk_rows行提交一次检查点，中断后重新运行会从上次提交的行继续；
+    重试后仍失败的行写入dead-letter文件，而不是保存为空embedding
+    output_dimensionality: 输出维度（如256/128/64）。truncate_locally为True时请求完整向量
+    （缓存中保留完整维度，可复用于其他维度），写入前截断并重新归一化；否则直接让API返回该维度
+    """
     # 配置API
     api_key = load_api_key()
     genai.configure(api_key=api_key)
     
     print(f"开始处理文件: {input_file}")
     
-    # 读取CSV文件
-    rows = []
-    with open(input_file, 'r', encoding='utf-8-sig') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row.get('output'):
-                rows.append(row)
+    # 并发批量处理（batch_size为单次请求最多包含的文本数）
+    engine = AsyncEmbeddingEngine(max_texts=min(batch_size, MAX_BATCH_TEXTS),
+                                  output_dimensionality=None if truncate_locally else output_dimensionality,
+                                  **load_rate_limit_config())
+    print(f"并发数: {engine.concurrency}, RPM限制: {engine.requests_per_minute}, TPM限制: {engine.tokens_per_minute}")
+    if output_dimensionality:
+        print(f"输出维度: {output_dimensionality} ({'本地截断' if truncate_locally else 'API返回'})")
+    cache = EmbeddingCache(cache_file, max_entries=cache_max_entries) if cache_file else None
     
-    print(f"找到 {len(rows)} 条包含output的数据")
+    writer = SegmentWriter(output_file, resume=resume)
+    if writer.rows_read:
+        print(f"从检查点续跑: 跳过已提交的 {writer.rows_read} 行 (已有 {writer.vectors} 条embedding)")
     
-    # 批量处理
-    results = []
-    for i in range(0, len(rows), batch_size):
-        batch = rows[i:i+batch_size]
-        texts = [row['output'] for row in batch]
-        
-        print(f"处理批次 {i//batch_size + 1}/{(len(rows)-1)//batch_size + 1} ({len(batch)} 条数据)...")
+    # 已写入存储的内容哈希 -> 首次出现的存储行号，用于把向量扇出给后续的重复行
+    first_row = {}
+    for row_no, record in enumerate(writer.iter_records()):
+        first_row.setdefault(record.get('content_hash'), row_no)
+    
+    total_rows = 0
+    total_embedded = 0
+    total_failed = 0
+    for rows_read, rows in iter_csv_chunks(input_file, chunk_rows, skip_rows=writer.rows_read):
+        # 预处理：规范化output，每个不同的内容只请求一次embedding
+        hashes = []
+        pending = {}
+        for row in rows:
+            canonical = canonicalize_output(row['output'])
+            h = content_hash(canonical)
+            hashes.append(h)
+            if h not in first_row and h not in pending:
+                pending[h] = canonical
+        embeddings, failed = embed_with_cache(engine, list(pending.items()), cache)
+        if output_dimensionality and embeddings:
+            keys = list(embeddings)
+            embeddings = dict(zip(keys, truncate_embeddings(np.stack([embeddings[key] for key in keys]),
+                                                            output_dimensionality)))
+        stored = writer.segment_matrix() if any(h in first_row for h in hashes) else None
         
-        embeddings = get_embeddings(texts)
+        # 把向量扇出到共享同一内容的每一行，失败的行写入dead-letter
+        base_row = writer.vectors
+        ids = []
+        previews = []
+        vectors = []
+        extras = []
+        dead_letters = []
+        for row, h in zip(rows, hashes):
+            if h in embeddings:
+                embedding = embeddings[h]
+            elif h in first_row:
+                embedding = stored[first_row[h]]
+            else:
+                dead_letters.append({'id': row.get('id', ''), 'output': row['output'],
+                                     'error': failed.get(h, 'missing embedding')})
+                continue
+            first_row.setdefault(h, base_row + len(ids))
+            ids.append(row.get('id', ''))
+            previews.append(row['output'][:100] + '...' if len(row['output']) > 100 else row['output'])  # 只保存前100字符作为预览
+            vectors.append(embedding)
+            extras.append({'content_hash': h})
         
-        # 保存结果
-        for j, (row, embedding) in enumerate(zip(batch, embeddings)):
-            result = {
-                'id': row.get('id', ''),
-                'output': row['output'][:100] + '...' if len(row['output']) > 100 else row['output'],  # 只保存前100字符作为预览
-                'embedding': embedding,
-                'embedding_dim': len(embedding) if embedding else 0
-            }
-            results.append(result)
+        if vectors:
+            writer.append(ids, np.stack(vectors), previews, extras)
+        writer.append_dead_letters(dead_letters)
+        writer.commit(rows_read)
         
-        print(f"已完成 {min(i+batch_size, len(rows))}/{len(rows)} 条数据")
+        total_rows += len(rows)
+        total_embedded += len(pending)
+        total_failed += len(dead_letters)
+        print(f"已提交 {rows_read} 行 (本次运行处理 {total_rows} 条，去重后请求 {total_embedded} 条，失败 {total_failed} 条)")
     
-    # 保存结果到JSON文件
-    print(f"保存结果到: {output_file}")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    if total_rows:
+        print(f"去重: {total_rows} 条output中有 {total_embedded} 个不同内容，"
+              f"重复率 {1 - total_embedded / total_rows:.1%}")
+    engine.report_throughput()
+    if cache:
+        cache.report()
+        cache.close()
     
-    # 也保存为CSV格式（embedding作为JSON字符串）
-    csv_output = output_file.replace('.json', '_embeddings.csv')
-    print(f"同时保存为CSV格式: {csv_output}")
-    with open(csv_output, 'w', encoding='utf-8', newline='') as f:
-        if results:
-            writer = csv.DictWriter(f, fieldnames=['id', 'output_preview', 'embedding_json', 'embedding_dim'])
-            writer.writeheader()
-            for result in results:
-                writer.writerow({
-                    'id': result['id'],
-                    'output_preview': result['output'],
-                    'embedding_json': json.dumps(result['embedding']) if result['embedding'] else '',
-                    'embedding_dim': result['embedding_dim']
-                })
+    # 合并分段为float32矩阵(.npy) + id索引，下游脚本以memmap方式加载
+    paths = store_paths(output_file)
+    print(f"保存结果到: {paths['matrix']} (索引: {paths['index']})")
+    dim = writer.checkpoint['dim']
+    count = writer.vectors
+    writer.finalize({
+        'model_name': engine.model_name,
+        'task_type': engine.task_type,
+        'normalized': True,
+        'distinct_count': len(first_row),
+        'output_dimensionality': output_dimensionality
+    })
     
-    print(f"完成！共处理 {len(results)} 条数据")
-    print(f"Embedding维度: {results[0]['embedding_dim'] if results else 'N/A'}")
+    if total_failed:
+        print(f"{total_failed} 条数据重试后仍失败，已写入: {paths['deadletter']}")
+    print(f"完成！共 {count} 条embedding")
+    print(f"Embedding维度: {dim if count else 'N/A'}")
 
 
 if __name__ == "__main__":
@@ -144,6 +552,7 @@ if __name__ == "__main__":
         input_file = sys.argv[1]
     if len(sys.argv) > 2:
         output_file = sys.argv[2]
+    output_dimensionality = int(sys.argv[3]) if len(sys.argv) > 3 else None
     
-    process_csv(input_file, output_file)
+    process_csv(input_file, output_file, output_dimensionality=output_dimensionality)
 
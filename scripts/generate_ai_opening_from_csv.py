@@ -10,8 +10,10 @@ import sys
 from typing import Dict, List
 import time
 
+from gemini_client import load_genai
+
 try:
-    import google.generativeai as genai
+    genai = load_genai()  # GEMINI_BACKEND=fake时连接本地模拟服务
 except ImportError:
     print("请先安装google-generativeai: pip install google-generativeai")
     sys.exit(1)
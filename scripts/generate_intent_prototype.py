@@ -13,6 +13,9 @@ import os
 import numpy as np
 from sklearn.metrics.pairwise import cosine_similarity
 
+from cluster_assignments import assignment_exists, load_centroids
+from embedding_store import open_embeddings, store_exists
+
 csv.field_size_limit(sys.maxsize)
 
 
@@ -95,6 +98,8 @@ def generate_intent_prototype(cluster: Dict, metadata_info: Dict, cluster_id: in
     
     prototype = {
         'intent_cluster_id': cluster_id,
+        'stable_cluster_id': cluster.get('stable_id', cluster_id),  # 跨运行不变的聚类id（见cluster_alignment.py）
+        'cluster_status': cluster.get('status'),  # unchanged / split / merged / new，unchanged的原型无需重新生成
         'cluster_size': cluster.get('size', 0),
         'intent_description': {
             'summary': main_description,
@@ -318,20 +323,26 @@ def identify_conversion_opportunities(cluster: Dict) -> List[str]:
     return opportunities
 
 
-def load_cluster_embeddings(embeddings_file: str, cluster_results: Dict) -> Dict[int, np.ndarray]:
-    """加载每个聚类的平均embedding向量"""
+def load_cluster_embeddings(embeddings_file: str, cluster_results: Dict,
+                            assignments_base: str = None) -> Dict[int, np.ndarray]:
+    """加载每个聚类的embedding向量：优先使用cluster_analysis保存的全量聚类中心，否则用top样本的平均值近似"""
     print("加载聚类embedding数据...")
     
-    # 加载embedding数据
-    with open(embeddings_file, 'r', encoding='utf-8') as f:
-        embedding_data = json.load(f)
+    if assignments_base and assignment_exists(assignments_base):
+        centroids = load_centroids(assignments_base)
+        cluster_embeddings = {
+            cluster['cluster_id']: centroids[cluster['cluster_id']]
+            for cluster in cluster_results['cluster_summaries']
+            if cluster['cluster_id'] < len(centroids)
+        }
+        print(f"使用全量聚类中心: {assignments_base}，加载了 {len(cluster_embeddings)} 个聚类的embedding")
+        return cluster_embeddings
+    
+    # 加载embedding数据（二进制存储以memmap打开，只读取用到的行）
+    embeddings, ids, _ = open_embeddings(embeddings_file)
     
-    # 创建id到embedding的映射
-    id_to_embedding = {}
-    for item in embedding_data:
-        if item.get('embedding') is not None:
-            item_id = item['id'].strip('"')
-            id_to_embedding[item_id] = np.array(item['embedding'])
+    # 创建id到行号的映射
+    id_to_row = {item_id.strip('"'): row for row, item_id in enumerate(ids)}
     
     # 为每个聚类计算平均embedding
     cluster_embeddings = {}
@@ -342,8 +353,8 @@ def load_cluster_embeddings(embeddings_file: str, cluster_results: Dict) -> Dict
         # 获取这些样本的embedding
         sample_embeddings = []
         for sample_id in sample_ids:
-            if sample_id in id_to_embedding:
-                sample_embeddings.append(id_to_embedding[sample_id])
+            if sample_id in id_to_row:
+                sample_embeddings.append(np.asarray(embeddings[id_to_row[sample_id]], dtype=np.float32))
         
         if sample_embeddings:
             # 计算平均embedding并归一化
@@ -449,6 +460,8 @@ def merge_clusters(cluster_results: Dict, merged_groups: List[Set[int]]) -> List
             merged_clusters.append({
                 'merged_cluster_ids': [cluster_id],
                 'cluster_id': cluster_id,
+                'stable_id': original_cluster.get('stable_id', cluster_id),
+                'status': original_cluster.get('status'),
                 'size': original_cluster['size'],
                 'top_samples': original_cluster['top_samples'],
                 'summary': original_cluster['summary']
@@ -458,6 +471,7 @@ def merge_clusters(cluster_results: Dict, merged_groups: List[Set[int]]) -> List
             merged_size = 0
             all_top_samples = []
             all_summaries = []
+            all_statuses = []
             
             for cluster_id in group_list:
                 original_cluster = next(c for c in cluster_results['cluster_summaries'] 
@@ -465,6 +479,7 @@ def merge_clusters(cluster_results: Dict, merged_groups: List[Set[int]]) -> List
                 merged_size += original_cluster['size']
                 all_top_samples.extend(original_cluster['top_samples'])
                 all_summaries.append(original_cluster['summary'])
+                all_statuses.append(original_cluster.get('status'))
             
             # 合并摘要（取最长的或最详细的）
             merged_summary = max(all_summaries, key=len)
@@ -483,6 +498,10 @@ def merge_clusters(cluster_results: Dict, merged_groups: List[Set[int]]) -> List
             merged_clusters.append({
                 'merged_cluster_ids': group_list,
                 'cluster_id': group_list[0],  # 使用第一个ID作为主ID
+                'stable_id': next(c.get('stable_id', group_list[0]) for c in cluster_results['cluster_summaries']
+                                  if c['cluster_id'] == group_list[0]),
+                # 成员全部未变化时整体未变化，否则取第一个有变化的成员的状态
+                'status': next((status for status in all_statuses if status != 'unchanged'), 'unchanged'),
                 'size': merged_size,
                 'top_samples': unique_samples,
                 'summary': merged_summary
@@ -594,9 +613,10 @@ def main():
     print(f"   预过滤掉聚类数: {pre_filtered_count}")
     
     # 加载embedding并计算相似度（只对过滤后的聚类）
-    if os.path.exists(embeddings_file):
+    assignments_base = cluster_results.get('assignments', "../results/cluster_assignments")
+    if assignment_exists(assignments_base) or store_exists(embeddings_file) or os.path.exists(embeddings_file):
         print("\n3. 分析聚类相似度...")
-        cluster_embeddings = load_cluster_embeddings(embeddings_file, filtered_cluster_results)
+        cluster_embeddings = load_cluster_embeddings(embeddings_file, filtered_cluster_results, assignments_base)
         
         if cluster_embeddings:
             merged_groups = calculate_cluster_similarity(cluster_embeddings, similarity_threshold)
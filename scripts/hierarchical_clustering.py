@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+多层级聚类（二分球面k-means），一次运行得到从粗到细的聚类树
+- 从全部数据开始，每次把簇内余弦距离和（SSE）最大的叶子节点二分，只在该节点自己的样本上拟合
+- 叶子数达到每一层的目标数时记录一层快照，下一层在此基础上继续二分（未被拆分的节点原样进入下一层）
+- 每层输出与cluster_results.json兼容的结果（附parent_id / children）和全量分配结果（见cluster_assignments.py），
+  以及整棵树的父子关系 tree.json，看板和prototype可以逐层下钻而无需重新拟合
+- 各层的摘要都提交到同一个SummaryPipeline（共享并发数和每分钟请求数限制），与后续层的分配结果写入重叠
+
+用法:
+    python hierarchical_clustering.py [embedding文件] [每层聚类数,如5,15,40]
+"""
+import json
+import os
+import sys
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from cluster_analysis import (configure_genai, fallback_summary, generate_cluster_summary_async, load_embeddings,
+                              load_full_outputs)
+from cluster_assignments import representative_samples, write_assignments
+from spherical_kmeans import MiniBatchSphericalKMeans, SphericalKMeans, normalize_rows
+from summary_pipeline import DEFAULT_SUMMARY_CONCURRENCY, DEFAULT_SUMMARY_RPM, SummaryPipeline
+
+FULL_BATCH_MAX_ROWS = 200000  # 超过该行数的节点用小批量球面k-means二分
+
+
+def bisect_node(matrix: np.ndarray, rows: np.ndarray, seed: int = 42) -> Dict:
+    """在一个节点的样本上做二分，返回两个子节点的行号、中心和SSE"""
+    X = normalize_rows(matrix[rows])
+    if len(rows) > FULL_BATCH_MAX_ROWS:
+        model = MiniBatchSphericalKMeans(n_clusters=2, batch_size=4096, n_init=3, random_state=seed)
+    else:
+        model = SphericalKMeans(n_clusters=2, n_init=3, random_state=seed)
+    labels = model.fit_predict(X)
+    centers = model.cluster_centers_
+    sims = np.einsum('ij,ij->i', X, centers[labels])
+    children = []
+    for child in range(2):
+        mask = labels == child
+        children.append({
+            'rows': rows[mask],
+            'centroid': centers[child],
+            'sse': float((1.0 - sims[mask]).sum())
+        })
+    return children
+
+
+def build_cluster_tree(matrix: np.ndarray, level_sizes: List[int], min_cluster_size: int = 20,
+                       seed: int = 42) -> List[Dict]:
+    """
+    逐层二分构建聚类树，返回每层的快照:
+    [{'labels': 行 -> 该层聚类id, 'centroids': (m, dim), 'parents': 该层聚类 -> 上一层聚类id（第一层为None）}]
+    """
+    n = len(matrix)
+    all_rows = np.arange(n)
+    root_centroid = normalize_rows(np.asarray(
+        sum(normalize_rows(matrix[start:start + 65536]).sum(axis=0) for start in range(0, n, 65536)))[None, :])[0]
+    root_sims = np.concatenate([normalize_rows(matrix[start:start + 65536]) @ root_centroid
+                                for start in range(0, n, 65536)])
+    # 叶子节点: rows / centroid / sse / parent（上一层快照中的聚类id）/ unsplittable（二分得到空子节点，不再参与拆分）
+    leaves = [{'rows': all_rows, 'centroid': root_centroid, 'sse': float((1.0 - root_sims).sum()), 'parent': None}]
+    levels = []
+    bisections = 0
+    for level, target in enumerate(sorted(level_sizes), 1):
+        while len(leaves) < target:
+            splittable = [i for i, leaf in enumerate(leaves)
+                          if len(leaf['rows']) >= 2 * min_cluster_size and not leaf.get('unsplittable')]
+            if not splittable:
+                print(f"  没有可继续拆分的节点（最小聚类大小 {min_cluster_size}，其余节点为重复样本无法二分），"
+                      f"第 {level} 层只得到 {len(leaves)} 个聚类（目标 {target}）")
+                break
+            index = max(splittable, key=lambda i: leaves[i]['sse'])
+            leaf = leaves.pop(index)
+            children = bisect_node(matrix, leaf['rows'], seed + bisections)
+            bisections += 1
+            if min(len(child['rows']) for child in children) == 0:
+                # 无法再分的节点（如全部重复）不再参与拆分
+                leaf['unsplittable'] = True
+                leaves.insert(index, leaf)
+                continue
+            for child in children:
+                child['parent'] = leaf['parent']
+            leaves[index:index] = children
+
+        labels = np.empty(n, dtype=np.int32)
+        for cluster_id, leaf in enumerate(leaves):
+            labels[leaf['rows']] = cluster_id
+        levels.append({
+            'labels': labels,
+            'centroids': np.stack([leaf['centroid'] for leaf in leaves]).astype(np.float32),
+            'parents': [leaf['parent'] for leaf in leaves]
+        })
+        print(f"第 {level} 层: {len(leaves)} 个聚类 (累计二分 {bisections} 次)")
+        for cluster_id, leaf in enumerate(leaves):
+            leaf['parent'] = cluster_id
+    return levels
+
+
+def submit_level_summaries(pipeline: SummaryPipeline, level: int, top: Dict[int, List[int]], data: List[Dict]):
+    """把一层各聚类的代表样本提交到摘要流水线（按 (层, 聚类) 区分，进度文件中记录level和cluster_id）"""
+    for cluster_id, rows in top.items():
+        pipeline.submit((level, cluster_id), [data[idx] for idx in rows],
+                        {'level': level, 'cluster_id': cluster_id})
+
+
+def build_level_results(level: int, snapshot: Dict, top: Dict[int, List[int]], data: List[Dict],
+                        child_map: Dict[int, List[int]], pipeline: SummaryPipeline,
+                        assignments_base: str) -> Dict:
+    """生成与cluster_results.json兼容的单层结果（额外包含level / parent_id / children）；pipeline为None时不含摘要"""
+    labels = snapshot['labels']
+    k = len(snapshot['centroids'])
+    sizes = np.bincount(labels, minlength=k)
+    cluster_summaries = []
+    for cluster_id in range(k):
+        top_samples = [data[idx] for idx in top[cluster_id]]
+        summary = pipeline.result((level, cluster_id)) if pipeline else ''
+        summary_error = pipeline.failures.get((level, cluster_id)) if pipeline else None
+        if summary_error is not None:
+            summary = fallback_summary(int(sizes[cluster_id]))
+        cluster_summaries.append({
+            'cluster_id': cluster_id,
+            'size': int(sizes[cluster_id]),
+            'parent_id': snapshot['parents'][cluster_id],
+            'children': child_map.get(cluster_id, []),
+            'top_samples': [
+                {'id': sample['id'], 'output_preview': sample.get('output', '')[:200]}
+                for sample in top_samples
+            ],
+            'summary': summary,
+            **({'summary_error': summary_error} if summary_error is not None else {})
+        })
+    return {
+        'level': level,
+        'optimal_k': k,
+        'assignments': assignments_base,
+        'cluster_summaries': cluster_summaries,
+        'total_samples': len(labels)
+    }
+
+
+def main():
+    # 配置（相对于scripts目录）
+    embeddings_file = "../data/output_embeddings.json"
+    csv_file = "../data/ikarao.csv"
+    output_dir = "../results/hierarchy"
+    level_sizes = [5, 15, 40]  # 每一层的聚类数（由粗到细）
+    min_cluster_size = 20  # 小于该大小两倍的节点不再拆分
+    top_n_samples = 10
+    summarize = True  # 是否为每层每个聚类调用AI生成摘要
+    summary_concurrency = DEFAULT_SUMMARY_CONCURRENCY  # 同时在途的摘要请求数（所有层共享）
+    summary_rpm = DEFAULT_SUMMARY_RPM  # 每分钟最多发出的摘要请求数（所有层共享）
+    summary_progress_file = os.path.join(output_dir, "cluster_summaries.partial.jsonl")  # 每个摘要完成时立即追加写入
+
+    if len(sys.argv) > 1:
+        embeddings_file = sys.argv[1]
+    if len(sys.argv) > 2:
+        level_sizes = [int(size) for size in sys.argv[2].split(',')]
+
+    if summarize:
+        api_key = os.getenv('GEMINI_API_KEY')
+        if not api_key:
+            api_key = input("请输入您的Gemini API Key: ").strip()
+        configure_genai(api_key)
+
+    full_outputs = load_full_outputs(csv_file) if os.path.exists(csv_file) else None
+    embeddings, data = load_embeddings(embeddings_file, full_outputs)
+    ids = [sample['id'] for sample in data]
+
+    print("\n" + "="*50)
+    print(f"构建聚类树 (每层聚类数: {level_sizes})...")
+    start = time.time()
+    levels = build_cluster_tree(embeddings, level_sizes, min_cluster_size)
+    print(f"聚类树构建完成，耗时 {time.time() - start:.1f}s")
+
+    os.makedirs(output_dir, exist_ok=True)
+    pipeline = None
+    if summarize:
+        pipeline = SummaryPipeline(generate_cluster_summary_async, summary_concurrency, summary_rpm,
+                                   summary_progress_file)
+    # 先写出各层分配结果并提交摘要请求，摘要在后台生成时继续处理后面的层
+    level_tops = []
+    for level, snapshot in enumerate(levels, 1):
+        print(f"\n保存第 {level} 层分配结果...")
+        assignments_base = os.path.join(output_dir, f"level_{level}.assignments")
+        columns, _, _ = write_assignments(assignments_base, embeddings, snapshot['centroids'], ids,
+                                          labels=snapshot['labels'],
+                                          metadata={'embeddings_file': embeddings_file, 'level': level})
+        top, _ = representative_samples(columns['similarity'], snapshot['labels'], len(snapshot['centroids']),
+                                        top_n_samples)
+        level_tops.append(top)
+        if pipeline:
+            submit_level_summaries(pipeline, level, top, data)
+            print(f"  已提交 {len(top)} 个摘要请求")
+
+    tree = {'embeddings_file': embeddings_file, 'level_sizes': level_sizes, 'levels': []}
+    for level, snapshot in enumerate(levels, 1):
+        print(f"\n保存第 {level} 层结果...")
+        # 下一层中以本层聚类为父节点的子聚类
+        child_map = {}
+        if level < len(levels):
+            for child_id, parent_id in enumerate(levels[level]['parents']):
+                child_map.setdefault(parent_id, []).append(child_id)
+
+        assignments_base = os.path.join(output_dir, f"level_{level}.assignments")
+        results = build_level_results(level, snapshot, level_tops[level - 1], data, child_map, pipeline,
+                                      assignments_base)
+        results_file = os.path.join(output_dir, f"level_{level}.cluster_results.json")
+        with open(results_file, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"  {results['optimal_k']} 个聚类 -> {results_file}")
+
+        tree['levels'].append({
+            'level': level,
+            'n_clusters': results['optimal_k'],
+            'results': results_file,
+            'assignments': assignments_base,
+            'parents': snapshot['parents'],
+            'children': {str(parent): children for parent, children in child_map.items()}
+        })
+
+    tree_file = os.path.join(output_dir, "tree.json")
+    with open(tree_file, 'w', encoding='utf-8') as f:
+        json.dump(tree, f, ensure_ascii=False, indent=2)
+    print(f"\n聚类树父子关系已保存到: {tree_file}")
+    if pipeline:
+        print(f"摘要流水线完成，共耗时 {pipeline.close():.1f}s"
+              + (f"，{len(pipeline.failures)} 个摘要生成失败（见各层结果中的summary_error）" if pipeline.failures else ""))
+
+
+if __name__ == "__main__":
+    main()
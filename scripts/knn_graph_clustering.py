@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+基于近似kNN图的密度聚类（不需要选择k，允许噪声点）
+- 近似kNN图（倒排分桶）: 先用小批量球面k-means把数据分成约 √n 个桶，每个桶的样本只在与其最近的
+  n_probe 个桶的成员中搜索近邻（分块float32 GEMM），总计算量约为 O(n · n_probe · n/桶数 · d)
+- 密度聚类: 在kNN图的余弦距离上做HDBSCAN（互达距离 + 最小生成树 + 稳定性最大的簇），
+  最小生成树只在 n·k 条边上构建，复杂度约 O(n·k·log n)；稀疏区域的样本标为噪声，不需要选择k
+- 噪声点标签为 -1，聚类按大小降序编号（需要scikit-learn>=1.3）
+"""
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
+
+from spherical_kmeans import BLOCK_ROWS, MiniBatchSphericalKMeans, normalize_rows
+
+SCORE_BUDGET = 1 << 26  # 每次GEMM的相似度矩阵最多元素数（float32约256MB）
+
+
+def build_knn_graph(X: np.ndarray, n_neighbors: int = 15, n_cells: int = None, n_probe: int = 4,
+                    seed: int = 42, block_rows: int = BLOCK_ROWS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    近似kNN图，返回 (neighbors (n, n_neighbors) int32, similarities (n, n_neighbors) float32)，按相似度降序，不含自身
+    X可以是memmap：分桶和搜索都按块/按桶读取并归一化，内存中只保留一个桶的查询和候选向量（约 n_probe·n/桶数 行），
+    不会载入整个矩阵；样本数不多时（只有一个桶）等价于精确搜索
+    """
+    n = len(X)
+    n_neighbors = min(n_neighbors, n - 1)
+    n_cells = n_cells or max(1, int(np.sqrt(n)))
+    n_probe = min(n_probe, n_cells)
+
+    if n_cells > 1:
+        # 小批量拟合只读取采样批次，fit结束时的labels_按块分配（块内归一化）
+        partitioner = MiniBatchSphericalKMeans(n_clusters=n_cells, batch_size=4096, n_init=1, max_iter=5,
+                                               random_state=seed, block_rows=block_rows)
+        cells = partitioner.fit(X).labels_
+        centers = partitioner.cluster_centers_
+        probes = np.argsort(-(centers @ centers.T), axis=1)[:, :n_probe]
+    else:
+        cells = np.zeros(n, dtype=np.int32)
+        probes = np.zeros((1, 1), dtype=np.int64)
+
+    order = np.argsort(cells, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength=n_cells))])
+    neighbors = np.empty((n, n_neighbors), dtype=np.int32)
+    similarities = np.empty((n, n_neighbors), dtype=np.float32)
+    for cell in range(n_cells):
+        queries = order[starts[cell]:starts[cell + 1]]
+        if not len(queries):
+            continue
+        candidates = np.concatenate([order[starts[c]:starts[c + 1]] for c in probes[cell]])
+        candidate_vectors = normalize_rows(X[candidates])
+        step = max(1, SCORE_BUDGET // max(len(candidates), 1))
+        for q_start in range(0, len(queries), step):
+            rows = queries[q_start:q_start + step]
+            scores = normalize_rows(X[rows]) @ candidate_vectors.T
+            # 去掉自身（候选中一定包含查询所在的桶）
+            self_mask = candidates[None, :] == rows[:, None]
+            scores[self_mask] = -np.inf
+            m = min(n_neighbors, len(candidates) - 1)
+            top = np.argpartition(-scores, m - 1, axis=1)[:, :m]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            ranking = np.argsort(-top_scores, axis=1, kind='stable')
+            top = np.take_along_axis(top, ranking, axis=1)
+            neighbors[rows, :m] = candidates[top]
+            similarities[rows, :m] = np.take_along_axis(top_scores, ranking, axis=1)
+            if m < n_neighbors:
+                # 候选不足（极小的桶）时用自身补齐，相似度记为-1，后续不会形成边
+                neighbors[rows, m:] = rows[:, None]
+                similarities[rows, m:] = -1.0
+    return neighbors, similarities
+
+
+def knn_distance_graph(neighbors: np.ndarray, similarities: np.ndarray) -> csr_matrix:
+    """
+    对称的稀疏余弦距离图（1 - cos，双向取较近的一个）；各连通分量之间用距离为2（余弦距离上限）的边串起来，
+    HDBSCAN要求图连通，这些边在层次树的最顶层才合并，不会影响聚类
+    """
+    n, k = neighbors.shape
+    valid = similarities.ravel() > -1.0
+    distances = np.maximum(1.0 - similarities.ravel()[valid], 1e-6)  # 稀疏矩阵中0会被当作缺失的边
+    rows = np.repeat(np.arange(n), k)[valid]
+    graph = csr_matrix((distances, (rows, neighbors.ravel()[valid])), shape=(n, n))
+    graph = graph.maximum(graph.T)
+    n_components, components = connected_components(graph, directed=False)
+    if n_components > 1:
+        representatives = np.unique(components, return_index=True)[1]
+        bridges = coo_matrix((np.full(n_components - 1, 2.0), (representatives[:-1], representatives[1:])),
+                             shape=(n, n))
+        graph = (graph + bridges + bridges.T).tocsr()
+    return graph
+
+
+def density_clustering(neighbors: np.ndarray, similarities: np.ndarray, min_cluster_size: int = 20,
+                       min_samples: int = 10) -> Tuple[np.ndarray, Dict]:
+    """在kNN距离图上做HDBSCAN（稀疏预计算距离，最小生成树只在kNN边上构建），返回 (labels（噪声为-1）, 统计信息)"""
+    from sklearn.cluster import HDBSCAN
+
+    min_samples = min(min_samples, neighbors.shape[1])
+    graph = knn_distance_graph(neighbors, similarities)
+    labels = HDBSCAN(min_cluster_size=min_cluster_size, min_samples=min_samples, metric='precomputed',
+                     copy=True).fit_predict(graph)
+
+    # 按聚类大小降序重新编号为 0..m-1
+    clustered = labels >= 0
+    cluster_ids, cluster_sizes = np.unique(labels[clustered], return_counts=True)
+    remap = np.full(labels.max() + 2, -1, dtype=np.int64)
+    remap[cluster_ids[np.argsort(-cluster_sizes, kind='stable')]] = np.arange(len(cluster_ids))
+    labels = remap[labels].astype(np.int32)
+
+    info = {
+        'n_neighbors': int(neighbors.shape[1]),
+        'min_cluster_size': int(min_cluster_size),
+        'min_samples': int(min_samples),
+        'graph_edges': int(graph.nnz // 2),
+        'n_clusters': int(len(cluster_ids)),
+        'noise_samples': int((labels < 0).sum())
+    }
+    return labels, info
+
+
+def cluster_centroids(X: np.ndarray, labels: np.ndarray, n_clusters: int,
+                      block_rows: int = BLOCK_ROWS) -> np.ndarray:
+    """每个聚类成员归一化向量之和再归一化（噪声点不参与）"""
+    sums = np.zeros((n_clusters, X.shape[1]), dtype=np.float64)
+    for start in range(0, len(X), block_rows):
+        block = normalize_rows(X[start:start + block_rows])
+        block_labels = np.asarray(labels[start:start + len(block)])
+        members = block_labels >= 0
+        one_hot = np.zeros((int(members.sum()), n_clusters), dtype=np.float32)
+        one_hot[np.arange(len(one_hot)), block_labels[members]] = 1.0
+        sums += one_hot.T @ block[members]
+    return normalize_rows(sums)
+
+
+def knn_graph_cluster(X: np.ndarray, n_neighbors: int = 15, min_cluster_size: int = 20, min_samples: int = 10,
+                      n_probe: int = 4, seed: int = 42) -> Tuple[np.ndarray, Dict]:
+    """构建近似kNN图并聚类，返回 (labels（噪声为-1）, 参数与统计信息)"""
+    print(f"构建近似kNN图 (k={n_neighbors}, n_probe={n_probe})...")
+    start = time.time()
+    neighbors, similarities = build_knn_graph(X, n_neighbors, n_probe=n_probe, seed=seed)
+    graph_seconds = time.time() - start
+    print(f"  kNN图构建完成，耗时 {graph_seconds:.1f}s")
+
+    start = time.time()
+    labels, info = density_clustering(neighbors, similarities, min_cluster_size, min_samples)
+    info.update({'engine': 'knn_graph', 'n_probe': n_probe, 'graph_seconds': graph_seconds,
+                 'cluster_seconds': time.time() - start})
+    print(f"  HDBSCAN: {info['n_clusters']} 个聚类, 噪声 {info['noise_samples']} 个 "
+          f"(kNN图 {info['graph_edges']} 条边), 耗时 {info['cluster_seconds']:.1f}s")
+    return labels, info
+
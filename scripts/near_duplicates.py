@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+聚类前的近重复折叠（embedding符号位SimHash + LSH分桶）
+- 完全重复的output先按.content_hash.npy中的内容哈希合并（见embedding_store.load_duplicate_groups）
+- 其余行用随机超平面的符号位做SimHash签名（余弦相似度为s的两行每一位相同的概率为 1 - arccos(s)/π），
+  签名切成 n_bands 段，任一段相同的行进入同一个桶，只在桶内用精确余弦相似度验证 >= threshold 的行对
+- 超过 max_bucket 的桶（如数千条几乎相同的行，每一段都落在同一个桶）不做两两比较，
+  而是依次取未归组的行作为枢轴，按块与其余行比较（每个枢轴 O(m·d)），相似的行与枢轴连边
+- 验证通过的行对取连通分量作为一组，每组保留编号最小的一行作为代表，重复次数作为聚类的sample_weight；
+  组内所有行沿用代表的标签，聚类大小仍按真实行数统计
+"""
+import time
+from typing import Dict
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from spherical_kmeans import BLOCK_ROWS, normalize_rows
+
+MAX_BUCKET = 5000  # 超过该大小的桶不做两两验证，改用枢轴验证
+MAX_PIVOTS = 32  # 每个超大桶最多使用的枢轴数，之后剩余的行在这一段上不再验证
+
+
+def simhash_signatures(matrix: np.ndarray, rows: np.ndarray, n_bits: int = 128, n_bands: int = 8,
+                       seed: int = 42, block_rows: int = BLOCK_ROWS) -> np.ndarray:
+    """给定行的SimHash签名，按段返回 (len(rows), n_bands) 的无符号整数键"""
+    band_bytes = n_bits // 8 // n_bands
+    if n_bits % 8 or (n_bits // 8) % n_bands or band_bytes not in (1, 2, 4, 8):
+        raise ValueError(f"n_bits={n_bits} 不能按字节均分为 {n_bands} 段（每段1/2/4/8字节）")
+    hyperplanes = np.random.RandomState(seed).standard_normal((matrix.shape[1], n_bits)).astype(np.float32)
+    packed = np.empty((len(rows), n_bits // 8), dtype=np.uint8)
+    for start in range(0, len(rows), block_rows):
+        block = np.asarray(matrix[rows[start:start + block_rows]], dtype=np.float32)
+        packed[start:start + len(block)] = np.packbits(block @ hyperplanes > 0, axis=1)
+    return packed.view(f'u{band_bytes}')
+
+
+def _equal_runs(sorted_keys: np.ndarray):
+    """排序后的键中相同值的连续区间，返回长度 >1 的区间 (starts, ends)"""
+    boundaries = np.flatnonzero(np.diff(sorted_keys)) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(sorted_keys)]])
+    keep = ends - starts > 1
+    return starts[keep], ends[keep]
+
+
+def _pivot_pairs(matrix: np.ndarray, rows: np.ndarray, members: np.ndarray, threshold: float,
+                 max_pivots: int = MAX_PIVOTS, block_rows: int = BLOCK_ROWS):
+    """
+    超大桶的验证：依次取第一条未归组的行作为枢轴，按块计算未归组行与它的余弦相似度，
+    >= threshold 的行与枢轴连边并移出；返回 (left, right, 比较次数, 未验证的行数)
+    """
+    left, right = [], []
+    compared = 0
+    remaining = members
+    for _ in range(max_pivots):
+        if len(remaining) < 2:
+            break
+        pivot = normalize_rows(matrix[rows[remaining[:1]]])[0]
+        others = remaining[1:]
+        sims = np.concatenate([normalize_rows(matrix[rows[others[start:start + block_rows]]]) @ pivot
+                               for start in range(0, len(others), block_rows)])
+        close = sims >= threshold
+        left.append(np.full(int(close.sum()), remaining[0]))
+        right.append(others[close])
+        compared += len(others)
+        remaining = others[~close]
+    return left, right, compared, len(remaining) if len(remaining) > 1 else 0
+
+
+def collapse_near_duplicates(matrix: np.ndarray, threshold: float = 0.98, exact_groups: np.ndarray = None,
+                             n_bits: int = 128, n_bands: int = 8, max_bucket: int = MAX_BUCKET,
+                             seed: int = 42, block_rows: int = BLOCK_ROWS) -> Dict:
+    """
+    返回 {'representatives': 每组代表行号, 'group_of': 每行所在组, 'counts': 每组行数, 'info': 统计信息}
+    exact_groups: 每行的完全重复组编号（如content_hash分组），None时每行单独成组
+    """
+    start_time = time.time()
+    n = len(matrix)
+    if exact_groups is None:
+        exact_groups = np.arange(n)
+    _, unique_rows, exact_of = np.unique(exact_groups, return_index=True, return_inverse=True)
+    n_unique = len(unique_rows)
+
+    signatures = simhash_signatures(matrix, unique_rows, n_bits, n_bands, seed, block_rows)
+    left, right = [], []
+    verified = 0
+    oversized_buckets = 0
+    unverified_rows = 0
+    for band in range(n_bands):
+        keys = signatures[:, band]
+        order = np.argsort(keys, kind='stable')
+        for bucket_start, bucket_end in zip(*_equal_runs(keys[order])):
+            members = order[bucket_start:bucket_end]
+            if len(members) > max_bucket:
+                oversized_buckets += 1
+                pivot_left, pivot_right, compared, unverified = _pivot_pairs(
+                    matrix, unique_rows, members, threshold, block_rows=block_rows)
+                left.extend(pivot_left)
+                right.extend(pivot_right)
+                verified += compared
+                unverified_rows += unverified
+                continue
+            vectors = normalize_rows(matrix[unique_rows[members]])
+            i, j = np.nonzero(np.triu(vectors @ vectors.T >= threshold, 1))
+            left.append(members[i])
+            right.append(members[j])
+            verified += len(members) * (len(members) - 1) // 2
+
+    left = np.concatenate(left) if left else np.empty(0, dtype=np.int64)
+    right = np.concatenate(right) if right else np.empty(0, dtype=np.int64)
+    graph = coo_matrix((np.ones(len(left), dtype=np.int8), (left, right)), shape=(n_unique, n_unique))
+    _, near_of = connected_components(graph, directed=False)
+
+    # 组编号按代表行（组内最小行号）排序
+    _, representatives, group_of, counts = np.unique(near_of[exact_of], return_index=True,
+                                                     return_inverse=True, return_counts=True)
+    order = np.argsort(representatives)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    info = {
+        'threshold': threshold,
+        'n_bits': n_bits,
+        'n_bands': n_bands,
+        'n_rows': int(n),
+        'exact_groups': int(n_unique),
+        'n_groups': int(len(representatives)),
+        'collapse_ratio': float(len(representatives) / n) if n else 1.0,
+        'near_duplicate_pairs': int(len(np.unique(left * n_unique + right))),
+        'verified_pairs': int(verified),
+        'oversized_buckets': int(oversized_buckets),
+        'unverified_rows': int(unverified_rows),  # 各段超大桶中枢轴用尽后未验证的行数（累计）
+        'seconds': time.time() - start_time
+    }
+    return {
+        'representatives': representatives[order],
+        'group_of': rank[group_of.ravel()],
+        'counts': counts[order],
+        'info': info
+    }
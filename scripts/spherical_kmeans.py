@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+球面k-means（余弦k-means），用于L2归一化的embedding
+- 分配: 样本与中心的点积（float32 GEMM，按块处理，支持memmap）
+- 更新: 簇内向量之和再归一化，中心始终为单位向量
+- SphericalKMeans: 全量批处理迭代；MiniBatchSphericalKMeans: 小批量在线更新，支持partial_fit
+接口与sklearn的KMeans / MiniBatchKMeans保持一致（fit / predict / fit_predict / cluster_centers_ / labels_ / inertia_），
+inertia_ 为余弦距离之和 Σ(1 - cos)；fit支持sample_weight（如coreset权重），此时各项按权重累加
+"""
+from typing import Tuple
+
+import numpy as np
+
+BLOCK_ROWS = 65536
+REASSIGN_EVERY = 10  # 小批量模式每隔多少个批次检查一次样本过少的中心
+
+
+def normalize_rows(x: np.ndarray) -> np.ndarray:
+    """返回float32的单位行向量副本（零向量保持为零）"""
+    x = np.array(x, dtype=np.float32)
+    norms = np.sqrt(np.einsum('ij,ij->i', x, x))[:, None]
+    norms[norms == 0] = 1.0
+    x /= norms
+    return x
+
+
+def assign_blocked(X: np.ndarray, centers: np.ndarray, block_rows: int = BLOCK_ROWS,
+                   normalize: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """按块计算点积分配，返回 (labels, 与所属中心的余弦相似度)"""
+    centers_t = np.ascontiguousarray(centers.T, dtype=np.float32)
+    labels = np.empty(len(X), dtype=np.int32)
+    sims = np.empty(len(X), dtype=np.float32)
+    for start in range(0, len(X), block_rows):
+        block = np.asarray(X[start:start + block_rows], dtype=np.float32)
+        if normalize:
+            block = normalize_rows(block)
+        scores = block @ centers_t
+        block_labels = scores.argmax(axis=1)
+        labels[start:start + len(block)] = block_labels
+        sims[start:start + len(block)] = scores[np.arange(len(block)), block_labels]
+    return labels, sims
+
+
+def kmeanspp_init(X: np.ndarray, n_clusters: int, rng: np.random.RandomState,
+                  n_local_trials: int = None, sample_weight: np.ndarray = None) -> np.ndarray:
+    """
+    球面上的贪心k-means++：按 1-cos（单位球面上与欧氏距离平方成正比）的概率抽取候选种子，
+    每步取使总距离下降最多的候选（与sklearn默认的 2+log(k) 个候选一致）；有sample_weight时距离按权重加权
+    """
+    if n_local_trials is None:
+        n_local_trials = 2 + int(np.log(n_clusters))
+    weights = None if sample_weight is None else np.asarray(sample_weight, dtype=np.float32)
+    centers = np.empty((n_clusters, X.shape[1]), dtype=np.float32)
+    if weights is None:
+        centers[0] = X[rng.randint(len(X))]
+    else:
+        centers[0] = X[rng.choice(len(X), p=weights / weights.sum(dtype=np.float64))]
+    closest = np.maximum(1.0 - X @ centers[0], 0)
+    if weights is not None:
+        closest *= weights
+    for i in range(1, n_clusters):
+        total = float(closest.sum(dtype=np.float64))
+        if total > 0:
+            cumulative = np.cumsum(closest, dtype=np.float64)
+            candidates = np.searchsorted(cumulative, rng.uniform(size=n_local_trials) * total)
+            candidates = np.minimum(candidates, len(X) - 1)
+        else:
+            candidates = rng.randint(len(X), size=n_local_trials)
+        candidate_distances = np.maximum(1.0 - X[candidates] @ X.T, 0)
+        if weights is not None:
+            candidate_distances *= weights
+        candidate_distances = np.minimum(closest[None, :], candidate_distances)
+        best = int(candidate_distances.sum(axis=1).argmin())
+        centers[i] = X[candidates[best]]
+        closest = candidate_distances[best]
+    return centers
+
+
+def _init_sample(X: np.ndarray, size: int, rng: np.random.RandomState,
+                 sample_weight: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+    """从X（可为memmap）中随机抽取归一化后的初始化样本，返回 (样本, 对应权重或None)"""
+    if len(X) <= size:
+        return normalize_rows(X[:]), sample_weight
+    indices = np.sort(rng.choice(len(X), size, replace=False))
+    return normalize_rows(X[indices]), None if sample_weight is None else sample_weight[indices]
+
+
+def _as_weights(sample_weight) -> np.ndarray:
+    return None if sample_weight is None else np.asarray(sample_weight, dtype=np.float32)
+
+
+def _cosine_cost(sims: np.ndarray, sample_weight: np.ndarray = None) -> float:
+    """余弦距离和 Σ w·(1 - cos)，无权重时w=1"""
+    if sample_weight is None:
+        return float(len(sims) - sims.sum(dtype=np.float64))
+    return float(np.dot(sample_weight.astype(np.float64), 1.0 - sims.astype(np.float64)))
+
+
+class SphericalKMeans:
+    """全量批处理的球面k-means，每次迭代对全部数据做一次分块GEMM"""
+
+    def __init__(self, n_clusters: int = 8, n_init: int = 3, max_iter: int = 100, tol: float = 1e-4,
+                 init_size: int = None, random_state: int = None, block_rows: int = BLOCK_ROWS, verbose: bool = False,
+                 init: np.ndarray = None):
+        self.n_clusters = n_clusters
+        self.init = init  # None为k-means++；(n_clusters, dim)数组为给定的初始中心（热启动，忽略n_init）
+        self.n_init = n_init
+        self.max_iter = max_iter
+        self.tol = tol
+        self.init_size = init_size
+        self.random_state = random_state
+        self.block_rows = block_rows
+        self.verbose = verbose
+
+    def _lloyd(self, X: np.ndarray, centers: np.ndarray, normalized: bool = False,
+               sample_weight: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, float, int]:
+        """从给定中心开始迭代，返回 (中心, 标签, 余弦距离和, 迭代次数)；normalized=True表示X已归一化"""
+        k = self.n_clusters
+        previous = None
+        for iteration in range(1, self.max_iter + 1):
+            sums = np.zeros((k, X.shape[1]), dtype=np.float32)
+            labels = np.empty(len(X), dtype=np.int32)
+            sims = np.empty(len(X), dtype=np.float32)
+            for start in range(0, len(X), self.block_rows):
+                block = X[start:start + self.block_rows]
+                block = block if normalized else normalize_rows(block)
+                scores = block @ centers.T
+                block_labels = scores.argmax(axis=1)
+                labels[start:start + len(block)] = block_labels
+                sims[start:start + len(block)] = scores[np.arange(len(block)), block_labels]
+                one_hot = np.zeros((len(block), k), dtype=np.float32)
+                one_hot[np.arange(len(block)), block_labels] = (
+                    1.0 if sample_weight is None else sample_weight[start:start + len(block)])
+                sums += one_hot.T @ block
+            objective = _cosine_cost(sims, sample_weight)
+            if self.verbose:
+                print(f"    迭代 {iteration}: 余弦距离和={objective:.4f}")
+
+            # 空簇用当前拟合最差的样本重新播种
+            empty = np.where(~sums.any(axis=1))[0]
+            if len(empty):
+                worst = np.argsort(sims)[:len(empty)]
+                sums[empty] = normalize_rows(X[np.sort(worst)])
+            centers = normalize_rows(sums)
+
+            if previous is not None and previous - objective <= self.tol * max(previous, 1e-12):
+                break
+            previous = objective
+        return centers, labels, objective, iteration
+
+    def fit(self, X: np.ndarray, y=None, sample_weight: np.ndarray = None) -> 'SphericalKMeans':
+        rng = np.random.RandomState(self.random_state)
+        init_size = self.init_size or min(len(X), max(10 * self.n_clusters, 20000))
+        weights = _as_weights(sample_weight)
+        # 内存中的数组只归一化一次；memmap保持按块读取，每次迭代逐块归一化
+        normalized = not isinstance(X, np.memmap)
+        data = normalize_rows(X) if normalized else X
+        best = None
+        if self.init is not None:
+            best = self._lloyd(data, normalize_rows(np.asarray(self.init, dtype=np.float32)), normalized, weights)
+        for _ in range(0 if self.init is not None else max(1, self.n_init)):
+            init, init_weights = _init_sample(X, init_size, rng, weights)
+            centers = kmeanspp_init(init, self.n_clusters, rng, sample_weight=init_weights)
+            result = self._lloyd(data, centers, normalized, weights)
+            if best is None or result[2] < best[2]:
+                best = result
+        self.cluster_centers_, _, _, self.n_iter_ = best
+        # 返回前用最终中心重新分配，保证labels_、inertia_与cluster_centers_一致
+        self.labels_, sims = assign_blocked(data, self.cluster_centers_, self.block_rows, normalize=not normalized)
+        self.inertia_ = _cosine_cost(sims, weights)
+        return self
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return assign_blocked(X, self.cluster_centers_, self.block_rows, normalize=True)[0]
+
+    def fit_predict(self, X: np.ndarray, y=None, sample_weight: np.ndarray = None) -> np.ndarray:
+        return self.fit(X, sample_weight=sample_weight).labels_
+
+
+class MiniBatchSphericalKMeans:
+    """
+    小批量球面k-means：每个批次分配后，中心按 normalize(count_j·c_j + batch_sum_j) 更新，
+    学习率随该中心累计样本数递减（与sklearn MiniBatchKMeans的更新规则一致）
+    """
+
+    def __init__(self, n_clusters: int = 8, batch_size: int = 1024, max_iter: int = 100, n_init: int = 3,
+                 init_size: int = None, max_no_improvement: int = 10, tol: float = 0.0,
+                 reassignment_ratio: float = 0.01, random_state: int = None, block_rows: int = BLOCK_ROWS,
+                 verbose: bool = False, init: np.ndarray = None):
+        self.n_clusters = n_clusters
+        self.init = init  # None为k-means++；(n_clusters, dim)数组为给定的初始中心（热启动，忽略n_init）
+        self.batch_size = batch_size
+        self.max_iter = max_iter
+        self.n_init = n_init
+        self.init_size = init_size
+        self.max_no_improvement = max_no_improvement
+        self.tol = tol
+        self.reassignment_ratio = reassignment_ratio
+        self.random_state = random_state
+        self.block_rows = block_rows
+        self.verbose = verbose
+        self._rng = None
+
+    def _init_centers(self, X: np.ndarray, sample_weight: np.ndarray = None):
+        """在初始化样本上做n_init次k-means++，按验证样本上的余弦距离和挑选最优（给定init时直接使用）"""
+        self.counts_ = np.zeros(self.n_clusters, dtype=np.float64)
+        self.n_steps_ = 0
+        if self.init is not None:
+            self.cluster_centers_ = normalize_rows(np.array(self.init, dtype=np.float32))
+            return
+        init_size = self.init_size or min(len(X), max(3 * self.batch_size, 3 * self.n_clusters))
+        validation, validation_weights = _init_sample(X, init_size, self._rng, sample_weight)
+        best_centers, best_cost = None, None
+        for _ in range(max(1, self.n_init)):
+            init, init_weights = _init_sample(X, init_size, self._rng, sample_weight)
+            centers = kmeanspp_init(init, self.n_clusters, self._rng, sample_weight=init_weights)
+            cost = _cosine_cost((validation @ centers.T).max(axis=1), validation_weights)
+            if best_cost is None or cost < best_cost:
+                best_centers, best_cost = centers, cost
+        self.cluster_centers_ = best_centers
+
+    def _update(self, batch: np.ndarray, weights: np.ndarray = None) -> float:
+        """用一个已归一化的批次（可带样本权重）更新中心，返回批次的（加权）平均余弦距离"""
+        scores = batch @ self.cluster_centers_.T
+        labels = scores.argmax(axis=1)
+        best_sims = scores[np.arange(len(batch)), labels]
+        if weights is None:
+            batch_cost = float(1.0 - best_sims.mean())
+        else:
+            batch_cost = _cosine_cost(best_sims, weights) / float(weights.sum())
+        batch_counts = np.bincount(labels, weights=weights, minlength=self.n_clusters)
+        one_hot = np.zeros((len(batch), self.n_clusters), dtype=np.float32)
+        one_hot[np.arange(len(batch)), labels] = 1.0 if weights is None else weights
+        batch_sums = one_hot.T @ batch
+        hit = batch_counts > 0
+        sums = self.cluster_centers_[hit] * self.counts_[hit, None].astype(np.float32) + batch_sums[hit]
+        self.cluster_centers_[hit] = normalize_rows(sums)
+        self.counts_ += batch_counts
+        self.n_steps_ += 1
+        if self.reassignment_ratio and self.n_steps_ % REASSIGN_EVERY == 0:
+            self._reassign_starved(batch, scores.max(axis=1))
+        return batch_cost
+
+    def _reassign_starved(self, batch: np.ndarray, best_sims: np.ndarray):
+        """累计样本数过少的中心（陷入空区域）重新放到当前批次中拟合较差的样本上"""
+        starved = np.where(self.counts_ < self.reassignment_ratio * self.counts_.max())[0]
+        starved = starved[:len(batch) // 2]
+        if not len(starved):
+            return
+        weights = np.maximum(1.0 - best_sims, 0).astype(np.float64)
+        total = weights.sum()
+        picks = self._rng.choice(len(batch), len(starved), replace=False,
+                                 p=weights / total if total > 0 else None)
+        self.cluster_centers_[starved] = batch[picks]
+        self.counts_[starved] = 0  # 下一个批次直接移动到其捕获样本的均值方向
+        if self.verbose:
+            print(f"    重新分配 {len(starved)} 个样本过少的中心")
+
+    def partial_fit(self, X: np.ndarray, y=None, sample_weight: np.ndarray = None) -> 'MiniBatchSphericalKMeans':
+        """用一个批次（可为未归一化向量）增量更新；首次调用时在该批次上初始化中心"""
+        if self._rng is None:
+            self._rng = np.random.RandomState(self.random_state)
+        batch = normalize_rows(X)
+        weights = _as_weights(sample_weight)
+        if not hasattr(self, 'cluster_centers_'):
+            self._init_centers(batch, weights)
+        self._update(batch, weights)
+        return self
+
+    def fit(self, X: np.ndarray, y=None, sample_weight: np.ndarray = None) -> 'MiniBatchSphericalKMeans':
+        self._rng = np.random.RandomState(self.random_state)
+        weights = _as_weights(sample_weight)
+        self._init_centers(X, weights)
+        n_batches = max(1, int(np.ceil(len(X) / self.batch_size)))
+        ewa_cost, best_cost, no_improvement = None, None, 0
+        alpha = min(1.0, 2.0 * self.batch_size / (len(X) + 1))
+        for step in range(self.max_iter * n_batches):
+            # 批内索引排序，memmap上顺序读取
+            indices = np.sort(self._rng.choice(len(X), min(self.batch_size, len(X)), replace=False))
+            cost = self._update(normalize_rows(X[indices]), None if weights is None else weights[indices])
+            ewa_cost = cost if ewa_cost is None else ewa_cost * (1 - alpha) + cost * alpha
+            if self.verbose and step % n_batches == 0:
+                print(f"    批次 {step}: 平均余弦距离(EWA)={ewa_cost:.6f}")
+            if best_cost is None or ewa_cost < best_cost - self.tol:
+                best_cost, no_improvement = ewa_cost, 0
+            else:
+                no_improvement += 1
+                if self.max_no_improvement and no_improvement >= self.max_no_improvement:
+                    break
+        self.n_iter_ = self.n_steps_ / n_batches
+        self.labels_, sims = assign_blocked(X, self.cluster_centers_, self.block_rows, normalize=True)
+        self.inertia_ = _cosine_cost(sims, weights)
+        return self
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return assign_blocked(X, self.cluster_centers_, self.block_rows, normalize=True)[0]
+
+    def fit_predict(self, X: np.ndarray, y=None, sample_weight: np.ndarray = None) -> np.ndarray:
+        return self.fit(X, sample_weight=sample_weight).labels_
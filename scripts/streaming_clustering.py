@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+超出内存的流式聚类（out-of-core）
+- 从memmap存储（<base>.npy）或尚未合并的分段文件（<base>.segment.f32）按块读取，不把整个矩阵载入内存
+- 第一遍: 按随机的块顺序把小批量送入 partial_fit（MiniBatchKMeans 或 MiniBatchSphericalKMeans）
+- 第二遍: 按块计算标签和与中心的余弦相似度，写入分配结果（磁盘上的.npy memmap），同时维护每个簇的top-N代表样本
+- 内存占用只与块大小、k、top_n有关，与数据行数无关
+"""
+import csv
+import json
+import os
+import sys
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+from cluster_assignments import write_assignments
+from embedding_store import load_ids, store_exists, store_paths
+from spherical_kmeans import normalize_rows
+
+# 增加CSV字段大小限制
+csv.field_size_limit(sys.maxsize)
+
+BLOCK_ROWS = 65536
+
+
+def open_streaming_matrix(path: str) -> np.ndarray:
+    """以memmap方式打开embedding矩阵：优先使用合并后的.npy，其次使用已提交的分段文件"""
+    paths = store_paths(path)
+    if store_exists(path):
+        return np.load(paths['matrix'], mmap_mode='r')  # 不解析索引JSON（其中的ids每个都是Python对象）
+    if os.path.exists(paths['checkpoint']):
+        with open(paths['checkpoint'], 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        print(f"使用尚未合并的分段文件: {paths['segment']} ({checkpoint['vectors']} 条已提交)")
+        return np.memmap(paths['segment'], dtype=np.float32, mode='r',
+                         shape=(checkpoint['vectors'], checkpoint['dim']))
+    raise FileNotFoundError(f"流式模式需要二进制存储或分段文件: {path}（旧的JSON文件请先用embedding_store.py转换）")
+
+
+def load_row_records(path: str, rows: Iterable[int], csv_file: str = None) -> Dict[int, Dict]:
+    """
+    只读取指定行的id和output（用于代表样本），返回 行号 -> {'id', 'output'}
+    有原始CSV时按id流式查找完整output，否则使用存储中的预览文本
+    """
+    wanted = set(int(row) for row in rows)
+    records = {}
+    paths = store_paths(path)
+    if store_exists(path):
+        ids = load_ids(path)
+        previews = None
+        if os.path.exists(paths['previews']):
+            with open(paths['previews'], 'r', encoding='utf-8') as f:
+                previews = json.load(f)
+        for row in wanted:
+            records[row] = {'id': str(ids[row]), 'output': previews[row] if previews else ''}
+        del ids, previews
+    else:
+        with open(paths['segment_index'], 'r', encoding='utf-8') as f:
+            for row, line in enumerate(f):
+                if row in wanted:
+                    record = json.loads(line)
+                    records[row] = {'id': record['id'], 'output': record.get('output', '')}
+
+    if csv_file and os.path.exists(csv_file):
+        by_id = {record['id'].strip('"'): record for record in records.values() if record['id']}
+        with open(csv_file, 'r', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                record = by_id.get(row.get('id', '').strip('"'))
+                if record is not None and row.get('output'):
+                    record['output'] = row['output']
+    return records
+
+
+def stream_fit(matrix: np.ndarray, model, block_rows: int = BLOCK_ROWS, batch_size: int = 1000,
+               epochs: int = 1, init_size: int = 10000, seed: int = 42):
+    """
+    第一遍：先用随机抽取的init_size行初始化中心，再按随机块顺序逐批partial_fit
+    每个块内部打乱后切成batch_size大小的小批量，块本身是连续读取
+    """
+    rng = np.random.RandomState(seed)
+    n = len(matrix)
+    init_rows = np.sort(rng.choice(n, min(init_size, n), replace=False))
+    model.partial_fit(normalize_rows(matrix[init_rows]))
+
+    block_starts = np.arange(0, n, block_rows)
+    for epoch in range(epochs):
+        seen = 0
+        for block_number, start in enumerate(rng.permutation(block_starts)):
+            block = normalize_rows(matrix[start:start + block_rows])
+            order = rng.permutation(len(block))
+            for batch_start in range(0, len(block), batch_size):
+                model.partial_fit(block[order[batch_start:batch_start + batch_size]])
+            seen += len(block)
+            if (block_number + 1) % 10 == 0 or seen == n:
+                print(f"  第 {epoch + 1}/{epochs} 轮: 已训练 {seen}/{n} 行")
+    return model
+
+
+def load_row_ids(path: str) -> np.ndarray:
+    """
+    按行顺序返回定长unicode的id数组，不为每个id保留Python对象
+    二进制存储以memmap打开.ids.npy；分段文件逐行读两遍（先求行数和最长id，再填入预分配的数组）
+    """
+    if store_exists(path):
+        return load_ids(path)
+    segment_index = store_paths(path)['segment_index']
+    n, width = 0, 1
+    with open(segment_index, 'r', encoding='utf-8') as f:
+        for line in f:
+            n += 1
+            width = max(width, len(json.loads(line)['id']))
+    ids = np.empty(n, dtype=f'<U{width}')
+    with open(segment_index, 'r', encoding='utf-8') as f:
+        for row, line in enumerate(f):
+            ids[row] = json.loads(line)['id']
+    return ids
+
+
+def stream_assign(matrix: np.ndarray, centers: np.ndarray, ids: np.ndarray, output_base: str, top_n: int = 10,
+                  metadata: Dict = None, farthest_n: int = 0,
+                  block_rows: int = BLOCK_ROWS) -> Tuple[np.ndarray, np.ndarray, Dict[int, List[int]], Dict[int, List[int]]]:
+    """
+    第二遍：按块分配标签、与所属/第二近中心的相似度，写入分配结果（见cluster_assignments.py，列为memmap），
+    同时合并出每个簇相似度最高的top_n行和最低的farthest_n行，返回 (labels, similarities, top, farthest)
+    """
+    columns, top, farthest = write_assignments(output_base, matrix, centers, ids, metadata=metadata, top_n=top_n,
+                                               farthest_n=farthest_n, block_rows=block_rows)
+    return columns['labels'], columns['similarity'], top, farthest
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+流水线式的聚类摘要生成
+- 后台线程运行asyncio事件循环，代表样本一确定就提交摘要请求，主线程继续做质量计算等工作
+- 限制在途请求数（信号量）并按每分钟请求数限流（令牌桶，见gemini_client.TokenBucket），代替逐个调用后sleep
+- 429/5xx/超时按指数退避重试（见gemini_client的重试策略），仍失败的聚类单独记录在failures中，
+  result返回None，由调用方决定如何报告和处理（不把占位文本当作摘要）
+- 每个摘要完成时立即追加到进度文件（JSONL），中途中断也不会丢失已生成的摘要
+总耗时接近 max(计算, LLM调用) 而不是两者之和
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from gemini_client import TokenBucket, is_transient_error, retry_delay, retry_limit
+
+DEFAULT_SUMMARY_CONCURRENCY = 8
+DEFAULT_SUMMARY_RPM = 120  # 与原来每次调用后sleep 0.5秒的速率相同
+DEFAULT_SUMMARY_RETRIES = 3  # 5xx/超时的最多重试次数（429按gemini_client.RATE_LIMIT_RETRIES）
+
+
+class SummaryPipeline:
+    """在后台事件循环中并发生成摘要；submit立即返回，result按聚类等待结果（失败时为None，原因见failures）"""
+
+    def __init__(self, summarize: Callable[[List[Dict]], Awaitable[str]],
+                 concurrency: int = DEFAULT_SUMMARY_CONCURRENCY, requests_per_minute: int = DEFAULT_SUMMARY_RPM,
+                 progress_file: str = None, max_retries: int = DEFAULT_SUMMARY_RETRIES):
+        self.summarize = summarize
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.futures = {}
+        self.failures = {}  # 聚类 -> 最终错误信息
+        self.submitted = 0  # 在调度前计数，协程可能在futures登记之前就已完成
+        self.completed = 0
+        self.started = time.time()
+        self.progress = None
+        if progress_file:
+            os.makedirs(os.path.dirname(progress_file) or '.', exist_ok=True)
+            self.progress = open(progress_file, 'w', encoding='utf-8')
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(), self.loop).result()
+
+    async def _setup(self):
+        # 信号量和令牌桶需要在事件循环所在的线程中创建
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.bucket = TokenBucket(self.requests_per_minute)
+
+    async def _summarize_with_retry(self, cluster_id: int, samples: List[Dict]) -> str:
+        """限流后调用summarize，可重试的错误按指数退避重试，其余错误或重试用尽时抛出"""
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                return await self.summarize(samples)
+            except Exception as e:
+                if not is_transient_error(e) or attempt >= retry_limit(e, self.max_retries):
+                    raise
+                delay = retry_delay(e, attempt)
+                print(f"  聚类 {cluster_id} 摘要请求失败，{delay:.0f}s后重试: {e}")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _run(self, cluster_id: int, samples: List[Dict], extra: Dict) -> str:
+        async with self.semaphore:
+            try:
+                summary = await self._summarize_with_retry(cluster_id, samples)
+            except Exception as e:
+                summary = None
+                self.failures[cluster_id] = str(e)
+        self.completed += 1
+        if self.progress:
+            record = {'cluster_id': cluster_id, **extra, 'summary': summary}
+            if summary is None:
+                record['summary_error'] = self.failures[cluster_id]
+            self.progress.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.progress.flush()
+        outcome = '摘要完成' if summary is not None else f"摘要失败: {self.failures[cluster_id]}"
+        print(f"  聚类 {cluster_id} {outcome} ({self.completed}/{self.submitted}, "
+              f"{time.time() - self.started:.1f}s)")
+        return summary
+
+    def submit(self, cluster_id: int, samples: List[Dict], extra: Dict = None):
+        """提交一个聚类的摘要请求（extra为写入进度文件的附加字段，如stable_id）"""
+        self.submitted += 1
+        self.futures[cluster_id] = asyncio.run_coroutine_threadsafe(
+            self._run(cluster_id, samples, extra or {}), self.loop)
+
+    def result(self, cluster_id: int) -> Optional[str]:
+        """等待并返回一个聚类的摘要；重试后仍失败时返回None（错误信息在failures[cluster_id]）"""
+        return self.futures[cluster_id].result()
+
+    def close(self) -> float:
+        """等待全部请求完成并停止事件循环，返回从创建到完成的秒数"""
+        for future in self.futures.values():
+            future.result()
+        elapsed = time.time() - self.started
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        if self.progress:
+            self.progress.close()
+        return elapsed